@@ -1,2 +1,2 @@
-from .model import build_model
-from .data import build_stan_data
+from .model import build_model, load_model, ValidationException
+from .data import build_stan_data, StanDataBuilder
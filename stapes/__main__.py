@@ -0,0 +1,36 @@
+import argparse
+import sys
+
+from .serve.client import main as client_main
+
+
+def main():
+    # `python -m stapes` imports the whole package before getting here, so `client` is a
+    # convenience. Running stapes/serve/client.py as a script skips that import and only costs
+    # interpreter startup on top of the request itself.
+    if len(sys.argv) > 1 and sys.argv[1] == "client":
+        client_main(sys.argv[2:], prog="python -m stapes client")
+        return
+
+    parser = argparse.ArgumentParser(prog="python -m stapes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser(
+        "serve",
+        help="Keep models and fits in memory and answer requests on a Unix socket",
+    )
+    serve_parser.add_argument("socket", help="Path of the Unix socket to listen on")
+    serve_parser.add_argument("--max-models", type=int, default=32)
+    serve_parser.add_argument("--max-fits", type=int, default=8)
+    commands.add_parser(
+        "client",
+        help="Send a request to a running server (run stapes/serve/client.py directly to skip "
+        "importing Stapes)",
+    )
+    args = parser.parse_args()
+
+    from .serve import serve
+    serve(args.socket, max_models=args.max_models, max_fits=args.max_fits)
+
+
+if __name__ == "__main__":
+    main()
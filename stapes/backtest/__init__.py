@@ -0,0 +1,3 @@
+from .splits import Fold, make_folds, frame_to_data
+from .scoring import score_predictions, crps
+from .harness import run_backtest
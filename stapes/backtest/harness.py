@@ -0,0 +1,135 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Any, Optional, Sequence, Union
+
+import pandas as pd
+
+from ..model import Model
+from .splits import Fold, make_folds
+from .scoring import score_predictions
+
+
+def run_backtest(
+    models: Dict[str, Model],
+    frame: pd.DataFrame,
+    cutoffs: Sequence[int],
+    configs: Optional[Dict[str, Dict[str, Any]]] = None,
+    responses: Sequence[str] = ("ReportedLoss",),
+    inputs: Sequence[str] = (),
+    per_triangle: bool = False,
+    backend: str = "stan",
+    max_workers: Optional[int] = None,
+    checkpoint_dir: Optional[Union[str, Path]] = None,
+    seed: Optional[int] = None,
+    interval: float = 0.9,
+    **kwargs,
+) -> pd.DataFrame:
+    """Run a rolling-origin backtest of several model variants.
+
+    Every variant in `models` is fitted to every fold from `make_folds` and scored with
+    `score_predictions`, using the matching entry of `configs` as its configuration and passing
+    `kwargs` on to `Model.fit`. Each variant's Stan program is compiled once up front, then jobs
+    run in a thread pool, each fitting the shared variant into its own `FittedModel`; the heavy
+    lifting happens in CmdStan subprocesses or in NumPy, so threads run concurrently.
+
+    If `checkpoint_dir` is given, the result of each finished job is saved there, and jobs with
+    a saved result are skipped when the backtest is run again. Returns one row per job with its
+    scores and timings; failed jobs have an `error` and are retried on the next run.
+    """
+    configs = configs or {}
+    folds = make_folds(frame, cutoffs, responses, inputs, per_triangle)
+    jobs = [(variant, fold) for variant in models for fold in folds]
+    checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir is not None else None
+    if checkpoint_dir is not None:
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    records = []
+    pending = []
+    for ndx, (variant, fold) in enumerate(jobs):
+        checkpoint = _checkpoint_file(checkpoint_dir, variant, fold)
+        if checkpoint is not None and checkpoint.exists():
+            records.append(json.loads(checkpoint.read_text()))
+        else:
+            pending.append((ndx, variant, fold))
+
+    if backend == "stan":
+        # Compile each variant's program once, before any threads need the executable. Programs
+        # that depend on the training data can only be compiled per fold.
+        for variant in set([variant for _, variant, _ in pending]):
+            if not models[variant].awaits_data:
+                models[variant].stan_model
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _run_job,
+                models[variant],
+                configs.get(variant, {}),
+                variant,
+                fold,
+                backend,
+                None if seed is None else seed + ndx,
+                interval,
+                kwargs,
+            ): (variant, fold)
+            for ndx, variant, fold in pending
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            variant, fold = futures[future]
+            checkpoint = _checkpoint_file(checkpoint_dir, variant, fold)
+            if checkpoint is not None and "error" not in record:
+                _write_checkpoint(checkpoint, record)
+
+    result = pd.DataFrame.from_records(records)
+    result = result.sort_values(["variant", "triangle", "cutoff"], na_position="first")
+    return result.reset_index(drop=True)
+
+
+def _run_job(
+    model: Model,
+    config: Dict[str, Any],
+    variant: str,
+    fold: Fold,
+    backend: str,
+    seed: Optional[int],
+    interval: float,
+    fit_kwargs: Dict[str, Any],
+) -> Dict[str, Any]:
+    record = {"variant": variant, "cutoff": fold.cutoff, "triangle": fold.triangle}
+    try:
+        if seed is not None:
+            fit_kwargs = {**fit_kwargs, "seed": seed}
+
+        start = time.perf_counter()
+        fitted = model.fit(fold.train_data, config, backend=backend, **fit_kwargs)
+        record["fit_time"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictions = fitted.predict(fold.test_coords, fold.test_data, seed=seed)
+        record["predict_time"] = time.perf_counter() - start
+
+        record.update(score_predictions(predictions, fold.actuals, interval))
+    except Exception as e:
+        record["error"] = f"{e.__class__.__name__}: {e}"
+    return record
+
+
+def _checkpoint_file(
+    checkpoint_dir: Optional[Path], variant: str, fold: Fold
+) -> Optional[Path]:
+    if checkpoint_dir is None:
+        return None
+    triangle = "all" if fold.triangle is None else fold.triangle
+    return checkpoint_dir / f"{variant}__cutoff{fold.cutoff}__triangle{triangle}.json"
+
+
+def _write_checkpoint(checkpoint: Path, record: Dict[str, Any]):
+    # Write to a temporary name first so an interrupted run never leaves a partial checkpoint
+    tmp_file = checkpoint.with_name(f".{checkpoint.name}.{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(record))
+    os.replace(tmp_file, checkpoint)
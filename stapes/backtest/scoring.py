@@ -0,0 +1,44 @@
+from typing import Dict, Mapping
+
+import numpy as np
+
+from ..data import DataCoords
+
+
+def crps(draws: np.ndarray, actuals: np.ndarray) -> np.ndarray:
+    """Continuous ranked probability score of each row of (cells x draws) predictive draws.
+
+    Uses the sample estimate E|X - y| - E|X - X'| / 2, with the second term computed from
+    sorted draws in O(draws log draws).
+    """
+    num_draws = draws.shape[1]
+    sorted_draws = np.sort(draws, axis=1)
+    weights = 2 * np.arange(1, num_draws + 1) - num_draws - 1
+    spread = 2 * (sorted_draws @ weights) / num_draws ** 2
+    return np.mean(np.abs(draws - actuals[:, None]), axis=1) - spread / 2
+
+
+def score_predictions(
+    predictions: Mapping[DataCoords, np.ndarray],
+    actuals: Dict[DataCoords, float],
+    interval: float = 0.9,
+) -> Dict[str, float]:
+    """Score predictive draws against the actuals of every cell that has one.
+
+    Returns the RMSE and MAE of the predictive mean, the mean CRPS, and the coverage of the
+    central `interval` predictive interval.
+    """
+    coords = [coord for coord in actuals if coord in predictions]
+    if not coords:
+        return {"num_cells": 0}
+    draws = np.stack([np.asarray(predictions[coord], dtype=float) for coord in coords])
+    observed = np.asarray([actuals[coord] for coord in coords])
+    errors = draws.mean(axis=1) - observed
+    lower, upper = np.quantile(draws, [(1 - interval) / 2, (1 + interval) / 2], axis=1)
+    return {
+        "num_cells": len(coords),
+        "rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "mae": float(np.mean(np.abs(errors))),
+        "crps": float(np.mean(crps(draws, observed))),
+        "coverage": float(np.mean((observed >= lower) & (observed <= upper))),
+    }
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ..data import DataCoords
+
+# Columns identifying a cell in a long-format triangle dataset
+CELL_COLUMNS = ["TriangleId", "ExpPeriodId", "DevLagId"]
+
+
+@dataclass
+class Fold(object):
+    """One rolling-origin split: train on cells with `CalendarId <= cutoff`, predict the rest.
+
+    Fields:
+        cutoff: The last calendar period in the training data.
+        triangle: The triangle the fold is restricted to, or None for all triangles.
+        train_data: Training data, keyed by data coordinates.
+        test_data: Values of the input (non-response) variables in the test cells.
+        test_coords: The response cells to predict.
+        actuals: Observed values of the test cells that have them, for scoring.
+    """
+
+    cutoff: int
+    triangle: Optional[int]
+    train_data: Dict[DataCoords, float]
+    test_data: Dict[DataCoords, float]
+    test_coords: List[DataCoords]
+    actuals: Dict[DataCoords, float]
+
+
+def frame_to_data(frame: pd.DataFrame, variables: Sequence[str]) -> Dict[DataCoords, float]:
+    """Convert a long-format dataset, with one row per cell, into Stapes data, dropping
+    missing values."""
+    long_frame = _melt(frame, variables)
+    return _to_data(long_frame)
+
+
+def make_folds(
+    frame: pd.DataFrame,
+    cutoffs: Sequence[int],
+    responses: Sequence[str],
+    inputs: Sequence[str],
+    per_triangle: bool = False,
+) -> List[Fold]:
+    """Build rolling-origin folds from a long-format dataset with a `CalendarId` column.
+
+    Response variables are predicted in every cell after the cutoff whose experience period has
+    training data; input variables are known everywhere. Folds with nothing to predict are
+    skipped.
+    """
+    cells = frame[CELL_COLUMNS + ["CalendarId"]].drop_duplicates(CELL_COLUMNS)
+    long_frame = _melt(frame, list(responses) + list(inputs)).merge(cells, on=CELL_COLUMNS)
+    is_response = long_frame["name"].isin(responses).to_numpy()
+
+    triangles = sorted(frame["TriangleId"].unique()) if per_triangle else [None]
+    folds = []
+    for triangle in triangles:
+        in_triangle = (
+            np.ones(len(long_frame), dtype=bool) if triangle is None
+            else (long_frame["TriangleId"] == triangle).to_numpy()
+        )
+        cells_in_triangle = cells if triangle is None else cells[cells["TriangleId"] == triangle]
+        for cutoff in cutoffs:
+            is_train = in_triangle & (long_frame["CalendarId"] <= cutoff).to_numpy()
+            is_test = in_triangle & ~is_train
+            # Only experience periods with training data can be projected forward
+            is_seen = cells_in_triangle.set_index(["TriangleId", "ExpPeriodId"]).index.isin(
+                pd.MultiIndex.from_frame(long_frame.loc[is_train, ["TriangleId", "ExpPeriodId"]])
+            )
+            test_cells = cells_in_triangle[
+                (cells_in_triangle["CalendarId"] > cutoff).to_numpy() & is_seen
+            ]
+            if len(test_cells) == 0:
+                continue
+            test_coords = [
+                (name, int(tri_id), int(exp_id), int(dev_id))
+                for name in responses
+                for tri_id, exp_id, dev_id in test_cells[CELL_COLUMNS].itertuples(index=False)
+            ]
+            folds.append(Fold(
+                cutoff=int(cutoff),
+                triangle=None if triangle is None else int(triangle),
+                train_data=_to_data(long_frame[is_train]),
+                test_data=_to_data(long_frame[is_test & ~is_response]),
+                test_coords=test_coords,
+                actuals=_to_data(long_frame[is_test & is_response]),
+            ))
+    return folds
+
+
+def _melt(frame: pd.DataFrame, variables: Sequence[str]) -> pd.DataFrame:
+    long_frame = frame.melt(
+        id_vars=CELL_COLUMNS, value_vars=list(variables), var_name="name", value_name="value"
+    )
+    return long_frame[long_frame["value"].notna()]
+
+
+def _to_data(long_frame: pd.DataFrame) -> Dict[DataCoords, float]:
+    return {
+        (name, int(tri_id), int(exp_id), int(dev_id)): float(value)
+        for name, tri_id, exp_id, dev_id, value in zip(
+            long_frame["name"],
+            long_frame["TriangleId"],
+            long_frame["ExpPeriodId"],
+            long_frame["DevLagId"],
+            long_frame["value"],
+        )
+    }
@@ -0,0 +1,10 @@
+from .synthetic import synthetic_triangles
+from .regression import compare_efficiency
+from .parser import (
+    PARSER_CORPUS,
+    random_model_source,
+    mutate_source,
+    differential_corpus,
+    compare_parsers,
+    benchmark_parsers,
+)
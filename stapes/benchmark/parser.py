@@ -0,0 +1,178 @@
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..parse import parse_text_fast, parse_text_reference
+
+# Hand-written sources covering every rule of the grammar, and the ways each can go wrong
+PARSER_CORPUS = [
+    # Valid
+    "X mean = 1;",
+    "X mean = 2.5;",
+    "X variance = :a;",
+    "X mean = Y;",
+    "X mean = Y.prev_dev.prev_exp;",
+    "X mean = Y.prev_exp.prev_dev;",
+    "X mean = log(Y);",
+    "X mean = exp(:a + :b * Y);",
+    "X mean = :a - :b - :c;",
+    "X mean = :a / :b * :c;",
+    "X mean = 1 + 2 * 3 ^ 4;",
+    "X mean = -:a;",
+    "X mean = -:a ^ 2;",
+    "X mean = 2 ^ -:a;",
+    "X mean = :a * -:b;",
+    "X mean = :a - -:b;",
+    "X mean = -(:a + :b) * (Y - 1.25);",
+    "X mean = ((((:a))));",
+    "X mean = log(exp(sqrt(Y.prev_dev)));",
+    "X  mean\t=\n:a\n;\n",
+    "real :a = scalar();",
+    "pos :a = vector(group=DevLagId);",
+    "real :a = factor(group=TriangleId, is_centered=false, parameterization=auto);",
+    "real :a = scalar(loc=1.5, scale=2);",
+    "pos :ata = vector(group=DevLagId);\nX mean = X.prev_dev * :ata;\nX variance = :s * X;",
+    # Invalid
+    "",
+    ";",
+    "X mean = 1",
+    "X mean 1;",
+    "X median = 1;",
+    "X meanx = 1;",
+    "x mean = 1;",
+    "X mean = --:a;",
+    "X mean = :a ^ :b ^ :c;",
+    "X mean = :a +;",
+    "X mean = (:a;",
+    "X mean = :a);",
+    "X mean = log Y;",
+    "X mean = log();",
+    "X mean = foo;",
+    "X mean = 1.;",
+    "X mean = .5;",
+    "X mean = 1.2.3;",
+    "X mean = Y.Prev;",
+    "X mean = Y_z;",
+    "X mean = : a;",
+    "X mean = :A;",
+    "X mean = 1;\r\n",
+    "real :a = scalar(;",
+    "real :a = scalar(x=);",
+    "real :a = scalar(x=1,);",
+    "real :a = scalar(x=:b);",
+    "real a = scalar();",
+    ":a = scalar();",
+]
+
+_FUNCTIONS = ["log", "exp", "sqrt"]
+_MODIFIERS = ["prev_dev", "prev_exp"]
+
+
+def random_model_source(num_statements: int, seed: int = 0, max_depth: int = 4) -> str:
+    """Generate a syntactically valid model source with a mix of parameter and likelihood
+    statements, such as a large programmatically generated portfolio model might have."""
+    rng = np.random.default_rng(seed)
+    statements = []
+    for ndx in range(num_statements):
+        if rng.random() < 0.2:
+            statements.append(
+                f"real :p{ndx} = factor(group=TriangleId, scale={rng.integers(1, 10)}.5);"
+            )
+        else:
+            aspect = "mean" if rng.random() < 0.5 else "variance"
+            statements.append(f"V{ndx} {aspect} = {_random_expression(rng, max_depth)};")
+    return "\n".join(statements)
+
+
+def mutate_source(text: str, num_mutations: int, seed: int = 0) -> List[str]:
+    """Variants of `text` with one character deleted, duplicated or replaced, most of which
+    are invalid in ways that exercise the parsers' error handling."""
+    rng = np.random.default_rng(seed)
+    alphabet = "abXY:._ -+*/^();=0123456789\t\n"
+    result = []
+    for _ in range(num_mutations):
+        pos = int(rng.integers(len(text)))
+        choice = rng.integers(3)
+        if choice == 0:
+            result.append(text[:pos] + text[pos + 1:])
+        elif choice == 1:
+            result.append(text[:pos] + text[pos] + text[pos:])
+        else:
+            result.append(text[:pos] + alphabet[rng.integers(len(alphabet))] + text[pos + 1:])
+    return result
+
+
+def compare_parsers(texts: Sequence[str]) -> List[str]:
+    """Parse every text with both parsers, and describe each one where they disagree: one
+    accepts the text and the other doesn't, or both accept it with different results."""
+    disagreements = []
+    for text in texts:
+        reference, reference_error = _try_parse(parse_text_reference, text)
+        fast, fast_error = _try_parse(parse_text_fast, text)
+        if (reference_error is None) != (fast_error is None):
+            reference_result = reference_error or "accepts"
+            fast_result = fast_error or "accepts"
+            disagreements.append(f"{text!r}: reference {reference_result}, fast {fast_result}")
+        elif reference != fast:
+            disagreements.append(f"{text!r}: reference {reference}, fast {fast}")
+    return disagreements
+
+
+def differential_corpus(num_random: int = 200, seed: int = 0) -> List[str]:
+    """The hand-written corpus, plus random valid sources and mutations of them."""
+    texts = list(PARSER_CORPUS)
+    for ndx in range(num_random):
+        source = random_model_source(3, seed=seed + ndx)
+        texts.append(source)
+        texts += mutate_source(source, 3, seed=seed + ndx)
+    return texts
+
+
+def benchmark_parsers(
+    num_statements: int = 10_000, seed: int = 0, text: Optional[str] = None
+) -> Dict[str, float]:
+    """Time both parsers on a large generated source (or on `text`), returning the seconds each
+    took and the speedup of the fast parser over the reference."""
+    text = text if text is not None else random_model_source(num_statements, seed)
+    timings = {}
+    results = {}
+    for name, parse in [("reference", parse_text_reference), ("fast", parse_text_fast)]:
+        start = time.perf_counter()
+        results[name] = parse(text)
+        timings[name] = time.perf_counter() - start
+    if results["reference"] != results["fast"]:
+        raise Exception("The parsers disagree on the benchmark source")
+    timings["speedup"] = timings["reference"] / timings["fast"]
+    return timings
+
+
+def _random_expression(rng: np.random.Generator, depth: int) -> str:
+    choice = rng.integers(8) if depth > 0 else rng.integers(3)
+    if choice == 0:
+        return f":p{rng.integers(100)}"
+    elif choice == 1:
+        modifiers = "".join([f".{m}" for m in _MODIFIERS if rng.random() < 0.3])
+        return f"V{rng.integers(100)}{modifiers}"
+    elif choice == 2:
+        if rng.random() < 0.5:
+            return str(rng.integers(10))
+        return f"{rng.integers(10)}.{rng.integers(100)}"
+    elif choice in (3, 4):
+        op = "+-*/"[rng.integers(4)]
+        return f"{_random_expression(rng, depth - 1)} {op} {_random_expression(rng, depth - 1)}"
+    elif choice == 5:
+        return f"{_random_expression(rng, 0)} ^ {_random_expression(rng, 0)}"
+    elif choice == 6:
+        return f"-{_random_expression(rng, 0)}"
+    else:
+        name = _FUNCTIONS[rng.integers(len(_FUNCTIONS))]
+        inner = _random_expression(rng, depth - 1)
+        return f"{name}({inner})" if rng.random() < 0.5 else f"({inner})"
+
+
+def _try_parse(parse, text):
+    try:
+        return parse(text), None
+    except Exception as e:
+        return None, e.__class__.__name__
@@ -0,0 +1,59 @@
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from ..data import DataCoords, DataValue
+from ..model import Model
+
+# Efficiency measures that are compared against the baseline variant
+COMPARED_COLUMNS = ["ess_bulk_per_second", "ess_tail_per_second", "gradients_per_draw"]
+
+
+def compare_efficiency(
+    models: Dict[str, Model],
+    train_data: Dict[DataCoords, DataValue],
+    config: Dict[str, Any],
+    baseline: Optional[str] = None,
+    tolerance: float = 0.8,
+    seed: int = 0,
+    **kwargs,
+) -> pd.DataFrame:
+    """Compare the sampling efficiency of model variants, such as alternative stem
+    parameterizations, on the same data.
+
+    Every variant in `models` is fitted with CmdStan to `train_data` with the same
+    configuration and seed, passing `kwargs` on to `Model.fit`. Variants are fitted one at a
+    time, so they don't compete for cores and their timings are comparable. Returns one row per
+    variant and core component of each parameter, such as a factor's `__sigma`, with the
+    columns of `EfficiencyReport.to_frame`.
+
+    If `baseline` names one of the variants, each compared measure is also given relative to
+    the baseline's value for the same component, and `is_regression` flags rows whose ESS per
+    second (bulk or tail) falls below `tolerance` times the baseline's.
+    """
+    if baseline is not None and baseline not in models:
+        raise KeyError(f"Unrecognized baseline variant {baseline}")
+
+    frames = []
+    for variant, model in models.items():
+        fitted = model.fit(train_data, config, seed=seed, **kwargs)
+        frame = fitted.efficiency_report().to_frame()
+        frame.insert(0, "variant", variant)
+        frames.append(frame)
+    result = pd.concat(frames, ignore_index=True)
+
+    if baseline is not None:
+        baseline_values = (
+            result.loc[result["variant"] == baseline, ["parameter"] + COMPARED_COLUMNS]
+            .set_index("parameter")
+        )
+        for column in COMPARED_COLUMNS:
+            result[f"relative_{column}"] = (
+                result[column].to_numpy()
+                / baseline_values[column].reindex(result["parameter"]).to_numpy()
+            )
+        result["is_regression"] = (
+            (result["relative_ess_bulk_per_second"] < tolerance)
+            | (result["relative_ess_tail_per_second"] < tolerance)
+        )
+    return result
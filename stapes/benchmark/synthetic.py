@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+
+def synthetic_triangles(
+    num_triangles: int = 3,
+    num_periods: int = 10,
+    seed: int = 0,
+    loss_ratio: float = 0.7,
+    noise: float = 0.05,
+) -> pd.DataFrame:
+    """Simulate loss triangles in the same long format as `examples/example_triangles.csv`.
+
+    Each triangle has its own premium level and ultimate loss ratio. Reported and paid losses
+    develop towards the ultimate along fixed patterns, with lognormal noise on each link ratio
+    whose scale shrinks with development lag. The result covers the full square, so it can be
+    cut at any calendar period; it also has a `DevLag` column for use as a model input. The
+    same arguments always produce the same data.
+    """
+    rng = np.random.default_rng(seed)
+    dev_lags = np.arange(1, num_periods + 1)
+    reported_pattern = 1 - 0.8 * np.exp(-0.6 * (dev_lags - 1))
+    paid_pattern = reported_pattern * (1 - 0.6 * np.exp(-0.4 * (dev_lags - 1)))
+
+    rows = []
+    for tri_id in range(1, num_triangles + 1):
+        premium_level = np.exp(rng.normal(np.log(5.0), 0.3))
+        triangle_loss_ratio = loss_ratio * np.exp(rng.normal(0.0, 0.1))
+        for exp_id in range(1, num_periods + 1):
+            premium = premium_level * (1.03 ** (exp_id - 1))
+            ultimate = premium * triangle_loss_ratio * np.exp(rng.normal(0.0, 0.1))
+            # Cumulative development with noise on each link ratio, shrinking with maturity
+            link_noise = np.exp(rng.normal(0.0, noise / dev_lags))
+            reported = ultimate * reported_pattern * np.cumprod(link_noise)
+            paid = np.minimum(ultimate * paid_pattern * np.cumprod(link_noise), reported)
+            for dev_id in dev_lags:
+                rows.append({
+                    "TriangleId": tri_id,
+                    "DevLagId": dev_id,
+                    "ReportedLoss": reported[dev_id - 1],
+                    "PaidLoss": paid[dev_id - 1],
+                    "EarnedPremium": premium,
+                    "ExpPeriodId": exp_id,
+                    "CalendarId": exp_id + dev_id - 1,
+                    "DevLag": float(dev_id),
+                })
+    return pd.DataFrame(rows)
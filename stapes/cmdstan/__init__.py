@@ -0,0 +1,8 @@
+from .cache import stan_file_for, stan_data_file, run_data_file, executable_for, is_compiled
+from .process import compile_async, sample_async, FitEvent, EventCallback
+from .adaptive import (
+    sample_until_converged,
+    check_staged_kwargs,
+    ConvergenceTargets,
+    SamplingReport,
+)
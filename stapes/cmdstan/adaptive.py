@@ -0,0 +1,175 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Union
+
+import cmdstanpy as csp
+import numpy as np
+
+from ..diagnostics import summarize_convergence, ConvergenceSummary
+
+
+@dataclass
+class ConvergenceTargets(object):
+    """When staged sampling may stop.
+
+    Fields:
+        max_rhat: Largest acceptable rank-normalized split R-hat over all core parameters.
+        min_ess_bulk: Smallest acceptable bulk effective sample size.
+        min_ess_tail: Smallest acceptable tail effective sample size.
+        stage_draws: Post-warmup draws per chain added by each stage.
+        max_draws: Budget of post-warmup draws per chain, reached even if the targets aren't.
+    """
+
+    max_rhat: float = 1.01
+    min_ess_bulk: float = 400.0
+    min_ess_tail: float = 400.0
+    stage_draws: int = 250
+    max_draws: int = 4000
+
+    def are_met(self, summary: ConvergenceSummary) -> bool:
+        return (
+            summary.rhat <= self.max_rhat
+            and summary.ess_bulk >= self.min_ess_bulk
+            and summary.ess_tail >= self.min_ess_tail
+        )
+
+
+@dataclass
+class SamplingReport(object):
+    """What a staged sampling run did.
+
+    Fields:
+        stages: Number of CmdStan runs, including the one that warmed up.
+        draws_per_chain: Post-warmup draws kept per chain.
+        converged: Whether the targets were met before the draw budget ran out.
+        wall_time: Seconds spent sampling.
+        time_saved: Estimated seconds saved relative to sampling the whole draw budget.
+        diagnostics: Worst-case diagnostics of each core parameter after the last stage.
+    """
+
+    stages: int
+    draws_per_chain: int
+    converged: bool
+    wall_time: float
+    time_saved: float
+    diagnostics: Dict[str, ConvergenceSummary] = field(default_factory=dict)
+
+
+def sample_until_converged(
+    stan_model: csp.CmdStanModel,
+    data: Union[Dict[str, Any], str],
+    core_parameters: List[str],
+    targets: ConvergenceTargets,
+    chains: int = 4,
+    seed: Optional[int] = None,
+    **kwargs,
+):
+    """Sample in stages until every core parameter meets the convergence targets.
+
+    The first stage warms up as usual. Each later stage continues every chain from its last
+    draw with the adapted step size and metric, and without warmup, so its draws extend the
+    chains already sampled. Returns the pooled samples, keyed by Stan variable name with draws
+    along the first axis as `CmdStanMCMC.stan_variables` would, and a `SamplingReport`. `data`
+    is a dictionary or the path of a data file; either way, it's reused by every stage.
+
+    `kwargs` are passed on to every call to `CmdStanModel.sample`, except `iter_sampling`,
+    which the targets' `stage_draws` and `max_draws` take the place of.
+    """
+    check_staged_kwargs(kwargs)
+    seed = seed if seed is not None else int(np.random.default_rng().integers(2**31 - 1))
+    stage_draws = min(targets.stage_draws, targets.max_draws)
+
+    start = time.perf_counter()
+    fit = stan_model.sample(
+        data=data, chains=chains, seed=seed, iter_sampling=stage_draws, **kwargs
+    )
+    stage_times = [time.perf_counter() - start]
+    chain_draws = _by_chain(fit, chains)
+    num_draws = stage_draws
+    diagnostics = _diagnose(chain_draws, core_parameters)
+    converged = all([targets.are_met(summary) for summary in diagnostics.values()])
+
+    while not converged and num_draws < targets.max_draws:
+        new_draws = min(stage_draws, targets.max_draws - num_draws)
+        continue_kwargs = {
+            key: value for key, value in kwargs.items()
+            if key not in ["iter_warmup", "inits", "step_size", "metric", "adapt_engaged"]
+        }
+        stage_start = time.perf_counter()
+        fit = stan_model.sample(
+            data=data,
+            chains=chains,
+            seed=seed + len(stage_times),
+            iter_warmup=0,
+            iter_sampling=new_draws,
+            adapt_engaged=False,
+            inits=_last_draws(chain_draws),
+            step_size=list(fit.step_size),
+            metric=[{"inv_metric": metric} for metric in fit.metric],
+            **continue_kwargs,
+        )
+        stage_times.append(time.perf_counter() - stage_start)
+        new_chain_draws = _by_chain(fit, chains)
+        chain_draws = {
+            name: np.concatenate([draws, new_chain_draws[name]], axis=1)
+            for name, draws in chain_draws.items()
+        }
+        num_draws += new_draws
+        diagnostics = _diagnose(chain_draws, core_parameters)
+        converged = all([targets.are_met(summary) for summary in diagnostics.values()])
+
+    # Continuation stages give the cleanest cost per draw; otherwise the first stage's cost is
+    # spread over its warmup and sampling iterations
+    if len(stage_times) > 1:
+        time_per_draw = sum(stage_times[1:]) / (num_draws - stage_draws)
+    else:
+        time_per_draw = stage_times[0] / (kwargs.get("iter_warmup", 1000) + stage_draws)
+    report = SamplingReport(
+        stages=len(stage_times),
+        draws_per_chain=num_draws,
+        converged=converged,
+        wall_time=sum(stage_times),
+        time_saved=(targets.max_draws - num_draws) * time_per_draw,
+        diagnostics=diagnostics,
+    )
+    samples = {
+        name: draws.reshape(chains * num_draws, *draws.shape[2:])
+        for name, draws in chain_draws.items()
+    }
+    return samples, report
+
+
+def check_staged_kwargs(kwargs: Dict[str, Any]):
+    """Raise if `kwargs` for staged sampling set something the convergence targets control."""
+    if "iter_sampling" in kwargs:
+        raise Exception(
+            "iter_sampling can't be combined with convergence targets; set the targets' "
+            "stage_draws and max_draws instead"
+        )
+
+
+def _by_chain(fit: csp.CmdStanMCMC, chains: int) -> Dict[str, np.ndarray]:
+    """Stan variables with shape (chains x draws x ...)."""
+    return {
+        name: values.reshape(chains, -1, *values.shape[1:])
+        for name, values in fit.stan_variables().items()
+    }
+
+
+def _last_draws(chain_draws: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """Inits that resume each chain from its last draw."""
+    num_chains = next(iter(chain_draws.values())).shape[0]
+    return [
+        {name: draws[chain, -1].tolist() for name, draws in chain_draws.items()}
+        for chain in range(num_chains)
+    ]
+
+
+def _diagnose(
+    chain_draws: Dict[str, np.ndarray], core_parameters: List[str]
+) -> Dict[str, ConvergenceSummary]:
+    return {
+        name: summarize_convergence(chain_draws[name])
+        for name in core_parameters
+        if name in chain_draws
+    }
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import platform
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import cmdstanpy as csp
+import numpy as np
+
+# Executables carry a platform-specific suffix, matching what CmdStan's makefiles produce.
+EXECUTABLE_SUFFIX = ".exe" if platform.system() == "Windows" else ""
+
+# Default directory for generated Stan programs and their compiled executables.
+DEFAULT_CACHE_DIR = Path(tempfile.gettempdir()) / "stapes"
+
+
+def stan_file_for(code: str, cache_dir: Optional[Union[str, Path]] = None) -> Path:
+    """Write a Stan program to a path derived from a hash of its contents.
+
+    Identical programs share a path, so an executable compiled for one fit is reused by every
+    later fit of the same program. The file is only written if it doesn't already exist, which
+    keeps its timestamp older than the executable's.
+    """
+    cache_dir = _cache_dir(cache_dir)
+    digest = hashlib.sha256(code.encode("utf-8")).hexdigest()[:16]
+    stan_file = cache_dir / f"model_{digest}.stan"
+    if not stan_file.exists():
+        _write_atomic(stan_file, lambda tmp_file: tmp_file.write_text(code, encoding="utf-8"))
+    return stan_file
+
+
+def stan_data_file(data: Dict[str, Any], cache_dir: Optional[Union[str, Path]] = None) -> Path:
+    """Write Stan data to a JSON file at a path derived from a hash of its contents.
+
+    Fits of the same data share the file, so it's only serialized once however many times the
+    data is sampled.
+    """
+    cache_dir = _cache_dir(cache_dir)
+    data_file = cache_dir / f"data_{_data_digest(data)}.json"
+    if not data_file.exists():
+        _write_atomic(data_file, lambda tmp_file: csp.write_stan_json(str(tmp_file), data))
+    return data_file
+
+
+def run_data_file(
+    data_file: Union[str, Path],
+    extra: Dict[str, Any],
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> Path:
+    """Combine a data file from `stan_data_file` with a few per-run values, such as the
+    resolved configuration.
+
+    CmdStan only reads a single data file, so the per-run values are serialized on their own
+    and spliced onto a byte-for-byte copy of the main file rather than re-serializing it. The
+    result is also content-addressed, so repeated runs with the same values reuse it.
+    """
+    data_file = Path(data_file)
+    cache_dir = _cache_dir(cache_dir)
+    run_file = cache_dir / f"{data_file.stem}_{_data_digest(extra)}.json"
+    if run_file.exists():
+        return run_file
+
+    fragment_file = cache_dir / f"values_{_data_digest(extra)}.json"
+    if not fragment_file.exists():
+        _write_atomic(fragment_file, lambda tmp_file: csp.write_stan_json(str(tmp_file), extra))
+    fragment = fragment_file.read_text(encoding="utf-8").strip()[1:-1].strip()
+
+    def _splice(tmp_file):
+        with open(data_file, "rb") as infile, open(tmp_file, "wb") as outfile:
+            # Copy everything up to the main object's closing brace...
+            infile.seek(0, os.SEEK_END)
+            end = infile.tell()
+            infile.seek(max(end - 64, 0))
+            close = infile.tell() + infile.read().rindex(b"}")
+            infile.seek(0)
+            _copy_bytes(infile, outfile, close)
+            # ...then append the per-run values and close the object again
+            if fragment:
+                outfile.write(b",\n" + fragment.encode("utf-8"))
+            outfile.write(b"\n}\n")
+
+    _write_atomic(run_file, _splice)
+    return run_file
+
+
+def executable_for(stan_file: Union[str, Path]) -> Path:
+    """The path CmdStan compiles a Stan program to."""
+    stan_file = Path(stan_file)
+    return stan_file.with_name(stan_file.stem + EXECUTABLE_SUFFIX)
+
+
+def is_compiled(stan_file: Union[str, Path]) -> bool:
+    """Whether an up-to-date executable exists for a Stan program."""
+    exe_file = executable_for(stan_file)
+    return exe_file.exists() and exe_file.stat().st_mtime >= Path(stan_file).stat().st_mtime
+
+
+def _cache_dir(cache_dir: Optional[Union[str, Path]]) -> Path:
+    cache_dir = Path(cache_dir or os.environ.get("STAPES_CACHE_DIR", DEFAULT_CACHE_DIR))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def _data_digest(data: Dict[str, Any]) -> str:
+    """Hash Stan data by the name, type, shape and raw bytes of every entry."""
+    digest = hashlib.sha256()
+    for name in sorted(data):
+        value = np.ascontiguousarray(data[name])
+        digest.update(f"{name}:{value.dtype.str}:{value.shape};".encode("utf-8"))
+        digest.update(value.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _write_atomic(path: Path, write):
+    # Write to a temporary name first so concurrent writers never see a partial file
+    tmp_file = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    write(tmp_file)
+    os.replace(tmp_file, path)
+
+
+def _copy_bytes(infile, outfile, length: int, chunk_size: int = 1 << 20):
+    while length > 0:
+        chunk = infile.read(min(chunk_size, length))
+        if not chunk:
+            break
+        outfile.write(chunk)
+        length -= len(chunk)
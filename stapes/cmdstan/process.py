@@ -0,0 +1,180 @@
+import asyncio
+import os
+import platform
+import re
+import signal
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import cmdstanpy as csp
+
+from .cache import executable_for, is_compiled
+
+MAKE = os.environ.get("MAKE", "mingw32-make" if platform.system() == "Windows" else "make")
+
+# CmdStan progress lines look like "Iteration:  100 / 2000 [  5%]  (Warmup)"
+PROGRESS_LINE = re.compile(r"Iteration:\s*(\d+)\s*/\s*(\d+)\s*\[\s*\d+%\]\s*\((\w+)\)")
+
+
+@dataclass
+class FitEvent(object):
+    """A progress event from an asynchronous fit.
+
+    Fields:
+        stage: One of "compile", "sample", or "done".
+        message: The raw line of CmdStan output, or a short description of the event.
+        chain: The chain the event came from, for sampling events.
+        iteration: The current iteration, for sampling progress events.
+        total: The total number of iterations, for sampling progress events.
+        phase: "Warmup" or "Sampling", for sampling progress events.
+    """
+
+    stage: str
+    message: str
+    chain: Optional[int] = None
+    iteration: Optional[int] = None
+    total: Optional[int] = None
+    phase: Optional[str] = None
+
+
+EventCallback = Callable[[FitEvent], None]
+
+
+async def compile_async(
+    stan_file: Union[str, Path],
+    on_event: Optional[EventCallback] = None,
+) -> Path:
+    """Compile a Stan program with CmdStan's makefiles without blocking the event loop.
+
+    If the task is cancelled, the whole `make` process group is killed and any partially built
+    executable is removed.
+    """
+    exe_file = executable_for(stan_file)
+    if is_compiled(stan_file):
+        return exe_file
+
+    def _on_line(line):
+        if on_event is not None:
+            on_event(FitEvent(stage="compile", message=line))
+
+    try:
+        await _run_process([MAKE, Path(exe_file).as_posix()], csp.cmdstan_path(), _on_line)
+    except BaseException:
+        exe_file.unlink(missing_ok=True)
+        raise
+    return exe_file
+
+
+async def sample_async(
+    exe_file: Union[str, Path],
+    data_file: Union[str, Path],
+    output_dir: Union[str, Path],
+    chains: int = 4,
+    seed: Optional[int] = None,
+    iter_warmup: int = 1000,
+    iter_sampling: int = 1000,
+    refresh: int = 100,
+    extra_args: Optional[List[str]] = None,
+    on_event: Optional[EventCallback] = None,
+    save_profile: bool = False,
+) -> csp.CmdStanMCMC:
+    """Run NUTS chains as concurrent CmdStan processes without blocking the event loop.
+
+    `extra_args` are appended to every chain's `method=sample` arguments. If `save_profile` is
+    set, each chain writes the timings of the program's profile blocks to
+    `chain_<id>-profile.csv` in `output_dir`. If the task is cancelled, or any chain fails,
+    every chain's process is killed.
+    """
+    seed = seed if seed is not None else int.from_bytes(os.urandom(3), "little")
+    csv_files = [Path(output_dir) / f"chain_{chain}.csv" for chain in range(1, chains + 1)]
+
+    def _chain_command(chain, csv_file):
+        profile_args = []
+        if save_profile:
+            profile_file = csv_file.with_name(f"{csv_file.stem}-profile.csv")
+            profile_args = [f"profile_file={profile_file.as_posix()}"]
+        return [
+            Path(exe_file).as_posix(),
+            f"id={chain}",
+            "random", f"seed={seed}",
+            "data", f"file={Path(data_file).as_posix()}",
+            "output", f"file={csv_file.as_posix()}", *profile_args, f"refresh={refresh}",
+            "method=sample", f"num_samples={iter_sampling}", f"num_warmup={iter_warmup}",
+            *(extra_args or []),
+        ]
+
+    def _on_line(chain):
+        def _handle(line):
+            if on_event is None:
+                return
+            match = PROGRESS_LINE.search(line)
+            if match:
+                on_event(FitEvent(
+                    stage="sample",
+                    message=line,
+                    chain=chain,
+                    iteration=int(match.group(1)),
+                    total=int(match.group(2)),
+                    phase=match.group(3),
+                ))
+            else:
+                on_event(FitEvent(stage="sample", message=line, chain=chain))
+        return _handle
+
+    tasks = [
+        asyncio.ensure_future(
+            _run_process(_chain_command(chain, csv_file), output_dir, _on_line(chain))
+        )
+        for chain, csv_file in enumerate(csv_files, start=1)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    if on_event is not None:
+        on_event(FitEvent(stage="done", message=f"Sampled {chains} chains"))
+    return csp.from_csv([str(csv_file) for csv_file in csv_files], method="sample")
+
+
+async def _run_process(
+    cmd: List[str],
+    cwd: Union[str, Path],
+    on_line: Callable[[str], None],
+):
+    """Run a subprocess, streaming its combined output line by line.
+
+    The process gets its own process group, so that cancelling kills anything it spawned
+    (e.g. the compiler processes started by `make`).
+    """
+    is_posix = os.name == "posix"
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=str(cwd),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=is_posix,
+    )
+    output = []
+    try:
+        async for raw_line in proc.stdout:
+            line = raw_line.decode("utf-8", errors="replace").rstrip()
+            output.append(line)
+            on_line(line)
+        return_code = await proc.wait()
+    except BaseException:
+        if proc.returncode is None:
+            if is_posix:
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+            await proc.wait()
+        raise
+
+    if return_code != 0:
+        tail = "\n".join(output[-20:])
+        raise Exception(f"Command {cmd[0]} failed with return code {return_code}:\n{tail}")
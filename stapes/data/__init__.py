@@ -1 +1,11 @@
-from .data import DataCoords, DataValue, build_stan_data, get_variable_value
+from .data import (
+    DataCoords,
+    DataValue,
+    COORDINATE_NAMES,
+    build_stan_data,
+    get_variable_value,
+    get_coordinate_id,
+    level_gaps,
+    triangle_id_problem,
+)
+from .incremental import StanDataBuilder, StanDataUpdate
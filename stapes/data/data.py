@@ -1,4 +1,5 @@
-from typing import Tuple, Union, Dict, Any, List
+from dataclasses import dataclass
+from typing import Tuple, Union, Dict, Any, Iterable, List, Set, Optional
 
 import numpy as np
 
@@ -9,6 +10,14 @@ DataCoords = Tuple[
     int,    # Development lag index
 ]
 
+COORDINATE_NAMES = [
+    "TriangleId",
+    "ExpPeriodId",
+    "DevLagId",
+    "TriangleExpPeriodId",
+    "TriangleDevLagId",
+]
+
 DataValue = Union[
     float,          # Observed scalar value,
     str,            # Placeholder for unrealized missing value
@@ -16,59 +25,215 @@ DataValue = Union[
 ]
 
 
-def get_variable_value(
-    data: Dict[DataCoords, DataValue],
-    coords: DataCoords,
-    field_name: str
-) -> Union[float, np.ndarray]:
-    base_name, tri_id, exp_id, dev_id = coords
-    max_triangle_id = max([coord[0] for coord in data])
+# Composite coordinate ids combine a triangle id with an experience period or development lag
+# id. They're only ever used as keys for rank-encoding, so the stride just has to exceed the
+# largest triangle id. Triangle ids outside [0, stride) would collide, so they're rejected.
+COMPOSITE_ID_STRIDE = 1_000_000
+
+
+def triangle_id_problem(tri_ids: Iterable[int]) -> Optional[str]:
+    """Describe the triangle ids that can't be combined into composite coordinate ids, or return
+    None if they all can."""
+    invalid = sorted(set([
+        int(tri_id) for tri_id in tri_ids if not 0 <= tri_id < COMPOSITE_ID_STRIDE
+    ]))
+    if not invalid:
+        return None
+    listed = ", ".join([str(tri_id) for tri_id in invalid[:5]])
+    if len(invalid) > 5:
+        listed += f" and {len(invalid) - 5} more"
+    return (
+        f"Triangle ids must be in [0, {COMPOSITE_ID_STRIDE}) to be combined into composite "
+        f"coordinate ids; out of range: {listed}"
+    )
+
+
+def get_coordinate_id(coords: Tuple[int, int, int], field_name: str) -> int:
+    """Compute the raw value of a coordinate variable for a (triangle, exp, dev) cell."""
+    tri_id, exp_id, dev_id = coords
     if field_name == "DevLagId":
         return dev_id
     elif field_name == "ExpPeriodId":
         return exp_id
     elif field_name == "TriangleId":
         return tri_id
-    elif field_name == "TriangleDevLagId":
-        return max_triangle_id * (dev_id - 1) + tri_id
-    elif field_name == "TriangleExpPeriodId":
-        return max_triangle_id * (exp_id - 1) + tri_id
+    elif field_name not in ["TriangleDevLagId", "TriangleExpPeriodId"]:
+        raise Exception(f"Unrecognized coordinate variable {field_name}")
+
+    if not 0 <= tri_id < COMPOSITE_ID_STRIDE:
+        raise ValueError(triangle_id_problem([tri_id]))
+    inner_id = dev_id if field_name == "TriangleDevLagId" else exp_id
+    return COMPOSITE_ID_STRIDE * (inner_id - 1) + tri_id
+
+
+def level_gaps(field_name: str, levels: Iterable[int]) -> List[str]:
+    """Describe the levels of a coordinate variable missing between the lowest and highest of
+    `levels`, per triangle for a composite variable. Composite levels are decoded assuming
+    their triangle ids are within range, as `get_coordinate_id` ensures."""
+    if field_name not in ["TriangleDevLagId", "TriangleExpPeriodId"]:
+        present = set([int(level) for level in levels])
+        if not present:
+            return []
+        return [
+            f"{field_name} {level}" for level in range(min(present), max(present) + 1)
+            if level not in present
+        ]
+
+    inner_name = field_name[len("Triangle"):]
+    by_triangle: Dict[int, List[int]] = {}
+    for level in levels:
+        tri_id = int(level) % COMPOSITE_ID_STRIDE
+        by_triangle.setdefault(tri_id, []).append(int(level) // COMPOSITE_ID_STRIDE + 1)
+    return [
+        f"TriangleId {tri_id}, {gap}"
+        for tri_id, inner_levels in sorted(by_triangle.items())
+        for gap in level_gaps(inner_name, inner_levels)
+    ]
+
+
+def get_variable_value(
+    data: Dict[DataCoords, DataValue],
+    coords: DataCoords,
+    field_name: str
+) -> Union[float, np.ndarray]:
+    base_name, tri_id, exp_id, dev_id = coords
+    if field_name[-2:] == "Id":
+        return get_coordinate_id((tri_id, exp_id, dev_id), field_name)
     else:
-        return coords[(field_name, tri_id, exp_id, dev_id)]
+        return data[(field_name, tri_id, exp_id, dev_id)]
+
+
+# For each likelihood, the offsets at which each variable is read: {response: {variable: offsets}}
+References = Dict[str, Dict[str, Set[Tuple[int, int]]]]
 
 
 def build_stan_data(
     train_data: Dict[DataCoords, DataValue],
-    offsets: List[Tuple[int, int]]
+    offsets: List[Tuple[int, int]],
+    references: Optional[References] = None,
 ) -> Dict[str, Any]:
-    raw_index = set([coord[1:] for coord in train_data])
-    core_index = _build_core_index(raw_index, offsets)
-    full_index = core_index + list(raw_index - set(core_index))
-    variables = set([name for name, _, _, _ in train_data])
+    """Build the data for the Stan program from training data.
 
-    max_triangle_id = max([coord[0] for coord in core_index])
+    Every array is a typed NumPy array (int64 for indices and ids, float64 for values), so it
+    can be hashed and serialized without going through Python lists. Coordinate variables are
+    rank-encoded to the levels observed in the core cells, so Stan parameters indexed by them
+    have no entries without data. The original id of each encoded level is kept in
+    `<name>__levels`.
+
+    If `references` is given, the data is pruned to what the likelihoods actually read: core
+    cells where no response is observed are dropped unless another likelihood term reads their
+    imputed response, and only missing values that some likelihood term reads are imputed.
+    Without it, every missing value of every variable in the full index is imputed.
+    """
+    return _assemble_stan_data(train_data, offsets, build_indices(train_data, offsets, references))
+
+
+def _assemble_stan_data(train_data, offsets, indices):
+    variables = set([name for name, _, _, _ in train_data])
 
     stan_data = {
-        "N": len(core_index),
-        "T": len(full_index),
-        **_build_index("TriangleId", core_index, lambda coord: coord[0]),
-        **_build_index("ExpPeriodId", core_index, lambda coord: coord[1]),
-        **_build_index("DevLagId", core_index, lambda coord: coord[2]),
-        **_build_index("TriangleExpPeriodId", core_index,
-                       lambda coord: max_triangle_id * (coord[1] - 1) + coord[0]),
-        **_build_index("TriangleDevLagId", core_index,
-                       lambda coord: max_triangle_id * (coord[2] - 1) + coord[0]),
+        "N": len(indices.core_index),
+        "T": len(indices.full_index),
         **{
-            _offset_name(offset): _build_offset_lookup(core_index, full_index, offset)
+            _offset_name(offset): _build_offset_lookup(
+                indices.core_index, indices.full_index, offset
+            )
             for offset in offsets
         }
     }
+    for name in COORDINATE_NAMES:
+        stan_data = {**stan_data, **_build_index(name, indices.core_index)}
     for name in variables:
-        stan_data = {**stan_data, **_build_variable(name, train_data, full_index)}
+        stan_data = {
+            **stan_data,
+            **_build_variable(name, train_data, indices.full_index, indices.needed),
+        }
 
     return stan_data
 
 
+@dataclass
+class DataIndices(object):
+    """The cells behind a set of Stan data.
+
+    Fields:
+        raw_index: Every (triangle, exp, dev) cell with any training data.
+        candidates: Cells with data at every offset the likelihoods read, before pruning.
+        core_index: The cells the likelihoods are evaluated at, in Stan order.
+        full_index: The core cells followed by the other cells the data holds values for.
+        needed: With pruning, the (variable, cell) pairs the likelihoods read; otherwise None.
+    """
+
+    raw_index: Set[Tuple[int, int, int]]
+    candidates: Set[Tuple[int, int, int]]
+    core_index: List[Tuple[int, int, int]]
+    full_index: List[Tuple[int, int, int]]
+    needed: Optional[Set[Tuple[str, Tuple[int, int, int]]]]
+
+
+def build_indices(
+    train_data: Dict[DataCoords, DataValue],
+    offsets: List[Tuple[int, int]],
+    references: Optional[References] = None,
+) -> DataIndices:
+    """Work out which cells `build_stan_data` puts in the core and full indices."""
+    raw_index = set([coord[1:] for coord in train_data])
+    core_index = _build_core_index(raw_index, offsets)
+    candidates = set(core_index)
+    needed = None
+    if references is not None:
+        core_index, needed = _prune_core_index(core_index, train_data, references)
+        referenced = set([
+            (tri_id, exp_id - exp_offset, dev_id - dev_offset)
+            for tri_id, exp_id, dev_id in core_index
+            for exp_offset, dev_offset in offsets
+        ])
+        full_index = core_index + sorted(referenced - set(core_index))
+    else:
+        full_index = core_index + sorted(raw_index - set(core_index))
+    return DataIndices(raw_index, candidates, core_index, full_index, needed)
+
+
+def _prune_core_index(core_index, train_data, references):
+    """Find the core cells that must stay in the model, and the (variable, cell) pairs whose
+    values the likelihoods read at those cells."""
+    core_set = set(core_index)
+    responses = set(references)
+
+    # Start from the cells with at least one observed response...
+    retained = set([
+        coord for coord in core_index
+        if any([(response, *coord) in train_data for response in responses])
+    ])
+    needed = set()
+    frontier = list(retained)
+    while frontier:
+        new_cells = []
+        for coord in frontier:
+            for variable, cell in _reads(coord, references):
+                if (variable, cell) in needed:
+                    continue
+                needed.add((variable, cell))
+                # ...and add any cell whose imputed response is read elsewhere, so that its
+                # likelihood still informs the imputation.
+                is_missing_response = variable in responses and (variable, *cell) not in train_data
+                if is_missing_response and cell in core_set and cell not in retained:
+                    retained.add(cell)
+                    new_cells.append(cell)
+        frontier = new_cells
+
+    return [coord for coord in core_index if coord in retained], needed
+
+
+def _reads(coord, references):
+    """The (variable, cell) pairs the likelihood terms at a core cell read."""
+    tri_id, exp_id, dev_id = coord
+    for variable_offsets in references.values():
+        for variable, offsets in variable_offsets.items():
+            for exp_offset, dev_offset in offsets:
+                yield variable, (tri_id, exp_id - exp_offset, dev_id - dev_offset)
+
+
 def _build_core_index(raw_index, offsets):
     core_index = []
     for tri_id, exp_id, dev_id in raw_index:
@@ -88,33 +253,38 @@ def _offset_name(offset):
 
 
 def _build_offset_lookup(core_index, full_index, offset):
-    offset_lookup = []
     full_index_map = {coords: ndx+1 for ndx, coords in enumerate(full_index)}
     exp_offset, dev_offset = offset
-    for tri_id, exp_id, dev_id in core_index:
-        offset_lookup.append(full_index_map[(tri_id, exp_id - exp_offset, dev_id - dev_offset)])
-    return offset_lookup
+    return np.asarray([
+        full_index_map[(tri_id, exp_id - exp_offset, dev_id - dev_offset)]
+        for tri_id, exp_id, dev_id in core_index
+    ], dtype=np.int64)
 
 
-def _build_variable(name, train_data, full_index):
+def _build_variable(name, train_data, full_index, needed=None):
     values = []
     missing_ndxs = []
     for ndx, coord in enumerate(full_index):
         if (name, *coord) not in train_data:
             values.append(0)
-            missing_ndxs.append(ndx+1)
+            # Values nothing reads are left as unused placeholders instead of being imputed
+            if needed is None or (name, coord) in needed:
+                missing_ndxs.append(ndx+1)
         else:
             values.append(train_data[(name, *coord)])
     return {
-        f"{name}__raw": values,
+        f"{name}__raw": np.asarray(values, dtype=np.float64),
         f"{name}__num_missing": len(missing_ndxs),
-        f"{name}__missing_ids": missing_ndxs
+        f"{name}__missing_ids": np.asarray(missing_ndxs, dtype=np.int64),
     }
 
 
-def _build_index(name, core_index, index_fn):
-    values = [index_fn(coord) for coord in core_index]
+def _build_index(name, core_index):
+    values = [get_coordinate_id(coord, name) for coord in core_index]
+    levels = sorted(set(values))
+    dense_ids = {level: ndx+1 for ndx, level in enumerate(levels)}
     return {
-        name: values,
-        f"{name}__count": max(values),
+        name: np.asarray([dense_ids[value] for value in values], dtype=np.int64),
+        f"{name}__count": len(levels),
+        f"{name}__levels": np.asarray(levels, dtype=np.int64),
     }
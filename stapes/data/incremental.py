@@ -0,0 +1,315 @@
+from collections import ChainMap
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+
+from .data import (
+    COORDINATE_NAMES,
+    DataCoords,
+    DataValue,
+    References,
+    build_indices,
+    get_coordinate_id,
+    triangle_id_problem,
+    _assemble_stan_data,
+    _offset_name,
+    _reads,
+)
+
+Cell = Tuple[int, int, int]
+
+
+@dataclass
+class StanDataUpdate(object):
+    """What an update to a `StanDataBuilder` changed.
+
+    Fields:
+        num_new_cells: How many cells were added to the core index.
+        is_incremental: Whether the existing data was extended in place of being rebuilt. A
+            rebuild may reorder the cells, though the result is equivalent.
+        changed_counts: The coordinate variables whose number of levels changed, with the
+            (old, new) counts.
+        relabeled: The coordinate variables whose existing levels got different dense ids,
+            because a new level sorts before an existing one.
+    """
+
+    num_new_cells: int = 0
+    is_incremental: bool = True
+    changed_counts: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    relabeled: List[str] = field(default_factory=list)
+
+    @property
+    def is_layout_valid(self) -> bool:
+        """Whether parameters indexed by coordinate variables keep their previous shapes and
+        element meanings, so a previous fit's draws still line up with the new data."""
+        return not self.changed_counts and not self.relabeled
+
+
+class StanDataBuilder(object):
+    """Builds Stan data like `build_stan_data`, and extends it as training data arrives.
+
+    Adding cells that come after the existing ones, like a new calendar diagonal, appends them
+    to the core index, offset lookups and variable arrays. The Python work is proportional to
+    the new cells; existing arrays are only copied, never changed, so Stan data handed out
+    earlier stays valid. Updates that would change existing cells (new values for them, a new
+    variable, or cells that join the core index) rebuild the data from scratch instead.
+
+    `train_data` is extended in place, so take a copy to keep the data of an earlier update.
+    """
+    def __init__(self, offsets: List[Tuple[int, int]], references: Optional[References] = None):
+        self.offsets = list(offsets)
+        self.references = references
+        self.train_data: Dict[DataCoords, DataValue] = {}
+        self.stan_data: Dict[str, Any] = {}
+        self.variables: Set[str] = set()
+        self._raw_index: Set[Cell] = set()
+        self._candidates: Set[Cell] = set()
+        self._needed: Optional[Set[Tuple[str, Cell]]] = None
+        # Positions of the core cells in the full index, and of the remaining cells after them.
+        # Both are in index order.
+        self._core_positions: Dict[Cell, int] = {}
+        self._extra_positions: Dict[Cell, int] = {}
+
+    @property
+    def core_index(self) -> List[Cell]:
+        return list(self._core_positions)
+
+    @property
+    def full_index(self) -> List[Cell]:
+        return list(self._core_positions) + list(self._extra_positions)
+
+    def update(self, new_data: Dict[DataCoords, DataValue]) -> StanDataUpdate:
+        """Add training data, returning what changed in the Stan data."""
+        # Checked up front, so a bad triangle id can't leave the builder half updated
+        problem = triangle_id_problem([key[1] for key in new_data])
+        if problem is not None:
+            raise ValueError(problem)
+        result = self._extend(new_data) if self.stan_data else None
+        if result is None:
+            result = self._rebuild({**self.train_data, **new_data})
+        return result
+
+    def _rebuild(self, train_data: Dict[DataCoords, DataValue]) -> StanDataUpdate:
+        previous = self.stan_data
+        indices = build_indices(train_data, self.offsets, self.references)
+        self.train_data = train_data
+        self.stan_data = _assemble_stan_data(train_data, self.offsets, indices)
+        self.variables = set([name for name, _, _, _ in train_data])
+        self._raw_index = indices.raw_index
+        self._candidates = indices.candidates
+        self._needed = indices.needed
+        num_core = len(indices.core_index)
+        self._core_positions = {cell: ndx + 1 for ndx, cell in enumerate(indices.core_index)}
+        self._extra_positions = {
+            cell: ndx + 1 for ndx, cell in enumerate(indices.full_index[num_core:])
+        }
+
+        result = StanDataUpdate(
+            num_new_cells=num_core - previous.get("N", 0), is_incremental=False
+        )
+        for name in COORDINATE_NAMES:
+            old_levels = previous.get(f"{name}__levels", np.zeros(0, dtype=np.int64))
+            new_levels = self.stan_data[f"{name}__levels"]
+            if len(old_levels) != len(new_levels):
+                result.changed_counts[name] = (len(old_levels), len(new_levels))
+            if not np.array_equal(old_levels, new_levels[:len(old_levels)]):
+                result.relabeled.append(name)
+        return result
+
+    def _extend(self, new_data: Dict[DataCoords, DataValue]) -> Optional[StanDataUpdate]:
+        """Append the new cells to the existing data, or return None if they can't simply be
+        appended. Nothing is changed until it's clear they can be."""
+        new_cells = set()
+        for key in new_data:
+            cell = key[1:]
+            if key[0] not in self.variables or cell in self._raw_index:
+                return None
+            new_cells.add(cell)
+        train_data = ChainMap(new_data, self.train_data)
+
+        # New cells must not complete the offsets of existing cells
+        def _is_raw(cell):
+            return cell in new_cells or cell in self._raw_index
+
+        new_candidates = set()
+        for tri_id, exp_id, dev_id in new_cells:
+            for exp_offset, dev_offset in self.offsets:
+                reader = (tri_id, exp_id + exp_offset, dev_id + dev_offset)
+                is_existing = reader in self._raw_index and reader not in self._candidates
+                if is_existing and self._is_candidate(reader, _is_raw):
+                    return None
+            if self._is_candidate((tri_id, exp_id, dev_id), _is_raw):
+                new_candidates.add((tri_id, exp_id, dev_id))
+
+        if self.references is None:
+            new_core = sorted(new_candidates)
+            new_extras = sorted(new_cells - new_candidates)
+            new_needed = set()
+        else:
+            retained = self._retain(new_candidates, train_data)
+            if retained is None:
+                return None
+            new_core, new_needed = retained
+            referenced = set([
+                (tri_id, exp_id - exp_offset, dev_id - dev_offset)
+                for tri_id, exp_id, dev_id in new_core
+                for exp_offset, dev_offset in self.offsets
+            ])
+            new_extras = sorted([
+                cell for cell in referenced - set(new_core)
+                if cell not in self._core_positions and cell not in self._extra_positions
+            ])
+            self._needed |= new_needed
+
+        self.train_data.update(new_data)
+        self._raw_index |= new_cells
+        self._candidates |= new_candidates
+        num_core = len(self._core_positions)
+        num_extras = len(self._extra_positions)
+        for ndx, cell in enumerate(new_core):
+            self._core_positions[cell] = num_core + ndx + 1
+        for ndx, cell in enumerate(new_extras):
+            self._extra_positions[cell] = num_extras + ndx + 1
+
+        stan_data = {
+            **self.stan_data,
+            "N": num_core + len(new_core),
+            "T": self.stan_data["T"] + len(new_core) + len(new_extras),
+        }
+        for offset in self.offsets:
+            stan_data.update(self._extend_offset_lookup(offset, num_core, new_core))
+        result = StanDataUpdate(num_new_cells=len(new_core))
+        for name in COORDINATE_NAMES:
+            stan_data.update(self._extend_index(name, new_core, result))
+        for name in self.variables:
+            stan_data.update(
+                self._extend_variable(name, num_core, new_core, new_extras, new_needed)
+            )
+        self.stan_data = stan_data
+        return result
+
+    def _is_candidate(self, cell: Cell, is_raw: Callable[[Cell], bool]) -> bool:
+        tri_id, exp_id, dev_id = cell
+        return all([
+            is_raw((tri_id, exp_id - exp_offset, dev_id - dev_offset))
+            for exp_offset, dev_offset in self.offsets
+        ])
+
+    def _retain(self, new_candidates: Set[Cell], train_data: Mapping[DataCoords, DataValue]):
+        """The new candidates to keep after pruning, and the (variable, cell) pairs they read,
+        following the same rules as `build_stan_data`. Returns None if a previously dropped
+        cell would have to be kept."""
+        responses = set(self.references)
+        retained = set([
+            cell for cell in new_candidates
+            if any([(response, *cell) in train_data for response in responses])
+        ])
+        new_needed = set()
+        frontier = list(retained)
+        while frontier:
+            new_cells = []
+            for cell in frontier:
+                for variable, read_cell in _reads(cell, self.references):
+                    pair = (variable, read_cell)
+                    if pair in self._needed or pair in new_needed:
+                        continue
+                    new_needed.add(pair)
+                    is_missing_response = (
+                        variable in responses and (variable, *read_cell) not in train_data
+                    )
+                    if not is_missing_response or read_cell in self._core_positions:
+                        continue
+                    if read_cell in new_candidates and read_cell not in retained:
+                        retained.add(read_cell)
+                        new_cells.append(read_cell)
+                    elif read_cell in self._candidates:
+                        return None
+            frontier = new_cells
+        return sorted(retained), new_needed
+
+    def _position(self, cell: Cell, num_core: int) -> int:
+        """Position of a cell in the full index, once `num_core` cells are in the core."""
+        if cell in self._core_positions:
+            return self._core_positions[cell]
+        return num_core + self._extra_positions[cell]
+
+    def _extend_offset_lookup(self, offset, num_core: int, new_core: List[Cell]):
+        name = _offset_name(offset)
+        lookup = self.stan_data[name]
+        num_new = len(new_core)
+        exp_offset, dev_offset = offset
+        new_positions = [
+            self._position((tri_id, exp_id - exp_offset, dev_id - dev_offset), num_core + num_new)
+            for tri_id, exp_id, dev_id in new_core
+        ]
+        # Cells after the core move back by the number of new core cells
+        shifted = np.where(lookup > num_core, lookup + num_new, lookup)
+        return {name: np.concatenate([shifted, np.asarray(new_positions, dtype=np.int64)])}
+
+    def _extend_index(self, name: str, new_core: List[Cell], result: StanDataUpdate):
+        dense_ids = self.stan_data[name]
+        levels = self.stan_data[f"{name}__levels"]
+        values = np.asarray([get_coordinate_id(cell, name) for cell in new_core], dtype=np.int64)
+        added = np.setdiff1d(values, levels)
+        if len(added) > 0:
+            result.changed_counts[name] = (len(levels), len(levels) + len(added))
+            if len(levels) > 0 and added[0] < levels[-1]:
+                # Existing levels are renumbered to keep the encoding in sorted order
+                result.relabeled.append(name)
+                new_levels = np.union1d(levels, added)
+                dense_ids = np.searchsorted(new_levels, levels[dense_ids - 1]) + 1
+                levels = new_levels
+            else:
+                levels = np.concatenate([levels, added])
+        new_ids = np.searchsorted(levels, values) + 1
+        return {
+            name: np.concatenate([dense_ids, new_ids]).astype(np.int64),
+            f"{name}__count": len(levels),
+            f"{name}__levels": levels,
+        }
+
+    def _extend_variable(
+        self,
+        name: str,
+        num_core: int,
+        new_core: List[Cell],
+        new_extras: List[Cell],
+        new_needed: Set[Tuple[str, Cell]],
+    ):
+        raw = self.stan_data[f"{name}__raw"]
+        missing_ids = self.stan_data[f"{name}__missing_ids"]
+        num_new = len(new_core)
+        train_data = self.train_data
+        needed = self._needed
+
+        def _values(cells, first_position):
+            values = []
+            missing = []
+            for ndx, cell in enumerate(cells):
+                key = (name, *cell)
+                values.append(train_data[key] if key in train_data else 0)
+                if key not in train_data and (needed is None or (name, cell) in needed):
+                    missing.append(first_position + ndx)
+            return np.asarray(values, dtype=np.float64), missing
+
+        core_values, core_missing = _values(new_core, num_core + 1)
+        extra_values, extra_missing = _values(new_extras, len(raw) + num_new + 1)
+        # Existing cells that new core cells read may need their missing values imputed now
+        new_cells = set(new_core) | set(new_extras)
+        newly_needed = [
+            self._position(cell, num_core + num_new)
+            for variable, cell in new_needed
+            if variable == name and (name, *cell) not in train_data and cell not in new_cells
+        ]
+        shifted = np.where(missing_ids > num_core, missing_ids + num_new, missing_ids)
+        missing_ids = np.unique(np.concatenate([
+            shifted,
+            np.asarray(core_missing + extra_missing + newly_needed, dtype=np.int64),
+        ])).astype(np.int64)
+        raw = np.concatenate([raw[:num_core], core_values, raw[num_core:], extra_values])
+        return {
+            f"{name}__raw": raw,
+            f"{name}__num_missing": len(missing_ids),
+            f"{name}__missing_ids": missing_ids,
+        }
@@ -0,0 +1,12 @@
+from .psis import psis_smooth, PARETO_K_THRESHOLD
+from .loo import loo, LooResult
+from .convergence import (
+    rhat,
+    ess_bulk,
+    ess_tail,
+    summarize_convergence,
+    ConvergenceSummary,
+)
+from .sensitivity import SensitivityResult, reweight
+from .efficiency import efficiency_report, EfficiencyReport, ParameterEfficiency
+from .profile import profile_table, PROFILE_COLUMNS
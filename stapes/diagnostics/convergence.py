@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.special
+import scipy.stats
+
+
+@dataclass
+class ConvergenceSummary(object):
+    """Worst-case convergence diagnostics over every element of a sampled variable.
+
+    Fields:
+        rhat: The largest rank-normalized split R-hat.
+        ess_bulk: The smallest bulk effective sample size.
+        ess_tail: The smallest tail effective sample size.
+    """
+
+    rhat: float
+    ess_bulk: float
+    ess_tail: float
+
+
+def rhat(draws: np.ndarray) -> float:
+    """Rank-normalized split R-hat (Vehtari et al., 2021) of a (chains x draws) array,
+    taking the worse of the bulk and the folded (tail) versions."""
+    split_draws = _split_chains(draws)
+    bulk = _rhat(_rank_normalize(split_draws))
+    folded = np.abs(split_draws - np.median(split_draws))
+    tail = _rhat(_rank_normalize(folded))
+    return max(bulk, tail)
+
+
+def ess_bulk(draws: np.ndarray) -> float:
+    """Bulk effective sample size of a (chains x draws) array."""
+    return _ess(_rank_normalize(_split_chains(draws)))
+
+
+def ess_tail(draws: np.ndarray) -> float:
+    """Tail effective sample size of a (chains x draws) array: the smaller of the effective
+    sample sizes of the 5% and 95% quantile indicators."""
+    split_draws = _split_chains(draws)
+    lower, upper = np.quantile(split_draws, [0.05, 0.95])
+    return min(
+        _ess(_rank_normalize((split_draws <= lower).astype(float))),
+        _ess(_rank_normalize((split_draws <= upper).astype(float))),
+    )
+
+
+def summarize_convergence(draws: np.ndarray) -> ConvergenceSummary:
+    """Worst-case diagnostics over the elements of a (chains x draws x ...) array.
+
+    Elements that never vary (e.g. the anchored entry of a vector parameter) carry no
+    information about convergence and are skipped.
+    """
+    num_chains, num_draws = draws.shape[:2]
+    flat_draws = draws.reshape(num_chains, num_draws, -1)
+    summary = ConvergenceSummary(rhat=1.0, ess_bulk=np.inf, ess_tail=np.inf)
+    for ndx in range(flat_draws.shape[2]):
+        element = flat_draws[:, :, ndx]
+        if np.ptp(element) == 0:
+            continue
+        summary.rhat = max(summary.rhat, rhat(element))
+        summary.ess_bulk = min(summary.ess_bulk, ess_bulk(element))
+        summary.ess_tail = min(summary.ess_tail, ess_tail(element))
+    return summary
+
+
+def _split_chains(draws: np.ndarray) -> np.ndarray:
+    """Split each chain in half, dropping the middle draw of odd-length chains."""
+    half = draws.shape[1] // 2
+    return np.concatenate([draws[:, :half], draws[:, -half:]], axis=0)
+
+
+def _rank_normalize(draws: np.ndarray) -> np.ndarray:
+    ranks = scipy.stats.rankdata(draws, method="average").reshape(draws.shape)
+    return scipy.special.ndtri((ranks - 0.375) / (draws.size + 0.25))
+
+
+def _rhat(draws: np.ndarray) -> float:
+    num_draws = draws.shape[1]
+    between = num_draws * np.var(np.mean(draws, axis=1), ddof=1)
+    within = np.mean(np.var(draws, axis=1, ddof=1))
+    if within == 0:
+        return np.nan
+    return float(np.sqrt((between / within + num_draws - 1) / num_draws))
+
+
+def _autocovariance(draws: np.ndarray) -> np.ndarray:
+    """Autocovariance of each chain along the draws axis, computed with an FFT."""
+    num_draws = draws.shape[1]
+    fft_len = 2 ** int(np.ceil(np.log2(2 * num_draws)))
+    centered = draws - draws.mean(axis=1, keepdims=True)
+    spectrum = np.fft.rfft(centered, n=fft_len, axis=1)
+    acov = np.fft.irfft(spectrum * np.conjugate(spectrum), n=fft_len, axis=1)
+    return acov[:, :num_draws] / num_draws
+
+
+def _ess(draws: np.ndarray) -> float:
+    """Effective sample size of a (chains x draws) array, truncating the autocorrelation sum
+    with Geyer's initial monotone sequence."""
+    num_chains, num_draws = draws.shape
+    if num_draws < 4:
+        return np.nan
+    acov = _autocovariance(draws)
+    mean_var = np.mean(acov[:, 0]) * num_draws / (num_draws - 1.0)
+    var_plus = mean_var * (num_draws - 1.0) / num_draws
+    if num_chains > 1:
+        var_plus += np.var(np.mean(draws, axis=1), ddof=1)
+    if var_plus == 0:
+        return np.nan
+
+    rho_hat = np.zeros(num_draws)
+    rho_hat_even = 1.0
+    rho_hat[0] = rho_hat_even
+    rho_hat_odd = 1.0 - (mean_var - np.mean(acov[:, 1])) / var_plus
+    rho_hat[1] = rho_hat_odd
+
+    # Sum autocorrelation pairs while they remain positive
+    t = 1
+    while t < (num_draws - 3) and (rho_hat_even + rho_hat_odd) > 0.0:
+        rho_hat_even = 1.0 - (mean_var - np.mean(acov[:, t + 1])) / var_plus
+        rho_hat_odd = 1.0 - (mean_var - np.mean(acov[:, t + 2])) / var_plus
+        if (rho_hat_even + rho_hat_odd) >= 0:
+            rho_hat[t + 1] = rho_hat_even
+            rho_hat[t + 2] = rho_hat_odd
+        t += 2
+    max_t = t - 2
+    if rho_hat_even > 0:
+        rho_hat[max_t + 1] = rho_hat_even
+
+    # Geyer's initial monotone sequence
+    t = 1
+    while t <= max_t - 2:
+        if (rho_hat[t + 1] + rho_hat[t + 2]) > (rho_hat[t - 1] + rho_hat[t]):
+            rho_hat[t + 1] = (rho_hat[t - 1] + rho_hat[t]) / 2.0
+            rho_hat[t + 2] = rho_hat[t + 1]
+        t += 2
+
+    total_draws = num_chains * num_draws
+    tau_hat = -1.0 + 2.0 * np.sum(rho_hat[:max_t + 1]) + np.sum(rho_hat[max_t + 1:max_t + 2])
+    tau_hat = max(tau_hat, 1 / np.log10(total_draws))
+    return float(total_draws / tau_hat)
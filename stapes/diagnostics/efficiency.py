@@ -0,0 +1,109 @@
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .convergence import summarize_convergence
+
+
+@dataclass
+class ParameterEfficiency(object):
+    """Sampling efficiency of a single Stan variable, over the worst of its elements.
+
+    Fields:
+        ess_bulk: The smallest bulk effective sample size.
+        ess_tail: The smallest tail effective sample size.
+        ess_bulk_per_second: `ess_bulk` per second of sampling, summed over chains.
+        ess_tail_per_second: `ess_tail` per second of sampling, summed over chains.
+        rhat: The largest rank-normalized split R-hat.
+    """
+
+    ess_bulk: float
+    ess_tail: float
+    ess_bulk_per_second: float
+    ess_tail_per_second: float
+    rhat: float
+
+
+@dataclass
+class EfficiencyReport(object):
+    """How efficiently a fit sampled, separating the cost of a draw from how well draws mix.
+
+    Fields:
+        parameters: Efficiency of each core component of each parameter, keyed by its Stan
+            name, such as `f__sigma` for the scale of a factor `f`.
+        warmup_time: Seconds spent in warmup, summed over chains.
+        sampling_time: Seconds spent sampling, summed over chains.
+        mean_treedepth: Average NUTS tree depth per draw.
+        max_treedepth_hits: Number of draws that reached the maximum tree depth.
+        gradients_per_draw: Average number of leapfrog steps (gradient evaluations) per draw.
+        divergences: Number of divergent transitions.
+    """
+
+    parameters: Dict[str, ParameterEfficiency] = field(default_factory=dict)
+    warmup_time: float = 0.0
+    sampling_time: float = 0.0
+    mean_treedepth: float = np.nan
+    max_treedepth_hits: int = 0
+    gradients_per_draw: float = np.nan
+    divergences: int = 0
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per core component, with the fit-wide sampler statistics repeated on each."""
+        fit_stats = {
+            "warmup_time": self.warmup_time,
+            "sampling_time": self.sampling_time,
+            "mean_treedepth": self.mean_treedepth,
+            "max_treedepth_hits": self.max_treedepth_hits,
+            "gradients_per_draw": self.gradients_per_draw,
+            "divergences": self.divergences,
+        }
+        return pd.DataFrame([
+            {"parameter": name, **asdict(efficiency), **fit_stats}
+            for name, efficiency in self.parameters.items()
+        ])
+
+
+def efficiency_report(
+    draws: Dict[str, np.ndarray],
+    sampler_variables: Dict[str, np.ndarray],
+    chain_times: List[Dict[str, float]],
+    max_treedepth: Optional[int] = None,
+) -> EfficiencyReport:
+    """Summarize the efficiency of a NUTS fit.
+
+    `draws` holds a (chains x draws x ...) array for each Stan variable, and `sampler_variables`
+    the (chains x draws) sampler diagnostics CmdStan reports, such as `treedepth__`,
+    `n_leapfrog__` and `divergent__`. `chain_times` has the warmup and sampling seconds of
+    each chain. ESS per second is relative to the sampling time summed over chains, so it
+    measures compute rather than wall time and doesn't depend on how many chains ran at once.
+    """
+    warmup_time = float(sum([times.get("warmup", 0.0) for times in chain_times]))
+    sampling_time = float(sum([times.get("sampling", 0.0) for times in chain_times]))
+    report = EfficiencyReport(warmup_time=warmup_time, sampling_time=sampling_time)
+
+    for name, values in draws.items():
+        summary = summarize_convergence(values)
+        report.parameters[name] = ParameterEfficiency(
+            ess_bulk=summary.ess_bulk,
+            ess_tail=summary.ess_tail,
+            ess_bulk_per_second=_per_second(summary.ess_bulk, sampling_time),
+            ess_tail_per_second=_per_second(summary.ess_tail, sampling_time),
+            rhat=summary.rhat,
+        )
+
+    if "treedepth__" in sampler_variables:
+        treedepth = np.asarray(sampler_variables["treedepth__"])
+        report.mean_treedepth = float(treedepth.mean())
+        if max_treedepth is not None:
+            report.max_treedepth_hits = int((treedepth >= max_treedepth).sum())
+    if "n_leapfrog__" in sampler_variables:
+        report.gradients_per_draw = float(np.asarray(sampler_variables["n_leapfrog__"]).mean())
+    if "divergent__" in sampler_variables:
+        report.divergences = int(np.asarray(sampler_variables["divergent__"]).sum())
+    return report
+
+
+def _per_second(ess: float, seconds: float) -> float:
+    return ess / seconds if seconds > 0 else np.nan
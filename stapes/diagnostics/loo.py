@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import scipy.special
+
+from ..data import DataCoords
+from .psis import psis_smooth, PARETO_K_THRESHOLD
+
+
+@dataclass
+class LooResult(object):
+    """Summary of a PSIS-LOO cross-validation estimate.
+
+    Fields:
+        elpd_loo: Expected log pointwise predictive density, summed over observations.
+        se: Standard error of `elpd_loo`.
+        p_loo: Effective number of parameters.
+        pointwise: Per-observation contributions to `elpd_loo`.
+        pareto_k: Per-observation Pareto k-hat diagnostics.
+        coords: Data coordinates of each observation.
+    """
+
+    elpd_loo: float
+    se: float
+    p_loo: float
+    pointwise: np.ndarray
+    pareto_k: np.ndarray
+    coords: List[DataCoords]
+
+    @property
+    def num_bad_k(self) -> int:
+        """The number of observations whose Pareto k-hat makes the estimate unreliable."""
+        return int(np.sum(self.pareto_k > PARETO_K_THRESHOLD))
+
+
+def loo(log_lik: np.ndarray, coords: List[DataCoords], chunk_size: int = 256) -> LooResult:
+    """Compute PSIS-LOO from a (draws x observations) pointwise log-likelihood matrix.
+
+    Observations are processed `chunk_size` columns at a time, so the only full-size array is
+    the input itself.
+    """
+    num_draws, num_obs = log_lik.shape
+    pointwise = np.empty(num_obs)
+    lppd = np.empty(num_obs)
+    pareto_k = np.empty(num_obs)
+
+    for start in range(0, num_obs, chunk_size):
+        chunk = np.asarray(log_lik[:, start:start + chunk_size], dtype=float)
+        lppd[start:start + chunk_size] = (
+            scipy.special.logsumexp(chunk, axis=0) - np.log(num_draws)
+        )
+        for col in range(chunk.shape[1]):
+            log_weights, k_hat = psis_smooth(-chunk[:, col])
+            pointwise[start + col] = scipy.special.logsumexp(log_weights + chunk[:, col])
+            pareto_k[start + col] = k_hat
+
+    return LooResult(
+        elpd_loo=float(np.sum(pointwise)),
+        se=float(np.sqrt(num_obs * np.var(pointwise))),
+        p_loo=float(np.sum(lppd - pointwise)),
+        pointwise=pointwise,
+        pareto_k=pareto_k,
+        coords=coords,
+    )
@@ -0,0 +1,38 @@
+from pathlib import Path
+from typing import List, Union
+
+import pandas as pd
+
+# Measurements in a CmdStan profile CSV, all of which add up across chains and threads
+PROFILE_COLUMNS = [
+    "total_time",
+    "forward_time",
+    "reverse_time",
+    "chain_stack",
+    "no_chain_stack",
+    "autodiff_calls",
+    "no_autodiff_calls",
+]
+
+
+def profile_table(profile_files: List[Union[str, Path]]) -> pd.DataFrame:
+    """Combine the profile CSVs CmdStan writes for each chain into one row per profile block.
+
+    Times are seconds summed over chains and threads: `forward_time` is spent evaluating the
+    block and `reverse_time` propagating its gradients. `chain_stack` and `no_chain_stack`
+    count the autodiff stack entries the block allocated, and `autodiff_calls` and
+    `no_autodiff_calls` how often it ran with and without gradients. Blocks named
+    `<kind>:<name>:<block>`, as generated by a profiled fit, are split into `kind`,
+    `component` and `block` columns. Rows are sorted by total time, with `time_share` giving
+    each one's fraction of the profiled time.
+    """
+    frames = [pd.read_csv(path, comment="#", skipinitialspace=True) for path in profile_files]
+    raw = pd.concat(frames, ignore_index=True)
+    table = raw.groupby("name", sort=False)[PROFILE_COLUMNS].sum().reset_index()
+
+    parts = table["name"].str.split(":", n=2, expand=True).reindex(columns=range(3))
+    for ndx, column in enumerate(["kind", "component", "block"]):
+        table.insert(1 + ndx, column, parts[ndx])
+    total_time = table["total_time"].sum()
+    table["time_share"] = table["total_time"] / total_time if total_time > 0 else float("nan")
+    return table.sort_values("total_time", ascending=False, ignore_index=True)
@@ -0,0 +1,84 @@
+from typing import Tuple
+
+import numpy as np
+import scipy.special
+
+# Pareto k-hat values above this threshold mean the importance weights are unreliable.
+PARETO_K_THRESHOLD = 0.7
+
+
+def psis_smooth(log_ratios: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Pareto-smooth a single vector of log importance ratios.
+
+    Implements Pareto-smoothed importance sampling (Vehtari, Gelman, and Gabry, 2017): the
+    largest ratios are replaced with the expected order statistics of a generalized Pareto
+    distribution fit to the tail, then truncated at the largest raw ratio.
+
+    Returns the normalized smoothed log weights and the estimated Pareto shape k-hat.
+    """
+    log_weights = np.array(log_ratios, dtype=float)
+    num_draws = log_weights.shape[0]
+    log_weights -= np.max(log_weights)
+
+    tail_len = int(np.ceil(min(0.2 * num_draws, 3 * np.sqrt(num_draws))))
+    sorted_weights = np.sort(log_weights)
+    cutoff = max(sorted_weights[-tail_len - 1], np.log(np.finfo(float).tiny))
+    tail_ids = np.flatnonzero(log_weights > cutoff)
+
+    if len(tail_ids) <= 4:
+        pareto_k = np.inf
+    else:
+        tail_order = np.argsort(log_weights[tail_ids])
+        exp_cutoff = np.exp(cutoff)
+        tail = np.exp(log_weights[tail_ids][tail_order]) - exp_cutoff
+        pareto_k, sigma = _gpd_fit(tail)
+        if np.isfinite(pareto_k):
+            probs = np.arange(0.5, len(tail_ids)) / len(tail_ids)
+            smoothed_tail = np.log(_gpd_quantile(probs, pareto_k, sigma) + exp_cutoff)
+            log_weights[tail_ids[tail_order]] = smoothed_tail
+            # Truncate at the largest raw ratio
+            log_weights[log_weights > 0] = 0
+
+    log_weights -= scipy.special.logsumexp(log_weights)
+    return log_weights, pareto_k
+
+
+def _gpd_fit(tail: np.ndarray) -> Tuple[float, float]:
+    """Estimate generalized Pareto parameters with the Zhang and Stephens (2009) method,
+    using the weakly informative prior on k recommended for PSIS.
+
+    `tail` must be sorted in ascending order.
+    """
+    prior_bs, prior_k = 3, 10
+    n = len(tail)
+    m_est = 30 + int(n ** 0.5)
+
+    b_ary = 1 - np.sqrt(m_est / (np.arange(1, m_est + 1) - 0.5))
+    b_ary /= prior_bs * tail[int(n / 4 + 0.5) - 1]
+    b_ary += 1 / tail[-1]
+
+    k_ary = np.log1p(-b_ary[:, None] * tail).mean(axis=1)
+    len_scale = n * (np.log(-(b_ary / k_ary)) - k_ary - 1)
+    weights = 1 / np.exp(len_scale - len_scale[:, None]).sum(axis=1)
+
+    # Remove negligible weights
+    real_ids = weights >= 10 * np.finfo(float).eps
+    if not np.all(real_ids):
+        weights = weights[real_ids]
+        b_ary = b_ary[real_ids]
+    weights /= weights.sum()
+
+    b_post = np.sum(b_ary * weights)
+    k_post = np.log1p(-b_post * tail).mean()
+    sigma = -k_post / b_post
+    # Shrink k towards 0.5 with the prior
+    k_post = (n * k_post + prior_k * 0.5) / (n + prior_k)
+    return k_post, sigma
+
+
+def _gpd_quantile(probs: np.ndarray, pareto_k: float, sigma: float) -> np.ndarray:
+    if sigma <= 0:
+        return np.full_like(probs, np.nan)
+    if pareto_k == 0:
+        return -np.log1p(-probs) * sigma
+    return np.expm1(-pareto_k * np.log1p(-probs)) / pareto_k * sigma
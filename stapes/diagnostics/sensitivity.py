@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from .psis import psis_smooth, PARETO_K_THRESHOLD
+
+
+@dataclass
+class SensitivityResult(object):
+    """The posterior under an alternative configuration, estimated from the original draws.
+
+    Fields:
+        config: The configuration values that differ from the fitted configuration.
+        log_weights: Pareto-smoothed, normalized log importance weights of the original draws.
+        pareto_k: The Pareto k-hat diagnostic of the importance weights.
+        refit: The model refitted under the alternative configuration, if the weights were too
+            unreliable to use.
+    """
+
+    config: Dict[str, Any]
+    log_weights: np.ndarray
+    pareto_k: float
+    refit: Optional[Any] = None
+
+    @property
+    def is_reliable(self) -> bool:
+        """Whether the importance weights can be trusted."""
+        return self.pareto_k <= PARETO_K_THRESHOLD
+
+    @property
+    def ess(self) -> float:
+        """Effective sample size of the importance weights."""
+        return float(1 / np.sum(np.exp(2 * self.log_weights)))
+
+    def expectation(self, values: np.ndarray) -> np.ndarray:
+        """Posterior mean of per-draw `values` (draws along the first axis) under the
+        alternative configuration."""
+        weights = np.exp(self.log_weights).reshape(-1, *[1] * (np.ndim(values) - 1))
+        return np.sum(weights * values, axis=0)
+
+
+def reweight(log_ratios: np.ndarray, config: Dict[str, Any]) -> SensitivityResult:
+    """Pareto-smooth per-draw log density ratios between an alternative and the fitted
+    configuration."""
+    log_weights, pareto_k = psis_smooth(log_ratios)
+    return SensitivityResult(config=config, log_weights=log_weights, pareto_k=pareto_k)
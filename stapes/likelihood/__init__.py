@@ -1 +1,2 @@
 from .likelihood import Likelihood, FAMILY_INDEX_LOOKUP
+from .evaluate import variable_reference
@@ -0,0 +1,277 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Callable, Set
+
+from ..parse import ast
+from ..parameter import Parameter
+
+# A hook that can replace the generated text of a subexpression.
+Rewrite = Callable[[ast.Operand], Optional[str]]
+
+
+def _generate_op_text(
+    op: ast.Operand,
+    params: Dict[str, Parameter],
+    rewrite: Optional[Rewrite] = None,
+    group_index: Optional[str] = None,
+) -> str:
+    """Recurse through an expression and generate the relevant Stan code.
+
+    If `rewrite` returns text for a subexpression, that text is used in place of the
+    subexpression. If `group_index` is set, grouped parameters are indexed by it directly
+    instead of through their group variable.
+    """
+    if rewrite is not None:
+        rewritten = rewrite(op)
+        if rewritten is not None:
+            return rewritten
+
+    if isinstance(op, ast.Operation):
+        if len(op.operands) == 1:
+            # Unary operators are all prefix operators
+            op_text = _generate_op_text(op.operands[0], params, rewrite, group_index)
+            return f"{op.operator}{op_text}"
+        elif len(op.operands) == 2:
+            # Binary operators are all infix operators
+            left_op_text = _generate_op_text(op.operands[0], params, rewrite, group_index)
+            right_op_text = _generate_op_text(op.operands[1], params, rewrite, group_index)
+            return f"({left_op_text} {op.operator} {right_op_text})"
+        else:
+            # All operators should be either unary or binary
+            raise Exception(f"Unknown operation arity {len(op.operands)}")
+    elif isinstance(op, ast.VariableOperand):
+        offset_name = _get_offset_name(_variable_offset(op))
+        if offset_name:
+            return f"{op.name}[{offset_name}[n]]"
+        else:
+            return f"{op.name}[n]"
+    elif isinstance(op, ast.OpCall):
+        return op.name + "(" + _generate_op_text(op.arg, params, rewrite, group_index) + ")"
+    elif isinstance(op, str):
+        param_name = op[1:]
+        param = params[param_name]
+        if group_index is not None and param.group_name is not None:
+            return f"{param_name}[{group_index}]"
+        return f"{param_name}{param.likelihood_index}"
+    else:
+        return str(op)
+
+
+def _variable_offset(variable: ast.VariableOperand) -> Tuple[int, int]:
+    """Compute the offset tuple from a list of offset properties."""
+    experience_offset, development_offset = 0, 0
+
+    for elem in variable.modifiers:
+        if elem == "prev_dev":
+            development_offset += 1
+        elif elem == "prev_exp":
+            experience_offset += 1
+        else:
+            raise Exception(f"Unknown modifier {elem}")
+
+    return experience_offset, development_offset
+
+
+def _get_offset_name(offset: Tuple[int, int]) -> Optional[str]:
+    """Get the name of the Stan variable that has the appropriate offset indices."""
+    if offset == (0, 0):
+        return None
+
+    exp_offset, dev_offset = offset
+    return "Lag" + "T" * exp_offset + "D" * dev_offset
+
+
+# Scopes a subexpression can be evaluated in, from cheapest to most expensive. Group-scoped
+# subexpressions carry their group name alongside the scope.
+CONSTANT_SCOPE = "constant"
+SCALAR_SCOPE = "scalar"
+GROUP_SCOPE = "group"
+CELL_SCOPE = "cell"
+Scope = Tuple[str, Optional[str]]
+
+
+@dataclass
+class LoopDefinitions(object):
+    """Stan code for a likelihood's mean and variance loop after hoisting and sharing.
+
+    Fields:
+        declarations: Local declarations made before the loop over cells.
+        hoisted: Statements that run once before the loop over cells.
+        shared: Local definitions at the top of the loop body, shared by mean and variance.
+        mean: The expression for the mean of cell `n`.
+        variance: The expression for the variance of cell `n`.
+    """
+
+    declarations: List[str] = field(default_factory=list)
+    hoisted: List[str] = field(default_factory=list)
+    shared: List[str] = field(default_factory=list)
+    mean: str = ""
+    variance: str = ""
+
+
+def optimize_definitions(
+    namespace: str,
+    mean_def: ast.Operand,
+    variance_def: ast.Operand,
+    params: Dict[str, Parameter],
+) -> LoopDefinitions:
+    """Generate the mean and variance definitions of a likelihood, moving repeated work out of
+    the per-cell loop.
+
+    Subexpressions that depend only on scalar parameters are computed once before the loop.
+    Subexpressions that depend only on parameters of a single group are computed once per
+    group level and gathered inside the loop. Remaining subexpressions that occur more than
+    once across the mean and variance are computed once per cell into a shared local. The
+    generated values are exactly those of the unoptimized code.
+    """
+    return _LoopOptimizer(namespace, params).optimize(mean_def, variance_def)
+
+
+class _LoopOptimizer(object):
+    def __init__(self, namespace: str, params: Dict[str, Parameter]):
+        self.namespace = namespace
+        self.params = params
+        self.result = LoopDefinitions()
+        self.hoisted_names: Dict[str, str] = {}
+        self.shared_names: Dict[str, str] = {}
+        self.shared_keys: Set[str] = set()
+
+    def optimize(self, mean_def: ast.Operand, variance_def: ast.Operand) -> LoopDefinitions:
+        self.shared_keys = self._select_shared([mean_def, variance_def])
+        self.result.mean = _generate_op_text(mean_def, self.params, self._rewrite_cell)
+        self.result.variance = _generate_op_text(variance_def, self.params, self._rewrite_cell)
+        return self.result
+
+    def _key(self, op: ast.Operand) -> str:
+        """Structural identity of a subexpression: its unoptimized Stan code."""
+        return _generate_op_text(op, self.params)
+
+    def _scope(self, op: ast.Operand) -> Scope:
+        if isinstance(op, ast.VariableOperand):
+            return CELL_SCOPE, None
+        elif isinstance(op, str):
+            group_name = self.params[op[1:]].group_name
+            return (GROUP_SCOPE, group_name) if group_name else (SCALAR_SCOPE, None)
+        elif isinstance(op, ast.Operation):
+            return _merge_scopes([self._scope(operand) for operand in op.operands])
+        elif isinstance(op, ast.OpCall):
+            return self._scope(op.arg)
+        else:
+            return CONSTANT_SCOPE, None
+
+    def _is_hoistable(self, op: ast.Operand) -> bool:
+        """Whether a subexpression is worth computing outside the per-cell loop."""
+        return _is_compound(op) and self._scope(op)[0] in (SCALAR_SCOPE, GROUP_SCOPE)
+
+    def _select_shared(self, defs: List[ast.Operand]) -> Set[str]:
+        """Pick the per-cell subexpressions that should be computed once and shared.
+
+        Candidates are taken largest first, and occurrences nested inside an already selected
+        subexpression only count once, so a shared subexpression never gets a redundant
+        shared local for each of its own parts.
+        """
+        counts = self._count_occurrences(defs, set())
+        candidates = sorted(
+            [key for key, count in counts.items() if count > 1], key=len, reverse=True
+        )
+        selected = set()
+        for key in candidates:
+            if self._count_occurrences(defs, selected)[key] > 1:
+                selected.add(key)
+        return selected
+
+    def _count_occurrences(self, defs: List[ast.Operand], selected: Set[str]) -> Counter:
+        counts = Counter()
+        visited = set()
+
+        def _visit(op):
+            if self._is_hoistable(op) or not isinstance(op, (ast.Operation, ast.OpCall)):
+                return
+            key = self._key(op)
+            counts[key] += 1
+            if key in selected:
+                if key in visited:
+                    return
+                visited.add(key)
+            for child in op.operands if isinstance(op, ast.Operation) else [op.arg]:
+                _visit(child)
+
+        for op in defs:
+            _visit(op)
+        return counts
+
+    def _rewrite_cell(self, op: ast.Operand) -> Optional[str]:
+        """Rewrite hook for code inside the per-cell loop."""
+        if self._is_hoistable(op):
+            scope, group_name = self._scope(op)
+            if scope == SCALAR_SCOPE:
+                return self._hoist_scalar(op)
+            return f"{self._hoist_group(op, group_name)}[{group_name}[n]]"
+
+        key = self._key(op)
+        if key not in self.shared_keys:
+            return None
+        if key not in self.shared_names:
+            # Generate the definition first so that nested shared locals are defined before it
+            text = _generate_op_text(op, self.params, self._rewrite_shared(key))
+            name = f"{self.namespace}__shared{len(self.shared_names) + 1}"
+            self.result.shared.append(f"real {name} = {text};")
+            self.shared_names[key] = name
+        return self.shared_names[key]
+
+    def _rewrite_shared(self, own_key: str) -> Rewrite:
+        def _rewrite(op):
+            # Don't let the definition of a shared local refer to itself
+            if self._key(op) == own_key:
+                return None
+            return self._rewrite_cell(op)
+        return _rewrite
+
+    def _rewrite_group(self, op: ast.Operand) -> Optional[str]:
+        """Rewrite hook for code inside a loop over group levels."""
+        if self._is_hoistable(op) and self._scope(op)[0] == SCALAR_SCOPE:
+            return self._hoist_scalar(op)
+        return None
+
+    def _hoist_scalar(self, op: ast.Operand) -> str:
+        key = self._key(op)
+        if key not in self.hoisted_names:
+            name = f"{self.namespace}__hoisted{len(self.hoisted_names) + 1}"
+            self.result.declarations.append(f"real {name};")
+            self.result.hoisted.append(f"{name} = {key};")
+            self.hoisted_names[key] = name
+        return self.hoisted_names[key]
+
+    def _hoist_group(self, op: ast.Operand, group_name: str) -> str:
+        key = self._key(op)
+        if key not in self.hoisted_names:
+            # Nested scalar subexpressions are hoisted first, so they're computed only once
+            text = _generate_op_text(op, self.params, self._rewrite_group, group_index="k")
+            name = f"{self.namespace}__hoisted{len(self.hoisted_names) + 1}"
+            self.result.declarations.append(f"array[{group_name}__count] real {name};")
+            self.result.hoisted.append(
+                f"for (k in 1:{group_name}__count) {{\n{name}[k] = {text};\n}}"
+            )
+            self.hoisted_names[key] = name
+        return self.hoisted_names[key]
+
+
+def _merge_scopes(scopes: List[Scope]) -> Scope:
+    """The scope of an expression built from subexpressions with the given scopes."""
+    group_names = {group_name for scope, group_name in scopes if scope == GROUP_SCOPE}
+    if any([scope == CELL_SCOPE for scope, _ in scopes]) or len(group_names) > 1:
+        return CELL_SCOPE, None
+    elif group_names:
+        return GROUP_SCOPE, group_names.pop()
+    elif any([scope == SCALAR_SCOPE for scope, _ in scopes]):
+        return SCALAR_SCOPE, None
+    else:
+        return CONSTANT_SCOPE, None
+
+
+def _is_compound(op: ast.Operand) -> bool:
+    """Whether an expression does enough work to be worth storing (negating a single parameter
+    or literal isn't)."""
+    if isinstance(op, ast.Operation) and len(op.operands) == 1:
+        return _is_compound(op.operands[0])
+    return isinstance(op, (ast.Operation, ast.OpCall))
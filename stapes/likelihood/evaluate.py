@@ -1,9 +1,8 @@
-from typing import Dict, Union
+from typing import Dict, Union, Any, Tuple
 
 import numpy as np
 
 from ..parse import ast
-from ..data import DataCoords, DataValue
 from ..parameter import Parameter
 
 
@@ -44,39 +43,81 @@ OP_CALLS = {
 }
 
 
-def evaluate_operand(
+def evaluate_operand_on_cells(
     operand: ast.Operand,
     params: Dict[str, Parameter],
-    state: np.random.Generator,
-    data: Dict[DataCoords, DataValue],
-    coords: DataCoords,
+    param_values: Dict[str, np.ndarray],
+    variable_values: Dict[str, np.ndarray],
+    stan_data: Dict[str, Any],
 ) -> Union[np.ndarray, float]:
-    """Evaluate a single Operand in a likelihood expression at a single predicted cell."""
+    """Evaluate a single Operand in a likelihood expression at every core cell at once.
+
+    This mirrors the Stan code generated for the likelihood loop. Parameter draws in
+    `param_values` have draws along the first axis; variable values are either a (T,) array of
+    observed values or a (draws x T) array when imputed values vary by draw. The result is
+    broadcastable against a (draws x N) array.
+    """
     if isinstance(operand, ast.VariableOperand):
-        # If it's a variable, unpack it into a variable name and offset
-        variable = operand.name
+        # Variables are read through the offset lookup that matches their modifiers
         dev_offset = sum([1 if mod == "prev_dev" else 0 for mod in operand.modifiers])
         exp_offset = sum([1 if mod == "prev_exp" else 0 for mod in operand.modifiers])
-        _, slc, dev, exp = coords
-        # Then use data_accessor to get the value of the variable for this cell
-        return data[(variable, slc, dev-dev_offset, exp-exp_offset)]
+        values = variable_values[operand.name]
+        if (exp_offset, dev_offset) == (0, 0):
+            return values[..., :stan_data["N"]]
+        lookup_name = "Lag" + "T" * exp_offset + "D" * dev_offset
+        return values[..., np.asarray(stan_data[lookup_name]) - 1]
+    elif isinstance(operand, float):
+        return operand
+    elif isinstance(operand, ast.Operation):
+        clean_sub_operands = [
+            evaluate_operand_on_cells(op, params, param_values, variable_values, stan_data)
+            for op in operand.operands
+        ]
+        return OPERATIONS[operand.operator](*clean_sub_operands)
+    elif isinstance(operand, ast.OpCall):
+        clean_arg = evaluate_operand_on_cells(
+            operand.arg, params, param_values, variable_values, stan_data
+        )
+        return OP_CALLS[operand.name](clean_arg)
+    elif isinstance(operand, str):
+        param_name = operand[1:]
+        return params[param_name].likelihood_values(param_values[param_name], stan_data)
+    else:
+        raise Exception(f"Unrecognized Operand type {operand.__class__.__name__}")
+
+
+def variable_reference(operand: ast.VariableOperand) -> Tuple[str, int, int]:
+    """The (variable, exp_offset, dev_offset) read by a variable operand."""
+    dev_offset = sum([1 if mod == "prev_dev" else 0 for mod in operand.modifiers])
+    exp_offset = sum([1 if mod == "prev_exp" else 0 for mod in operand.modifiers])
+    return operand.name, exp_offset, dev_offset
+
+
+def evaluate_operand_on_batch(
+    operand: ast.Operand,
+    param_values: Dict[str, np.ndarray],
+    variable_values: Dict[Tuple[str, int, int], np.ndarray],
+) -> Union[np.ndarray, float]:
+    """Evaluate a single Operand in a likelihood expression at a batch of predicted cells.
+
+    Every parameter and variable reference has already been gathered onto the batch:
+    `param_values` is keyed by parameter name and `variable_values` by the result of
+    `variable_reference`, each broadcastable against a (draws x cells) array.
+    """
+    if isinstance(operand, ast.VariableOperand):
+        return variable_values[variable_reference(operand)]
     elif isinstance(operand, float):
-        # If it's a float, it's a plain numeric literal.
         return operand
     elif isinstance(operand, ast.Operation):
-        # If it's an operation, evaluate each of the operands, then apply the operator
         clean_sub_operands = [
-            evaluate_operand(op, params, state, data, coords) for op in operand.operands
+            evaluate_operand_on_batch(op, param_values, variable_values)
+            for op in operand.operands
         ]
         return OPERATIONS[operand.operator](*clean_sub_operands)
     elif isinstance(operand, ast.OpCall):
-        # If it's a function call, evaluate the operand, then apply the function
-        clean_arg = evaluate_operand(operand.arg, params, state, data, coords)
+        clean_arg = evaluate_operand_on_batch(operand.arg, param_values, variable_values)
         return OP_CALLS[operand.name](clean_arg)
     elif isinstance(operand, str):
-        # If it's a string, it's the name of a parameter. Clean up the parameter name,
-        # then evaluate it at the current cell.
-        param = params[operand[1:]]
-        return param.evaluate(state, data, coords)
+        return param_values[operand[1:]]
     else:
         raise Exception(f"Unrecognized Operand type {operand.__class__.__name__}")
@@ -1,15 +1,20 @@
 from dataclasses import dataclass
-from typing import Set, Tuple, List, Dict, Optional
+from typing import Set, Tuple, List, Dict, Any, Optional
 from pathlib import Path
 
 import numpy as np
 
-from ..data import DataCoords, DataValue
 from ..parse import ast, recurse_over_variables, get_all_parameters
 from ..utils import StanCode, ConfigParameter, get_data_type, process_stem
 from ..parameter import Parameter
 from .random import variates_from_mean_variance
-from .evaluate import evaluate_operand
+from .evaluate import (
+    evaluate_operand_on_cells,
+    evaluate_operand_on_batch,
+    variable_reference,
+)
+from .log_lik import mean_variance_log_lik
+from .codegen import optimize_definitions, _variable_offset, _generate_op_text, Rewrite
 
 FAMILY_NAME_LOOKUP = ["normal", "lognormal", "gamma"]
 FAMILY_INDEX_LOOKUP = {
@@ -42,6 +47,25 @@ class Likelihood(object):
             | recurse_over_variables(self.variance_def, lambda x: x.name)
         )
 
+    @property
+    def variable_offsets(self) -> Dict[str, Set[Tuple[int, int]]]:
+        """The offsets at which each variable is read, including the response itself."""
+        result = {self.variable: {(0, 0)}}
+        for name, offset in (
+            recurse_over_variables(self.mean_def, lambda x: (x.name, _variable_offset(x)))
+            | recurse_over_variables(self.variance_def, lambda x: (x.name, _variable_offset(x)))
+        ):
+            result.setdefault(name, set()).add(offset)
+        return result
+
+    @property
+    def references(self) -> Set[Tuple[str, int, int]]:
+        """The (variable, exp_offset, dev_offset) combinations read by the mean and variance."""
+        return (
+            recurse_over_variables(self.mean_def, variable_reference)
+            | recurse_over_variables(self.variance_def, variable_reference)
+        )
+
     @property
     def parameters(self) -> Set[str]:
         return get_all_parameters(self.mean_def) | get_all_parameters(self.variance_def)
@@ -57,81 +81,67 @@ class Likelihood(object):
             )
         ]
 
-    def stan_code(self, params: Dict[str, Parameter]) -> StanCode:
+    def stan_code(self, params: Dict[str, Parameter], family: Optional[int] = None) -> StanCode:
+        """Stan code for the likelihood.
+
+        By default the family is read from data and dispatched on at run time. If `family` is
+        given, the model block sums a vectorized log density for that family alone, and the
+        pointwise log-likelihood moves to generated quantities, so it's computed once per draw
+        rather than on every gradient evaluation.
+        """
+        definitions = optimize_definitions(self.variable, self.mean_def, self.variance_def, params)
         stem = process_stem(
             Path(__file__).resolve().parent / "likelihood.stem",
             self.variable,
             {
-                "mean_definition": _generate_op_text(self.mean_def, params),
-                "variance_definition": _generate_op_text(self.variance_def, params),
+                "hoisted_declarations": "\n".join(definitions.declarations),
+                "hoisted_definitions": "\n".join(definitions.hoisted),
+                "shared_definitions": "\n".join(definitions.shared),
+                "mean_definition": definitions.mean,
+                "variance_definition": definitions.variance,
+                "family": family,
+                "family_name": FAMILY_NAME_LOOKUP[family - 1] if family is not None else None,
             }
         )
         return stem.stan_code
 
-    def predict(
+    def prediction_definitions(
+        self, params: Dict[str, Parameter], rewrite: Rewrite
+    ) -> Tuple[str, str]:
+        """Stan expressions for the mean and variance of a predicted cell, with variable and
+        parameter references generated by `rewrite`."""
+        return (
+            _generate_op_text(self.mean_def, params, rewrite),
+            _generate_op_text(self.variance_def, params, rewrite),
+        )
+
+    def predict_batch(
         self,
-        params: Dict[str, Parameter],
-        state: np.random.Generator,
+        param_values: Dict[str, np.ndarray],
+        variable_values: Dict[Tuple[str, int, int], np.ndarray],
         distribution_id: int,
-        data: Dict[DataCoords, DataValue],
-        coords: DataCoords,
+        state: np.random.Generator,
+        shape: Tuple[int, int],
     ) -> np.ndarray:
-        mean = evaluate_operand(self.mean_def, params, state, data, coords)
-        variance = evaluate_operand(self.variance_def, params, state, data, coords)
+        """Draw predictions of the given (draws x cells) shape for a batch of cells whose
+        parameters and variables have already been gathered, as in `evaluate_operand_on_batch`."""
+        mean = evaluate_operand_on_batch(self.mean_def, param_values, variable_values)
+        variance = evaluate_operand_on_batch(self.variance_def, param_values, variable_values)
+        mean, variance = np.broadcast_to(mean, shape), np.broadcast_to(variance, shape)
         distribution = FAMILY_NAME_LOOKUP[distribution_id-1]
-        return variates_from_mean_variance(mean, variance, distribution, state)
-
-
-def _generate_op_text(op: ast.Operand, params: Dict[str, Parameter]) -> str:
-    """Recurse through an expression and generate the relevant Stan code."""
-    if isinstance(op, ast.Operation):
-        if len(op.operands) == 1:
-            # Unary operators are all prefix operators
-            op_text = _generate_op_text(op.operands[0], params)
-            return f"{op.operator}{op_text}"
-        elif len(op.operands) == 2:
-            # Binary operators are all infix operators
-            left_op_text = _generate_op_text(op.operands[0], params)
-            right_op_text = _generate_op_text(op.operands[1], params)
-            return f"({left_op_text} {op.operator} {right_op_text})"
-        else:
-            # All operators should be either unary or binary
-            raise Exception(f"Unknown operation arity {len(op.operands)}")
-    elif isinstance(op, ast.VariableOperand):
-        offset_name = _get_offset_name(_variable_offset(op))
-        if offset_name:
-            return f"{op.name}[{offset_name}[n]]"
-        else:
-            return f"{op.name}[n]"
-    elif isinstance(op, ast.OpCall):
-        return op.name + "(" + _generate_op_text(op.arg, params) + ")"
-    elif isinstance(op, str):
-        param_name = op[1:]
-        index_expr = params[param_name].likelihood_index
-        return f"{param_name}{index_expr}"
-    else:
-        return str(op)
-
-
-def _variable_offset(variable: ast.VariableOperand) -> Tuple[int, int]:
-    """Compute the offset tuple from a list of offset properties."""
-    experience_offset, development_offset = 0, 0
-
-    for elem in variable.modifiers:
-        if elem == "prev_dev":
-            development_offset += 1
-        elif elem == "prev_exp":
-            experience_offset += 1
-        else:
-            raise Exception(f"Unknown modifier {elem}")
-
-    return experience_offset, development_offset
-
-
-def _get_offset_name(offset: Tuple[int, int]) -> Optional[str]:
-    """Get the name of the Stan variable that has the appropriate offset indices."""
-    if offset == (0, 0):
-        return None
-
-    exp_offset, dev_offset = offset
-    return "Lag" + "T" * exp_offset + "D" * dev_offset
+        return variates_from_mean_variance(mean.copy(), variance.copy(), distribution, state)
+
+    def log_lik(
+        self,
+        params: Dict[str, Parameter],
+        param_values: Dict[str, np.ndarray],
+        variable_values: Dict[str, np.ndarray],
+        stan_data: Dict[str, Any],
+        distribution_id: int,
+    ) -> np.ndarray:
+        """Pointwise log-likelihood over (draws x N) core cells, as computed in `.log_lik`."""
+        args = (params, param_values, variable_values, stan_data)
+        mean = evaluate_operand_on_cells(self.mean_def, *args)
+        variance = evaluate_operand_on_cells(self.variance_def, *args)
+        obs = evaluate_operand_on_cells(ast.VariableOperand(self.variable, []), *args)
+        return mean_variance_log_lik(obs, mean, variance, distribution_id)
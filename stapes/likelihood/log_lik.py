@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.special
+
+HALF_LOG_2PI = 0.5 * np.log(2 * np.pi)
+
+
+def mean_variance_log_lik(
+    obs: np.ndarray,
+    obs_mean: np.ndarray,
+    obs_variance: np.ndarray,
+    family: int,
+) -> np.ndarray:
+    """Pointwise log-likelihood of observations under a mean/variance parameterized family.
+
+    This is the NumPy counterpart of `mean_variance_log_lik` in `UTIL_FUNCTIONS`, and it maps
+    mean and variance onto each family's native parameters in exactly the same way. All inputs
+    are broadcast against each other.
+    """
+    if family == 1:
+        # Family 1 is normal.
+        scale_param = np.sqrt(obs_variance)
+        z = (obs - obs_mean) / scale_param
+        return -HALF_LOG_2PI - np.log(scale_param) - 0.5 * z ** 2
+    elif family == 2:
+        # Family 2 is log-normal.
+        mean_sq = obs_mean ** 2
+        loc_param = np.log(mean_sq / np.sqrt(mean_sq + obs_variance))
+        scale_param = np.sqrt(np.log(1 + obs_variance / mean_sq))
+        log_obs = np.log(obs)
+        z = (log_obs - loc_param) / scale_param
+        return -HALF_LOG_2PI - np.log(scale_param) - log_obs - 0.5 * z ** 2
+    elif family == 3:
+        # Family 3 is gamma.
+        shape_param = obs_mean ** 2 / obs_variance
+        rate_param = obs_mean / obs_variance
+        return (
+            shape_param * np.log(rate_param)
+            - scipy.special.gammaln(shape_param)
+            + (shape_param - 1) * np.log(obs)
+            - rate_param * obs
+        )
+    else:
+        raise Exception(
+            "Positive variables modeled with mean and variance are not compatible with "
+            f"family={family}"
+        )
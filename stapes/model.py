@@ -1,24 +1,92 @@
-from typing import Dict, Tuple, Optional, List, Any
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Tuple, Optional, List, Any, Set, Iterable, Union
+import asyncio
+import functools
+import math
+import numbers
+import pickle
 import tempfile
+from pathlib import Path
 
 import cmdstanpy as csp
 import numpy as np
+import pandas as pd
 
 from .parameter import Parameter, make_parameter
 from .likelihood import Likelihood, FAMILY_INDEX_LOOKUP
 from .parse import parse_text
-from .utils import StanCode, ConfigParameter, UTIL_FUNCTIONS
-from .variable import get_variable_stan
-from .data import build_stan_data, DataCoords, DataValue
+from .utils import (
+    StanCode,
+    StanCodeBuilder,
+    ConfigParameter,
+    UTIL_FUNCTIONS,
+    demunge_samples,
+    bake_constants,
+    add_profiles,
+    check_data_constraints,
+)
+from .variable import get_variable_stan, variable_log_prior
+from .data import (
+    build_stan_data,
+    StanDataBuilder,
+    DataCoords,
+    DataValue,
+    COORDINATE_NAMES,
+    level_gaps,
+    triangle_id_problem,
+)
+from .data.data import build_indices
+from .diagnostics import (
+    loo,
+    LooResult,
+    reweight,
+    SensitivityResult,
+    efficiency_report,
+    EfficiencyReport,
+    profile_table,
+)
+from .optimize import JointDensity, fit_laplace
+from .results import PredictionResult, ParameterDraws
+from .prediction import PredictionPlan, generated_quantities_code, generated_quantities_data
+from .cmdstan import (
+    stan_file_for,
+    stan_data_file,
+    run_data_file,
+    compile_async,
+    sample_async,
+    EventCallback,
+    sample_until_converged,
+    check_staged_kwargs,
+    ConvergenceTargets,
+    SamplingReport,
+)
+
+
+class ValidationException(Exception):
+    """Raised when a model can't be fitted to the given data and configuration, before anything
+    is compiled or sampled. `problems` describes each of the problems found."""
+    def __init__(self, problems: List[str]):
+        super().__init__(problems)
+        self.problems = problems
+
+    def __str__(self) -> str:
+        return "\n".join(["The model can't be fitted:"] + [f"- {p}" for p in self.problems])
 
 
 class Model(object):
-    """A completely specified Stapes model."""
+    """A completely specified Stapes model.
+
+    The model is only a specification, and fitting never changes it: `fit` returns a separate,
+    read-only `FittedModel`. One model can be fitted to many datasets and configurations at
+    once, from as many threads as needed.
+    """
     def __init__(self, parameters: Dict[str, Parameter], likelihoods: Dict[str, Likelihood]):
         self.parameters = parameters
         self.likelihoods = likelihoods
-        self.train_data: Dict[DataCoords, DataValue] = {}
-        self.distribution_ids = {}
+        # Resolved configuration values compiled into the Stan program as constants
+        self.constants: Dict[str, float] = {}
+        # Whether the Stan program wraps each component's statements in a profile block
+        self.is_profiled = False
 
     @property
     def offsets(self) -> List[Tuple[int, int]]:
@@ -26,7 +94,7 @@ class Model(object):
         result = set()
         for lik in self.likelihoods.values():
             result |= lik.offsets
-        return list(result)
+        return sorted(result)
 
     @property
     def variables(self) -> List[str]:
@@ -36,7 +104,35 @@ class Model(object):
             result |= param.variables
         for lik in self.likelihoods.values():
             result |= lik.variables
-        return list(result)
+        return sorted(result)
+
+    @property
+    def references(self) -> Dict[str, Dict[str, Set[Tuple[int, int]]]]:
+        """For each likelihood, the offsets at which each variable is read."""
+        return {name: lik.variable_offsets for name, lik in self.likelihoods.items()}
+
+    @property
+    def core_parameters(self) -> List[str]:
+        """Names of the Stan variables marked `$core` in the parameter stems."""
+        result = []
+        for param in self.parameters.values():
+            result += param.stem.stan_parameters
+        return result
+
+    @property
+    def parameterizations(self) -> Dict[str, str]:
+        """How each parameter with a choice of parameterizations is sampled. Automatic choices
+        appear on a fitted model, and are kept when it's refitted."""
+        return {
+            name: param.chosen_parameterization
+            for name, param in self.parameters.items()
+            if param.chosen_parameterization is not None
+        }
+
+    @property
+    def awaits_data(self) -> bool:
+        """Whether the Stan program can't be generated until the model has seen training data."""
+        return any([param.awaits_data for param in self.parameters.values()])
 
     @property
     def config_parameters(self) -> List[ConfigParameter]:
@@ -52,17 +148,12 @@ class Model(object):
 
     @property
     def stan_code(self) -> StanCode:
-        """Stan source code representation of the Marrow model."""
-        result = StanCode(data="int<lower=1> N;\nint<lower=N> T;")
-        for offset in self.offsets:
-            result += _offset_to_stan_code(offset)
-        for variable in self.variables:
-            result += get_variable_stan(variable).stan_code
-        for param in self.parameters.values():
-            result += param.stan_code
-        for lik in self.likelihoods.values():
-            result += lik.stan_code(self.parameters)
-        return result
+        """Stan source code representation of the Marrow model.
+
+        Configuration values in `constants` are compiled in rather than read from data. Fixing a
+        likelihood family this way also specializes its log density to that family.
+        """
+        return self._build_stan_code(self.constants, self.is_profiled)
 
     @property
     def full_stan_code(self) -> str:
@@ -71,26 +162,347 @@ class Model(object):
 
     @property
     def stan_model(self) -> csp.CmdStanModel:
-        # Write the Stan code to a tempfile so cmdstanpy can pick it up
-        with tempfile.NamedTemporaryFile(suffix=".stan", delete=False) as tmp:
-            tmp.write(str(self.full_stan_code).encode("utf-8"))
-            tmp_name = tmp.name
-        return csp.CmdStanModel(stan_file=tmp_name)
+        return self._build_stan_model(self.constants, self.is_profiled)
 
-    def fit(self, train_data, config: Dict[str, float]):
-        self.train_data = train_data
-        stan_data = build_stan_data(train_data, self.offsets)
-        stan_model = self.stan_model
-        final_config = self.resolve_config(config)
-        for lik in self.likelihoods:
-            self.distribution_ids[lik] = final_config[f"{lik}__family"]
-        fit = stan_model.sample(data={**stan_data, **final_config})
-        samples = fit.stan_variables()
-        for param in self.parameters.values():
-            param.set_samples(samples)
+    def data_builder(self) -> StanDataBuilder:
+        """A builder for the model's Stan data, which can be extended as training data arrives
+        and passed to `fit` in place of the training data."""
+        return StanDataBuilder(self.offsets, self.references)
+
+    def _build_stan_code(self, constants: Dict[str, float], is_profiled: bool = False) -> StanCode:
+        def _component(code, name):
+            return add_profiles(code, name) if is_profiled else code
+
+        builder = StanCodeBuilder().add(StanCode(data="int<lower=1> N;\nint<lower=N> T;"))
+        for offset in self.offsets:
+            builder += _offset_to_stan_code(offset)
+        for variable in self.variables:
+            builder += _component(get_variable_stan(variable).stan_code, f"variable:{variable}")
+        for name, param in self.parameters.items():
+            builder += _component(param.stan_code, f"parameter:{name}")
+        for name, lik in self.likelihoods.items():
+            lik_code = lik.stan_code(self.parameters, constants.get(f"{name}__family"))
+            builder += _component(lik_code, f"likelihood:{name}")
+        return bake_constants(builder.build(), constants)
+
+    def _build_stan_model(
+        self, constants: Dict[str, float], is_profiled: bool = False
+    ) -> csp.CmdStanModel:
+        # Write the Stan code to a content-addressed file, so identical programs share a
+        # compiled executable
+        code = UTIL_FUNCTIONS + str(self._build_stan_code(constants, is_profiled))
+        return csp.CmdStanModel(stan_file=str(stan_file_for(code)))
+
+    def fit(
+        self,
+        train_data,
+        config: Dict[str, float],
+        backend: str = "stan",
+        targets: Optional[ConvergenceTargets] = None,
+        specialize: Union[bool, Iterable[str]] = False,
+        profile: bool = False,
+        **kwargs,
+    ) -> "FittedModel":
+        """Fit the model to training data, returning the fit as a new `FittedModel`.
+
+        The default "stan" backend samples with CmdStan, passing `kwargs` on to
+        `CmdStanModel.sample`. If `targets` is given, it samples in stages instead, stopping as
+        soon as the core parameters meet the R-hat and ESS targets, and records what it did in
+        the fit's `sampling_report`. The "map" backend needs no compiler: it maximizes the joint
+        log density in NumPy and draws from a Laplace approximation, passing `kwargs` on to
+        `fit_laplace`. Either way, parameter samples end up in the same layout.
+
+        By default the Stan program reads its whole configuration from data, so one executable
+        serves every configuration. If `specialize` is set, the likelihood families are compiled
+        into the program instead, as are the values of any configuration parameters it names.
+        Each specialization is a different program, and so gets its own cached executable.
+
+        If `profile` is set, the statements of every variable, parameter and likelihood are
+        wrapped in Stan profile blocks, and the timings CmdStan records for them end up in the
+        fit's `profile` table. Profiling needs a single CmdStan run, so it only works with the
+        "stan" backend and without `targets`.
+
+        `train_data` may also be a `StanDataBuilder` from `data_builder`, whose Stan data is then
+        used as is, so a refit after new cells arrive only has to process those cells.
+
+        Before anything is compiled or sampled, the fit is checked as in `validate`, raising a
+        `ValidationException` that lists every problem found.
+        """
+        if profile and (backend != "stan" or targets is not None):
+            raise Exception("Profiling needs the stan backend without convergence targets")
+        if targets is not None:
+            # Checked here as well as when sampling, so the mistake is caught before compiling
+            check_staged_kwargs(kwargs)
+        fitted = self._prepare_fit(train_data, config, specialize, profile)
+        if backend == "stan" and targets is not None:
+            samples, sampling_report = sample_until_converged(
+                fitted.stan_model,
+                str(run_data_file(stan_data_file(fitted.stan_data), fitted.resolved_config)),
+                fitted.core_parameters,
+                targets,
+                **kwargs,
+            )
+            fitted._set_samples(samples, sampling_report=sampling_report)
+        elif backend == "stan":
+            data_file = run_data_file(stan_data_file(fitted.stan_data), fitted.resolved_config)
+            if profile:
+                kwargs = {**kwargs, "save_profile": True}
+            stan_fit = fitted.stan_model.sample(data=str(data_file), **kwargs)
+            fitted._set_samples(
+                stan_fit.stan_variables(),
+                stan_fit=stan_fit,
+                profile_files=stan_fit.runset.profile_files if profile else None,
+            )
+        elif backend == "map":
+            density = JointDensity(
+                fitted.parameters,
+                fitted.likelihoods,
+                fitted.variables,
+                fitted.stan_data,
+                fitted.resolved_config,
+            )
+            fitted._set_samples(fit_laplace(density, **kwargs).samples)
+        else:
+            raise Exception(f"Unrecognized fit backend {backend}")
+        return fitted
+
+    async def fit_async(
+        self,
+        train_data,
+        config: Dict[str, float],
+        on_event: Optional[EventCallback] = None,
+        specialize: Union[bool, Iterable[str]] = False,
+        profile: bool = False,
+        **kwargs,
+    ) -> "FittedModel":
+        """Fit the model with CmdStan without blocking the event loop.
+
+        Compilation starts immediately and runs alongside data preparation, which is offloaded
+        to the default executor. Progress from `make` and from every chain is streamed to
+        `on_event`. Cancelling the task kills the compiler or the sampler processes. `kwargs`
+        are passed on to `sample_async`, and `specialize` and `profile` work as in `fit`.
+
+        The configuration is validated before compilation starts, and a compilation that's
+        underway is cancelled if the training data fails validation.
+        """
+        loop = asyncio.get_running_loop()
+        fitted = None
+        if self.awaits_data:
+            # The program depends on the data, so it has to be prepared before compiling
+            fitted = await loop.run_in_executor(
+                None, self._prepare_fit, train_data, config, specialize, profile
+            )
+            code = fitted.full_stan_code
+        else:
+            # The program only depends on the specialized configuration, so resolve that first
+            _, constants = self._check_config(config, specialize)
+            code = UTIL_FUNCTIONS + str(self._build_stan_code(constants, profile))
+        compile_task = asyncio.ensure_future(compile_async(stan_file_for(code), on_event))
+        try:
+            if fitted is None:
+                fitted = await loop.run_in_executor(
+                    None, self._prepare_fit, train_data, config, specialize, profile
+                )
+            exe_file = await compile_task
+        except BaseException:
+            compile_task.cancel()
+            await asyncio.gather(compile_task, return_exceptions=True)
+            raise
+
+        output_dir = tempfile.mkdtemp(prefix="stapes-")
+        data_file = await loop.run_in_executor(
+            None, lambda: run_data_file(stan_data_file(fitted.stan_data), fitted.resolved_config)
+        )
+        stan_fit = await sample_async(
+            exe_file, data_file, output_dir, on_event=on_event, save_profile=profile, **kwargs
+        )
+        samples = await loop.run_in_executor(None, stan_fit.stan_variables)
+        profile_files = sorted(Path(output_dir).glob("*-profile.csv")) if profile else None
+        fitted._set_samples(samples, stan_fit=stan_fit, profile_files=profile_files)
+        return fitted
+
+    def validate(
+        self,
+        train_data,
+        config: Dict[str, float],
+        specialize: Union[bool, Iterable[str]] = False,
+    ):
+        """Check that the model can be fitted to `train_data` with `config`, raising a
+        `ValidationException` that lists every problem found. Nothing is compiled or sampled.
+
+        The configuration is checked for unrecognized names, unrecognized families and values
+        outside the range of their data types, and the parameters for groupings by anything but
+        a coordinate variable. Triangle ids must be small enough to combine into composite
+        coordinate ids. The Stan data is then built and checked: there must be cells with data at
+        every offset the model reads, groups of parameters that can't extrapolate to new levels
+        mustn't skip levels, and the data must meet the sizes, types and bounds declared in the
+        program, such as variables declared non-negative in their stems.
+        """
+        self._prepare_fit(train_data, config, specialize)
+
+    def _prepare_fit(
+        self,
+        train_data,
+        config: Dict[str, float],
+        specialize: Union[bool, Iterable[str]] = False,
+        profile: bool = False,
+    ) -> "FittedModel":
+        """Validate and build the Stan data and resolve the configuration for a fit, returning
+        the fitted model still waiting for its samples."""
+        final_config, constants = self._check_config(config, specialize)
+        if isinstance(train_data, StanDataBuilder):
+            if train_data.offsets != self.offsets or train_data.references != self.references:
+                raise Exception("The data builder was made for a different model")
+            stan_data = train_data.stan_data
+            builder = train_data
+            # The builder extends its training data in place, so the fit keeps a copy
+            train_data = dict(train_data.train_data)
+        else:
+            # Building the data would fail on triangle ids that can't form composite ids
+            problem = triangle_id_problem([key[1] for key in train_data])
+            if problem is not None:
+                raise ValidationException([problem])
+            stan_data = build_stan_data(train_data, self.offsets, self.references)
+            builder = None
+
+        problems = self._data_problems(train_data, stan_data, final_config, constants, builder)
+        if problems:
+            raise ValidationException(problems)
+        parameters = {name: param.unfitted_copy() for name, param in self.parameters.items()}
+        for param in parameters.values():
+            param.adapt_to_data(stan_data)
+        return FittedModel(
+            parameters,
+            self.likelihoods,
+            train_data,
+            stan_data,
+            config,
+            final_config,
+            constants,
+            profile,
+        )
+
+    def _check_config(
+        self, config: Dict[str, Any], specialize: Union[bool, Iterable[str]] = False
+    ) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Resolve a configuration and the constants to specialize the program with, raising a
+        `ValidationException` for any problems with them or with the model's parameters, which
+        can be found without the training data."""
+        final_config, errors = self._resolve_config(config)
+        constants, specialize_problems = self._constants(final_config, specialize)
+        problems = [error.args[0] for error in errors] + specialize_problems
+        for name, param in self.parameters.items():
+            if param.group_name is not None and param.group_name not in COORDINATE_NAMES:
+                problems.append(
+                    f"Parameter {name} is grouped by {param.group_name}, which isn't a "
+                    f"coordinate variable ({', '.join(COORDINATE_NAMES)})"
+                )
+        if problems:
+            raise ValidationException(problems)
+        return final_config, constants
+
+    def _data_problems(
+        self,
+        train_data: Dict[DataCoords, DataValue],
+        stan_data: Dict[str, Any],
+        final_config: Dict[str, float],
+        constants: Dict[str, float],
+        builder: Optional[StanDataBuilder] = None,
+    ) -> List[str]:
+        """Describe the problems with the Stan data for a fit."""
+        if stan_data["N"] == 0:
+            return [self._empty_core_problem(train_data)]
+
+        problems = []
+        for name, param in self.parameters.items():
+            if param.group_name is None or param.new_level_rng() is not None:
+                continue
+            gaps = level_gaps(param.group_name, stan_data[f"{param.group_name}__levels"])
+            if gaps:
+                listed = "; ".join(gaps[:5])
+                if len(gaps) > 5:
+                    listed += f" and {len(gaps) - 5} more"
+                problems.append(
+                    f"Parameter {name} has a value per {param.group_name}, but no core cells "
+                    f"have {listed}, so it would have no estimate for them"
+                )
+
+        full_index = []
+
+        def _describe(size_expr: str, ndx: int) -> Optional[str]:
+            # Arrays over N follow the core cells, which lead the full index of arrays over T
+            if size_expr not in ["N", "T"]:
+                return None
+            if not full_index:
+                full_index.extend(
+                    builder.full_index if builder is not None
+                    else build_indices(train_data, self.offsets, self.references).full_index
+                )
+            tri_id, exp_id, dev_id = full_index[ndx]
+            return f"cell (TriangleId {tri_id}, ExpPeriodId {exp_id}, DevLagId {dev_id})"
+
+        code = self._build_stan_code(constants)
+        problems += check_data_constraints(code, {**stan_data, **final_config}, _describe)
+        return problems
+
+    def _empty_core_problem(self, train_data: Dict[DataCoords, DataValue]) -> str:
+        cells = set([key[1:] for key in train_data])
+        if not cells:
+            return "There's no training data"
+
+        def _has_data(cell, offset):
+            tri_id, exp_id, dev_id = cell
+            return (tri_id, exp_id - offset[0], dev_id - offset[1]) in cells
+
+        complete = [cell for cell in cells if all([_has_data(cell, o) for o in self.offsets])]
+        if complete:
+            return (
+                f"{len(complete)} cells have data at every offset the model reads, but neither "
+                f"they nor the cells they read have an observed {' or '.join(self.likelihoods)}"
+            )
+        counts = [
+            f"{sum([_has_data(cell, offset) for cell in cells])} at offset {offset}"
+            for offset in self.offsets
+        ]
+        return (
+            f"No cell has training data at every (exp, dev) offset the model reads. Of the "
+            f"{len(cells)} cells with data, {', '.join(counts)}"
+        )
+
+    def _constants(
+        self, final_config: Dict[str, float], specialize: Union[bool, Iterable[str]]
+    ) -> Tuple[Dict[str, float], List[str]]:
+        """The resolved configuration values to compile into the program for a fit, and a
+        description of each problem with `specialize`."""
+        if not specialize:
+            return {}, []
+        if isinstance(specialize, str):
+            # A string is iterable, but only ever a mistake for a list of names
+            return {}, [
+                f"specialize must be True or a list of configuration parameter names, not the "
+                f"string {specialize!r}"
+            ]
+        names = [f"{lik}__family" for lik in self.likelihoods]
+        problems = []
+        if specialize is not True:
+            for name in specialize:
+                if name not in final_config:
+                    problems.append(f"Unrecognized configuration parameter {name} to specialize")
+                else:
+                    names.append(name)
+        return {name: final_config[name] for name in names}, problems
 
     def resolve_config(self, config: Dict[str, Any]) -> Dict[str, float]:
         """Perform clean-up and validation work on a configuration with respect to a given model."""
+        final_config, errors = self._resolve_config(config)
+        if errors:
+            raise errors[0]
+        return final_config
+
+    def _resolve_config(self, config: Dict[str, Any]) -> Tuple[Dict[str, float], List[Exception]]:
+        """Resolve a configuration like `resolve_config`, collecting an error for each problem
+        instead of raising the first."""
+        errors: List[Exception] = []
         final_config = {}
         bounds = {}
         for param in self.config_parameters:
@@ -100,45 +512,373 @@ class Model(object):
         for name, value in config.items():
             # Make sure the configuration element is valid
             if name not in final_config:
-                raise KeyError(f"Unrecognized configuration parameter {name} supplied")
+                errors.append(KeyError(f"Unrecognized configuration parameter {name} supplied"))
+                continue
 
             # If it's a family parameter, map to the appropriate integer
             if name[-8:] == "__family":
-                try:
-                    final_config[name] = FAMILY_INDEX_LOOKUP[value.lower()]
-                except KeyError:
-                    raise KeyError(f"Unrecognized distribution family {value} supplied")
+                family = value.lower() if isinstance(value, str) else None
+                if family not in FAMILY_INDEX_LOOKUP:
+                    errors.append(KeyError(
+                        f"Unrecognized distribution family {value} supplied for {name} "
+                        f"(expected one of {', '.join(FAMILY_INDEX_LOOKUP)})"
+                    ))
+                    continue
+                final_config[name] = FAMILY_INDEX_LOOKUP[family]
                 continue
 
-            # Make sure the supplied value falls within the bounds
+            # Make sure the supplied value is a number within the bounds
             min_value, max_value, inv_transform = bounds[name]
-            if value <= min_value or value >= max_value:
-                raise ValueError(
-                    f"Configuration parameter {name} must be " "between {min_value} and {max_value}"
+            if isinstance(value, bool) or not isinstance(value, numbers.Real) or math.isnan(value):
+                errors.append(
+                    ValueError(f"Configuration parameter {name} must be a number, not {value!r}")
                 )
+                continue
+            if value <= min_value or value >= max_value:
+                errors.append(ValueError(
+                    f"Configuration parameter {name} must be between {min_value} and "
+                    f"{max_value}, not {value}"
+                ))
+                continue
             final_config[name] = inv_transform(value)
 
-        return final_config
+        for name, value in final_config.items():
+            if value is None:
+                errors.append(KeyError(f"Configuration parameter {name} has no default value"))
+        return final_config, errors
+
+
+class FittedModel(Model):
+    """A model fitted to training data, with its configuration and posterior samples.
+
+    Fitted models are read-only, so predictions and diagnostics can run against one from many
+    threads at once. Refitting one returns another fitted model, with the same parameterization
+    choices, and leaves this one as it was.
+    """
+    def __init__(
+        self,
+        parameters: Dict[str, Parameter],
+        likelihoods: Dict[str, Likelihood],
+        train_data: Dict[DataCoords, DataValue],
+        stan_data: Dict[str, Any],
+        config: Dict[str, Any],
+        resolved_config: Dict[str, float],
+        constants: Dict[str, float],
+        is_profiled: bool = False,
+    ):
+        super().__init__(parameters, likelihoods)
+        self.train_data = train_data
+        self.stan_data = stan_data
+        self.config = config
+        self.resolved_config = resolved_config
+        self.constants = constants
+        self.is_profiled = is_profiled
+        self.distribution_ids = {lik: resolved_config[f"{lik}__family"] for lik in likelihoods}
+        self.variable_samples: Dict[str, Dict[str, np.ndarray]] = {}
+        self.sampling_report: Optional[SamplingReport] = None
+        self.stan_fit: Optional[csp.CmdStanMCMC] = None
+        # Timings of each profile block, for fits with `profile` set
+        self.profile: Optional[pd.DataFrame] = None
+
+    def __setattr__(self, name: str, value: Any):
+        if self.__dict__.get("_is_frozen", False):
+            raise AttributeError(f"Fitted models are read-only; can't set {name}")
+        super().__setattr__(name, value)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The CmdStan fit refers to output files that may not exist where the model is loaded;
+        # the samples drawn from it are kept
+        return {**self.__dict__, "stan_fit": None}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+
+    def _set_samples(
+        self,
+        samples: Dict[str, np.ndarray],
+        stan_fit: Optional[csp.CmdStanMCMC] = None,
+        sampling_report: Optional[SamplingReport] = None,
+        profile_files: Optional[List[Union[str, Path]]] = None,
+    ):
+        """Store posterior samples, keyed by Stan variable name, and freeze the model."""
+        for param in self.parameters.values():
+            param.set_samples(samples)
+            param.set_group_levels(self.stan_data)
+        self.variable_samples = {
+            name: demunge_samples(name, samples) for name in self.variables
+        }
+        self.stan_fit = stan_fit
+        self.sampling_report = sampling_report
+        if profile_files:
+            self.profile = profile_table(profile_files)
+        self._is_frozen = True
+
+    def log_lik(self, chunk_size: int = 1000) -> Tuple[np.ndarray, List[DataCoords]]:
+        """Pointwise log-likelihood of the observed training cells, evaluated in NumPy.
+
+        Returns a (draws x observations) matrix along with the data coordinates of each
+        observation. Draws are evaluated `chunk_size` at a time, so intermediate expression
+        values never exceed (chunk_size x N).
+        """
+        num_cells = self.stan_data["N"]
+        num_draws = next(iter(self.parameters.values())).samples[".."].shape[0]
+        # Coordinate ids in the Stan data are rank-encoded, so map them back to the originals
+        core_coords = list(zip(*[
+            [int(self.stan_data[f"{name}__levels"][idx - 1]) for idx in self.stan_data[name]]
+            for name in ["TriangleId", "ExpPeriodId", "DevLagId"]
+        ]))
+
+        # Only cells where the response was actually observed enter the comparison
+        columns = []
+        coords = []
+        for name in self.likelihoods:
+            missing_ids = set(self.stan_data[f"{name}__missing_ids"])
+            observed = [n for n in range(num_cells) if n + 1 not in missing_ids]
+            columns.append((name, observed))
+            coords += [(name, *core_coords[n]) for n in observed]
+
+        result = np.empty((num_draws, len(coords)))
+        for start in range(0, num_draws, chunk_size):
+            stop = min(start + chunk_size, num_draws)
+            draws = slice(start, stop)
+            param_values = {
+                name: param.samples[".."][draws] for name, param in self.parameters.items()
+            }
+            variable_values = {
+                name: self._variable_values(name, draws) for name in self.variables
+            }
+            col = 0
+            for name, observed in columns:
+                lik_values = self.likelihoods[name].log_lik(
+                    self.parameters,
+                    param_values,
+                    variable_values,
+                    self.stan_data,
+                    self.distribution_ids[name],
+                )
+                lik_values = np.broadcast_to(lik_values, (stop - start, num_cells))
+                result[draws, col:col + len(observed)] = lik_values[:, observed]
+                col += len(observed)
+
+        return result, coords
+
+    def loo(self, chunk_size: int = 1000) -> LooResult:
+        """Estimate the expected log predictive density with PSIS-LOO on the training data."""
+        log_lik, coords = self.log_lik(chunk_size)
+        return loo(log_lik, coords)
+
+    def prior_sensitivity(
+        self,
+        configs: Dict[str, Dict[str, Any]],
+        refit: bool = True,
+        backend: str = "stan",
+        max_workers: Optional[int] = None,
+        chunk_size: int = 1000,
+        **kwargs,
+    ) -> Dict[str, SensitivityResult]:
+        """See how the posterior moves under alternative configurations without refitting.
+
+        Each entry of `configs` overrides some of the fitted configuration values, such as
+        prior locations and scales, imputation priors or likelihood families. The stored draws
+        are reweighted by the ratio of the new to the old prior (and likelihood, if a family
+        changes) with Pareto-smoothed importance sampling. If `refit` is set, configurations
+        whose weights are unreliable are refitted in parallel, passing `backend` and `kwargs` on
+        to `fit`; unless they're specialized, the refits share the compiled executable.
+        """
+        base_log_prior = self._log_prior(self.resolved_config)
+        base_log_lik = None
+        results = {}
+        for label, overrides in configs.items():
+            resolved = self.resolve_config(overrides)
+            new_config = {
+                **self.resolved_config, **{name: resolved[name] for name in overrides}
+            }
+            log_ratios = self._log_prior(new_config) - base_log_prior
+            distribution_ids = {lik: new_config[f"{lik}__family"] for lik in self.likelihoods}
+            if distribution_ids != self.distribution_ids:
+                if base_log_lik is None:
+                    base_log_lik = self._total_log_lik(self.distribution_ids, chunk_size)
+                log_ratios += self._total_log_lik(distribution_ids, chunk_size) - base_log_lik
+            results[label] = reweight(log_ratios, overrides)
+
+        to_refit = [label for label, result in results.items() if not result.is_reliable]
+        if refit and to_refit:
+            if backend == "stan" and not kwargs.get("specialize"):
+                # Make sure the executable exists before the refits go looking for it. Only
+                # programs that read their whole configuration from data can be shared.
+                self._build_stan_model({}, kwargs.get("profile", False))
+
+            def _refit(label):
+                config = {**self.config, **configs[label]}
+                return self.fit(self.train_data, config, backend, **kwargs)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for label, model in zip(to_refit, executor.map(_refit, to_refit)):
+                    results[label].refit = model
+        return results
+
+    def _log_prior(self, config: Dict[str, float]) -> np.ndarray:
+        """Per-draw log prior density of the stored draws under a resolved configuration."""
+        result = 0.0
+        for name, param in self.parameters.items():
+            result = result + param.log_prior(param.samples, demunge_samples(name, config))
+        for name, samples in self.variable_samples.items():
+            if ".raw_missing_values" in samples:
+                result = result + variable_log_prior(
+                    name, samples, demunge_samples(name, config)
+                )
+        return result
+
+    def _total_log_lik(self, distribution_ids: Dict[str, int], chunk_size: int) -> np.ndarray:
+        """Per-draw log-likelihood of every core cell, under the given families."""
+        num_draws = next(iter(self.parameters.values())).samples[".."].shape[0]
+        result = np.zeros(num_draws)
+        for start in range(0, num_draws, chunk_size):
+            draws = slice(start, min(start + chunk_size, num_draws))
+            param_values = {
+                name: param.samples[".."][draws] for name, param in self.parameters.items()
+            }
+            variable_values = {
+                name: self._variable_values(name, draws) for name in self.variables
+            }
+            for name, lik in self.likelihoods.items():
+                lik_values = lik.log_lik(
+                    self.parameters,
+                    param_values,
+                    variable_values,
+                    self.stan_data,
+                    distribution_ids[name],
+                )
+                result[draws] += np.broadcast_to(
+                    lik_values, (draws.stop - draws.start, self.stan_data["N"])
+                ).sum(axis=1)
+        return result
+
+    async def predict_async(
+        self,
+        pred_coords: List[DataCoords],
+        pred_data: Dict[DataCoords, DataValue],
+        seed: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        **kwargs,
+    ) -> PredictionResult:
+        """Run `predict` in an executor, so it doesn't block the event loop. `kwargs` are
+        passed on to `predict`."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(self.predict, pred_coords, pred_data, seed, **kwargs)
+        )
+
+    def _variable_values(self, name: str, draws: slice) -> np.ndarray:
+        """Values of a variable as seen by the Stan program: imputed draws if any cells were
+        missing, otherwise the observed values."""
+        if name[-2:] == "Id":
+            # Coordinate variables are plain data over the core cells
+            return np.asarray(self.stan_data[name], dtype=float)
+        if self.stan_data[f"{name}__num_missing"] > 0:
+            return self.variable_samples[name][".."][draws]
+        return np.asarray(self.stan_data[f"{name}__raw"], dtype=float)
+
+    def plan_prediction(self, pred_coords: List[DataCoords]) -> PredictionPlan:
+        """Precompute the scenario-independent work of predicting `pred_coords`, so the plan
+        can be run repeatedly with different prediction data or seeds."""
+        return PredictionPlan(
+            self.parameters, self.likelihoods, self.distribution_ids, self.train_data, pred_coords
+        )
 
     def predict(
         self,
         pred_coords: List[DataCoords],
         pred_data: Dict[DataCoords, DataValue],
         seed: Optional[int] = None,
-    ) -> Dict[DataCoords, DataValue]:
-        random_state = np.random.default_rng(seed)
-        prediction_data = {**self.train_data, **pred_data}
-        predictions = {}
-        for coord in sorted(pred_coords, key=lambda x: (x[2] + x[3], x[2], x[0], x[1])):
-            name, tri_id, exp_id, dev_id = coord
-            if name not in self.likelihoods:
-                raise Exception(f"Cannot predict variable {name}")
-            pred_value = self.likelihoods[name].predict(
-                self.parameters, random_state, self.distribution_ids[name], prediction_data, coord
-            )
-            prediction_data[coord] = pred_value
-            predictions[coord] = pred_value
-        return predictions
+        chunk_size: Optional[int] = None,
+        dtype: np.dtype = np.float64,
+        backend: str = "numpy",
+    ) -> PredictionResult:
+        """Simulate draws of the requested cells, in calendar order so later cells can read
+        earlier predictions.
+
+        The default "numpy" backend predicts in Python. Set `chunk_size` to bound memory by
+        working through the posterior that many draws at a time, and `dtype=np.float32` to
+        halve the size of the stored predictions. The "stan" backend runs CmdStan's standalone
+        generated quantities over the draws of a CmdStan fit instead.
+        """
+        plan = self.plan_prediction(pred_coords)
+        if backend == "numpy":
+            return plan.run(pred_data, seed, chunk_size, dtype)
+        elif backend == "stan":
+            return self._predict_generated(plan, pred_data, seed, dtype)
+        else:
+            raise Exception(f"Unrecognized prediction backend {backend}")
+
+    def _predict_generated(
+        self,
+        plan: PredictionPlan,
+        pred_data: Dict[DataCoords, DataValue],
+        seed: Optional[int],
+        dtype: np.dtype,
+    ) -> PredictionResult:
+        """Predict the planned cells with a generated quantities program run over the fit."""
+        if self.stan_fit is None:
+            raise Exception("Prediction with the stan backend needs a single CmdStan fit")
+        builder = StanCodeBuilder().add(self.stan_code).add(generated_quantities_code(plan))
+        code = UTIL_FUNCTIONS + str(builder.build())
+        gq_model = csp.CmdStanModel(stan_file=str(stan_file_for(code)))
+        data = str(run_data_file(
+            stan_data_file(self.stan_data),
+            {**self.resolved_config, **generated_quantities_data(plan, pred_data)},
+        ))
+        # The fit is passed positionally, since its keyword changed between cmdstanpy versions
+        gq_fit = gq_model.generate_quantities(data, self.stan_fit, seed=seed)
+        values = gq_fit.stan_variable("gq")
+        return PredictionResult(values.T.astype(dtype), plan.coords)
+
+    def efficiency_report(self) -> EfficiencyReport:
+        """Bulk and tail ESS, ESS per second of sampling, tree depth, gradient evaluations per
+        draw and divergences for every core component of every parameter of the stored CmdStan
+        fit, such as a factor's `__mu` and `__sigma` as well as its levels."""
+        if self.stan_fit is None:
+            raise Exception("An efficiency report needs a single CmdStan fit")
+        num_chains = self.stan_fit.chains
+        draws = {}
+        for name, param in self.parameters.items():
+            for stan_name in param.stem.stan_parameters:
+                key = ".." if stan_name == name else "." + stan_name[len(name) + 2:]
+                values = param.samples[key]
+                draws[stan_name] = values.reshape(num_chains, -1, *values.shape[1:])
+        # Sampler variables come back as (draws x chains)
+        sampler_variables = {
+            name: np.asarray(values).reshape(values.shape[0], num_chains).T
+            for name, values in self.stan_fit.method_variables().items()
+        }
+        return efficiency_report(
+            draws,
+            sampler_variables,
+            self.stan_fit.time,
+            self.stan_fit.metadata.cmdstan_config.get("max_depth"),
+        )
+
+    def parameter_draws(self) -> ParameterDraws:
+        """Posterior draws of every parameter of the fitted model, in exportable form."""
+        return ParameterDraws({name: param.samples for name, param in self.parameters.items()})
+
+    def save(self, path: Union[str, Path]):
+        """Save the fitted model, with its data, configuration and samples, for `load_model`.
+
+        The CmdStan fit isn't saved, since it refers to output files that may not exist where
+        the model is loaded; the samples drawn from it are.
+        """
+        with open(path, "wb") as outfile:
+            pickle.dump(self, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_model(path: Union[str, Path]) -> FittedModel:
+    """Load a fitted model saved with `FittedModel.save`."""
+    with open(path, "rb") as infile:
+        model = pickle.load(infile)
+    if not isinstance(model, FittedModel):
+        raise Exception(f"{path} doesn't contain a saved Stapes model")
+    return model
 
 
 def build_model(text: str):
@@ -179,8 +919,9 @@ def build_model(text: str):
         if param_name not in used_param_names:
             raise Exception(f"Parameter {param_name} is never used")
 
-    # Add implicitly declared parameters
-    for name in used_param_names:
+    # Add implicitly declared parameters, in a fixed order so the generated program (and the
+    # executable it's cached under) doesn't change between processes
+    for name in sorted(used_param_names):
         if name not in parameters:
             parameters[name] = make_parameter(None, name, "real", {})
 
@@ -0,0 +1,2 @@
+from .density import JointDensity
+from .laplace import fit_laplace, LaplaceResult
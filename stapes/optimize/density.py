@@ -0,0 +1,141 @@
+from typing import Dict, List, Any, Tuple, Callable
+
+import numpy as np
+
+from ..likelihood import Likelihood
+from ..parameter import Parameter
+from ..utils import demunge_samples, munge_samples
+from ..variable import variable_unconstrained_shapes, constrain_variable, variable_log_prior
+
+# A block of the unconstrained vector: (namespace, demunged name, shape, start, stop)
+Block = Tuple[str, str, Tuple[int, ...], int, int]
+
+
+class JointDensity(object):
+    """The joint log density of a Stapes model, evaluated in NumPy.
+
+    The density is defined over the same unconstrained space as the generated Stan program:
+    the priors from the parameter stems, imputation of missing variable values, and the
+    likelihoods, plus the log Jacobian of every constraining transform. All methods are
+    vectorized over rows of a (draws x size) array of unconstrained values.
+    """
+
+    def __init__(
+        self,
+        parameters: Dict[str, Parameter],
+        likelihoods: Dict[str, Likelihood],
+        variables: List[str],
+        stan_data: Dict[str, Any],
+        config: Dict[str, float],
+    ):
+        self.parameters = parameters
+        self.likelihoods = likelihoods
+        self.variables = variables
+        self.stan_data = stan_data
+        self.config = config
+
+        self.blocks: List[Block] = []
+        self.size = 0
+        for name, param in parameters.items():
+            self._add_blocks(name, param.unconstrained_shapes(stan_data))
+        for name in variables:
+            self._add_blocks(name, variable_unconstrained_shapes(name, stan_data))
+
+    def _add_blocks(self, namespace: str, shapes: Dict[str, Tuple[int, ...]]):
+        for name, shape in shapes.items():
+            stop = self.size + int(np.prod(shape, dtype=int))
+            self.blocks.append((namespace, name, shape, self.size, stop))
+            self.size = stop
+
+    def constrain(self, theta: np.ndarray) -> Tuple[Dict[str, Dict[str, np.ndarray]], np.ndarray]:
+        """Map unconstrained rows to demunged samples for every parameter and variable.
+
+        Returns samples keyed by namespace, along with the per-draw log Jacobian.
+        """
+        unconstrained = {}
+        for namespace, name, shape, start, stop in self.blocks:
+            unconstrained.setdefault(namespace, {})[name] = theta[:, start:stop].reshape(
+                (theta.shape[0], *shape)
+            )
+
+        samples = {}
+        log_jacobian = np.zeros(theta.shape[0])
+        for name, param in self.parameters.items():
+            samples[name], param_jacobian = param.constrain(unconstrained.get(name, {}))
+            log_jacobian += param_jacobian
+        for name in self.variables:
+            samples[name], variable_jacobian = constrain_variable(
+                name, unconstrained.get(name, {}), self.stan_data
+            )
+            log_jacobian += variable_jacobian
+        return samples, log_jacobian
+
+    def log_density(self, theta: np.ndarray, chunk_size: int = 1000) -> np.ndarray:
+        """Joint log density (up to a constant) of each row of `theta`."""
+        result = np.empty(theta.shape[0])
+        for start in range(0, theta.shape[0], chunk_size):
+            result[start:start + chunk_size] = self._log_density(theta[start:start + chunk_size])
+        return result
+
+    def _log_density(self, theta: np.ndarray) -> np.ndarray:
+        samples, result = self.constrain(theta)
+        for name, param in self.parameters.items():
+            result = result + param.log_prior(samples[name], demunge_samples(name, self.config))
+        for name in self.variables:
+            result = result + variable_log_prior(
+                name, samples[name], demunge_samples(name, self.config)
+            )
+
+        param_values = {name: samples[name][".."] for name in self.parameters}
+        variable_values = {
+            name: samples[name].get("..", np.asarray(self.stan_data.get(name, []), dtype=float))
+            for name in self.variables
+        }
+        for name, lik in self.likelihoods.items():
+            log_lik = lik.log_lik(
+                self.parameters,
+                param_values,
+                variable_values,
+                self.stan_data,
+                self.config[f"{name}__family"],
+            )
+            log_lik = np.broadcast_to(log_lik, (theta.shape[0], self.stan_data["N"]))
+            result = result + log_lik.sum(axis=1)
+        return np.where(np.isnan(result), -np.inf, result)
+
+    def stan_variables(self, theta: np.ndarray) -> Dict[str, np.ndarray]:
+        """Constrained draws keyed by Stan variable name, in the layout of
+        `CmdStanMCMC.stan_variables()`."""
+        samples, _ = self.constrain(theta)
+        result = {}
+        for namespace, namespace_samples in samples.items():
+            result.update(munge_samples(namespace, namespace_samples))
+        return result
+
+    def gradient(self, theta: np.ndarray, chunk_size: int = 1000) -> np.ndarray:
+        """Central finite-difference gradient of the log density at each row of `theta`.
+
+        All 2 x size perturbed points of a row are evaluated as a single vectorized batch.
+        """
+        return np.array([
+            _central_difference(lambda x: self.log_density(x, chunk_size), row) for row in theta
+        ])
+
+    def hessian(self, point: np.ndarray, chunk_size: int = 1000) -> np.ndarray:
+        """Finite-difference Hessian of the log density at a single unconstrained point."""
+        hessian = _central_difference(lambda x: self.gradient(x, chunk_size), point)
+        return 0.5 * (hessian + hessian.T)
+
+
+def _central_difference(func: Callable[[np.ndarray], np.ndarray], point: np.ndarray) -> np.ndarray:
+    """Central differences of a row-vectorized function at a single point.
+
+    `func` maps a (rows x size) array to a (rows x ...) array; the result has shape
+    (... x size).
+    """
+    size = point.shape[0]
+    steps = np.cbrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(point))
+    offsets = np.diag(steps)
+    values = func(np.concatenate([point + offsets, point - offsets]))
+    diffs = (values[:size] - values[size:]) / (2 * steps.reshape(size, *[1] * (values.ndim - 1)))
+    return np.moveaxis(diffs, 0, -1)
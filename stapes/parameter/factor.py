@@ -1,57 +1,137 @@
-from typing import Dict, Set
+from typing import Dict, Set, Any, Tuple, Optional
 from pathlib import Path
 
 import numpy as np
 import scipy.stats
 
-from ..data import DataCoords, DataValue, get_variable_value
-from ..utils import process_stem
+from ..utils import process_stem, normal_lpdf, cauchy_lpdf
 from .parameter import Parameter
 
+PARAMETERIZATIONS = ["centered", "noncentered", "auto"]
+
+# With `parameterization=auto`, a factor is centered if every level has at least this many
+# core cells, so that the likelihood rather than the hierarchy pins down each level.
+AUTO_CENTERED_MIN_CELLS = 10
+
 
 class Factor(Parameter):
-    """A basic hierarchical parameter."""
+    """A basic hierarchical parameter.
+
+    `is_centered` fixes the hierarchical mean at zero. `parameterization` controls how the
+    levels are sampled: "noncentered" (the default) samples standardized offsets from the mean,
+    which suits groups with little data, and "centered" samples the levels directly, which suits
+    groups with a lot of data. "auto" chooses from the number of cells per level in the first
+    training data the factor is fitted to, and keeps that choice for later fits.
+    """
 
     def __init__(self, name: str, dtype: str, args: Dict[str, str]):
         self.group_name = args.get("group")
         if not self.group_name:
             raise Exception("Vector parameter must have the `group` argument provided")
         self.is_centered = args.get("is_centered", "false") == "true"
+        self.parameterization = args.get("parameterization", "noncentered")
+        if self.parameterization not in PARAMETERIZATIONS:
+            raise Exception(f"Unrecognized factor parameterization {self.parameterization}")
         super().__init__(name, dtype)
 
+        # Until an automatic choice is made, the stem is generated in non-centered form
+        if self.parameterization != "auto":
+            self.chosen_parameterization = self.parameterization
+        self._process_stem()
+
+    def _process_stem(self):
         self.stem = process_stem(
             Path(__file__).resolve().parent / "factor.stem",
             self.name,
             {
                 "is_centered": self.is_centered,
+                "noncentered": self.is_noncentered,
                 "range_name": f"{self.group_name}__count",
                 "dtype": self.dtype.stan_dtype,
                 "transform": self.dtype.transform,
             },
         )
 
-    def evaluate(
+    @property
+    def is_noncentered(self) -> bool:
+        return self.chosen_parameterization != "centered"
+
+    @property
+    def awaits_data(self) -> bool:
+        return self.chosen_parameterization is None
+
+    def adapt_to_data(self, stan_data: Dict[str, Any]):
+        if not self.awaits_data:
+            return
+        counts = np.bincount(
+            np.asarray(stan_data[self.group_name]),
+            minlength=stan_data[f"{self.group_name}__count"] + 1,
+        )[1:]
+        is_informative = counts.size > 0 and counts.min() >= AUTO_CENTERED_MIN_CELLS
+        self.chosen_parameterization = "centered" if is_informative else "noncentered"
+        self._process_stem()
+
+    def evaluate_cells(
         self,
         state: np.random.Generator,
-        data: Dict[DataCoords, DataValue],
-        coords: DataCoords
+        group_ids: Optional[np.ndarray],
+        gather_index: Optional[np.ndarray],
+        new_levels: Dict[Any, np.ndarray],
+        draws: slice = slice(None),
     ) -> np.ndarray:
-        idx = int(get_variable_value(data, coords, self.group_name))
-        max_idx = self.samples[".."].shape[1]
-        # If the index id was present in the training data, use the posterior samples.
-        if idx <= max_idx:
-            return self.samples[".."][:, idx - 1]
-        # If we've already generated samples for a new index value, use the cached samples.
-        elif idx in self.pred_cache:
-            return self.pred_cache[idx]
-        # Otherwise, generate a set of samples for the new index value.
+        values = self.samples[".."][draws, np.maximum(gather_index, 0)]
+        # Cells in groups that weren't in the training data get draws from the prior, shared by
+        # every cell in the same group
+        for col in np.flatnonzero(gather_index < 0):
+            idx = int(group_ids[col])
+            if idx not in new_levels:
+                mu = self.samples[".mu"][draws] if ".mu" in self.samples else 0.0
+                sigma = self.samples[".sigma"][draws]
+                raw_values = scipy.stats.norm(loc=mu, scale=sigma).rvs(random_state=state)
+                new_levels[idx] = self.dtype.transform_fn(raw_values)
+            values[:, col] = new_levels[idx]
+        return values
+
+    def new_level_rng(self) -> Optional[str]:
+        return f"{self.dtype.transform}({self.name}__mu + {self.name}__sigma * normal_rng(0, 1))"
+
+    def likelihood_values(self, values: np.ndarray, stan_data: Dict[str, Any]) -> np.ndarray:
+        return values[:, np.asarray(stan_data[self.group_name]) - 1]
+
+    def unconstrained_shapes(self, stan_data: Dict[str, Any]) -> Dict[str, Tuple[int, ...]]:
+        level_name = ".norm" if self.is_noncentered else ".raw"
+        shapes = {".sigma": (), level_name: (stan_data[f"{self.group_name}__count"],)}
+        if not self.is_centered:
+            shapes[".mu"] = ()
+        return shapes
+
+    def constrain(
+        self, unconstrained: Dict[str, np.ndarray]
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        # `.sigma` has a lower bound of zero, so it's optimized on the log scale
+        log_sigma = unconstrained[".sigma"]
+        samples = {".sigma": np.exp(log_sigma)}
+        mu = np.zeros_like(log_sigma)
+        if not self.is_centered:
+            mu = samples[".mu"] = unconstrained[".mu"]
+        if self.is_noncentered:
+            samples[".norm"] = unconstrained[".norm"]
+            raw = mu[:, None] + samples[".sigma"][:, None] * samples[".norm"]
+        else:
+            raw = samples[".raw"] = unconstrained[".raw"]
+        samples[".."] = self.dtype.transform_fn(raw)
+        return samples, log_sigma
+
+    def log_prior(self, samples: Dict[str, np.ndarray], config: Dict[str, float]) -> np.ndarray:
+        result = cauchy_lpdf(samples[".sigma"], 0.0, config[".sigma_scale"])
+        if self.is_noncentered:
+            result += normal_lpdf(samples[".norm"], 0.0, 1.0)
         else:
-            mu = self.samples.get(".mu", 0.0)
-            sigma = self.samples[".sigma"]
-            raw_values = scipy.stats.norm(loc=mu, scale=sigma).rvs(random_state=state)
-            values = self.dtype.transform_fn(raw_values)
-            self.pred_cache[idx] = values
-            return values
+            mu = samples[".mu"][:, None] if ".mu" in samples else 0.0
+            result += normal_lpdf(samples[".raw"], mu, samples[".sigma"][:, None])
+        if not self.is_centered:
+            result += normal_lpdf(samples[".mu"], config[".mu_loc"], config[".mu_scale"])
+        return result
 
     @property
     def likelihood_index(self) -> str:
@@ -1,45 +1,107 @@
-from typing import Optional, List, Dict, Any, Set
+import copy
+from typing import Optional, List, Dict, Any, Set, Tuple
 
 import numpy as np
 
-from ..utils import ConfigParameter, StanCode, get_data_type, DataType, StanStem
-from ..data import DataCoords, DataValue
+from ..utils import ConfigParameter, StanCode, get_data_type, DataType, StanStem, demunge_samples
 
 
 class Parameter(object):
+    # Name of the coordinate variable indexing the parameter, for parameters that have one.
+    group_name: Optional[str] = None
+    # How a parameter with a choice of parameterizations is sampled, once that's settled.
+    chosen_parameterization: Optional[str] = None
+
     def __init__(self, name: str, dtype: str):
         self.name = name
         self.dtype: DataType = get_data_type(dtype)
         self.stem: Optional[StanStem] = None
         self.samples: Optional[Dict[str, np.ndarray]] = None
-        self.pred_cache: Dict[Any, Any] = {}
+        self.group_levels: Dict[int, int] = {}
 
     def set_samples(self, samples: Dict[str, np.ndarray]):
         """Set the samples attribute on the parameter from the overall sample dictionary."""
+        self.samples = demunge_samples(self.name, samples)
+
+    def set_group_levels(self, stan_data: Dict[str, Any]):
+        """Record the mapping from original group ids to the dense ids used in the Stan data."""
+        if self.group_name is not None:
+            levels = stan_data[f"{self.group_name}__levels"]
+            self.group_levels = {int(level): ndx+1 for ndx, level in enumerate(levels)}
+
+    def unfitted_copy(self) -> "Parameter":
+        """A copy of the parameter without samples, to be fitted independently of this one.
+        Settled parameterization choices carry over."""
+        result = copy.copy(self)
+        result.samples = None
+        result.group_levels = {}
+        return result
+
+    @property
+    def awaits_data(self) -> bool:
+        """Whether the parameter's Stan code can't be generated until `adapt_to_data` is
+        called."""
+        return False
+
+    def adapt_to_data(self, stan_data: Dict[str, Any]):
+        """Settle any choices that depend on the training data before the Stan code is
+        generated. Choices that are already settled are kept."""
+        pass
 
-        def _demunge_name(name: str) -> str:
-            if name == self.name:
-                return ".."
-            dundered_name = f"{self.name}__"
-            dundered_len = len(dundered_name)
-            if name[:dundered_len] == dundered_name:
-                return "." + name[dundered_len:]
-            else:
-                return name
-
-        self.samples = {
-            _demunge_name(name): value
-            for name, value in samples.items()
-            if _demunge_name(name)[0] == "."
-        }
-
-    def evaluate(
+    def gather_index(self, group_ids: np.ndarray) -> np.ndarray:
+        """Columns of the `..` samples holding each original group id in `group_ids`, with -1
+        for ids that weren't in the training data."""
+        return np.asarray([self.group_levels.get(int(idx), 0) - 1 for idx in group_ids], dtype=int)
+
+    def evaluate_cells(
         self,
         state: np.random.Generator,
-        data: Dict[DataCoords, DataValue],
-        coords: DataCoords
+        group_ids: Optional[np.ndarray],
+        gather_index: Optional[np.ndarray],
+        new_levels: Dict[Any, np.ndarray],
+        draws: slice = slice(None),
     ) -> np.ndarray:
-        raise NotImplementedError("Must implement evaluate method")
+        """Evaluate the parameter at many predicted cells at once, for the given draws.
+
+        `group_ids` holds the original group id of each cell and `gather_index` the matching
+        result of `gather_index`; both are None for parameters without a group. Draws generated
+        for group ids not seen in training are kept in `new_levels`, so every cell in the same
+        new group shares them. The result is broadcastable against a (draws x cells) array.
+        """
+        raise NotImplementedError("Must implement evaluate_cells method")
+
+    def new_level_rng(self) -> Optional[str]:
+        """Stan expression that draws the parameter for a group that wasn't in the training
+        data, or None if the parameter can't extrapolate to new groups."""
+        return None
+
+    def likelihood_values(self, values: np.ndarray, stan_data: Dict[str, Any]) -> np.ndarray:
+        """Gather draws of the parameter onto the core cells of the Stan data.
+
+        This is the vectorized counterpart of `likelihood_index`: `values` has draws along its
+        first axis, and the result is broadcastable against a (draws x N) array.
+        """
+        raise NotImplementedError("Must implement likelihood_values method")
+
+    def unconstrained_shapes(self, stan_data: Dict[str, Any]) -> Dict[str, Tuple[int, ...]]:
+        """Shapes of the parameter's unconstrained Stan parameters, keyed by demunged name."""
+        raise NotImplementedError("Must implement unconstrained_shapes method")
+
+    def constrain(
+        self, unconstrained: Dict[str, np.ndarray]
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Map unconstrained draws to demunged samples, as the Stan program would.
+
+        Returns the samples along with the per-draw log Jacobian of the transform.
+        """
+        raise NotImplementedError("Must implement constrain method")
+
+    def log_prior(self, samples: Dict[str, np.ndarray], config: Dict[str, float]) -> np.ndarray:
+        """Per-draw log prior density from the stem's model block, up to a constant.
+
+        Both `samples` and `config` are keyed by demunged name.
+        """
+        raise NotImplementedError("Must implement log_prior method")
 
     @property
     def likelihood_index(self) -> str:
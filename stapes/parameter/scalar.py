@@ -1,10 +1,9 @@
-from typing import Dict
+from typing import Dict, Any, Tuple, Optional
 from pathlib import Path
 
 import numpy as np
 
-from ..data import DataCoords, DataValue
-from ..utils import process_stem
+from ..utils import process_stem, normal_lpdf
 from .parameter import Parameter
 
 
@@ -25,13 +24,30 @@ class Scalar(Parameter):
             },
         )
 
-    def evaluate(
-            self,
-            state: np.random.Generator,
-            data: Dict[DataCoords, DataValue],
-            coords: DataCoords
+    def evaluate_cells(
+        self,
+        state: np.random.Generator,
+        group_ids: Optional[np.ndarray],
+        gather_index: Optional[np.ndarray],
+        new_levels: Dict[Any, np.ndarray],
+        draws: slice = slice(None),
     ) -> np.ndarray:
-        return self.samples[".."]
+        return self.samples[".."][draws, None]
+
+    def likelihood_values(self, values: np.ndarray, stan_data: Dict[str, Any]) -> np.ndarray:
+        return values[:, None]
+
+    def unconstrained_shapes(self, stan_data: Dict[str, Any]) -> Dict[str, Tuple[int, ...]]:
+        return {".raw": ()}
+
+    def constrain(
+        self, unconstrained: Dict[str, np.ndarray]
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        raw = unconstrained[".raw"]
+        return {".raw": raw, "..": self.dtype.transform_fn(raw)}, np.zeros(raw.shape[0])
+
+    def log_prior(self, samples: Dict[str, np.ndarray], config: Dict[str, float]) -> np.ndarray:
+        return normal_lpdf(samples[".raw"], config[".loc"], config[".scale"])
 
     @property
     def likelihood_index(self) -> str:
@@ -1,10 +1,9 @@
-from typing import Dict, Set
+from typing import Dict, Set, Any, Tuple, Optional
 from pathlib import Path
 
 import numpy as np
 
-from ..data import DataCoords, DataValue, get_variable_value
-from ..utils import process_stem
+from ..utils import process_stem, normal_lpdf
 from .parameter import Parameter
 
 
@@ -31,19 +30,41 @@ class Vector(Parameter):
             },
         )
 
-    def evaluate(
+    def evaluate_cells(
         self,
         state: np.random.Generator,
-        data: Dict[DataCoords, DataValue],
-        coords: DataCoords
+        group_ids: Optional[np.ndarray],
+        gather_index: Optional[np.ndarray],
+        new_levels: Dict[Any, np.ndarray],
+        draws: slice = slice(None),
     ) -> np.ndarray:
-        idx = int(get_variable_value(data, coords, self.group_name))
-        max_idx = self.samples[".."].shape[1]
-        # If the index value isn't present in the training data, throw an exception. Unlike factors,
-        # vectors are unable to extrapolate to unseen indices.
-        if idx > max_idx:
+        # Unlike factors, vectors are unable to extrapolate to unseen indices
+        if np.any(gather_index < 0):
             raise Exception("Cannot extrapolate to index values not in training data")
-        return self.samples[".."][:, idx - 1]
+        return self.samples[".."][draws, gather_index]
+
+    def likelihood_values(self, values: np.ndarray, stan_data: Dict[str, Any]) -> np.ndarray:
+        return values[:, np.asarray(stan_data[self.group_name]) - 1]
+
+    def unconstrained_shapes(self, stan_data: Dict[str, Any]) -> Dict[str, Tuple[int, ...]]:
+        count = stan_data[f"{self.group_name}__count"]
+        return {".raw": (count if self.anchor == "none" else count - 1,)}
+
+    def constrain(
+        self, unconstrained: Dict[str, np.ndarray]
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        raw = unconstrained[".raw"]
+        anchor = np.zeros((raw.shape[0], 1))
+        if self.anchor == "first":
+            values = np.concatenate([anchor, raw], axis=1)
+        elif self.anchor == "last":
+            values = np.concatenate([raw, anchor], axis=1)
+        else:
+            values = raw
+        return {".raw": raw, "..": self.dtype.transform_fn(values)}, np.zeros(raw.shape[0])
+
+    def log_prior(self, samples: Dict[str, np.ndarray], config: Dict[str, float]) -> np.ndarray:
+        return normal_lpdf(samples[".raw"], config[".loc"], config[".scale"])
 
     @property
     def likelihood_index(self) -> str:
@@ -1,2 +1,3 @@
 from .ast import recurse_over_variables, get_all_parameters
-from .parse import parse_text
+from .parse import parse_text, parse_text_reference
+from .fast import parse_text_fast, ParseException
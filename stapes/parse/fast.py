@@ -0,0 +1,190 @@
+import re
+from typing import Dict, List, Tuple, Union
+
+from .ast import (
+    Likelihood,
+    ParamSpec,
+    ModelAst,
+    VariableOperand,
+    Operation,
+    OpCall,
+    Operand,
+)
+
+
+class ParseException(Exception):
+    pass
+
+
+# One alternative per token type, mirroring the patterns in `grammar.ebnf`. Anything else is an
+# error, including whitespace the grammar doesn't skip.
+TOKEN_PATTERN = re.compile(
+    r"(?P<space>[\t\n ]+)"
+    r"|(?P<number>[0-9]+(?:\.[0-9]+)?)"
+    r"|(?P<parameter>:[a-z][a-z0-9_]*)"
+    r"|(?P<variable>[A-Z][A-Za-z0-9]*)"
+    r"|(?P<name>[a-z][a-z0-9_]*)"
+    r"|(?P<symbol>[-+*/^(),;=.])"
+    r"|(?P<error>.)",
+    re.DOTALL,
+)
+
+ASPECTS = {"mean", "variance"}
+
+# Binding power of the left-associative binary operators. `^` binds tighter still, but it's
+# non-associative, so it's handled separately.
+BINARY_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2}
+
+Token = Tuple[str, str, int]  # (type, text, offset)
+END = "end"
+
+
+def parse_text_fast(text: str) -> ModelAst:
+    """Parse Stapes source into the same AST as the reference tatsu parser.
+
+    This is a hand-written recursive descent parser, using precedence climbing for binary
+    operators, so it runs in a single pass over the tokens rather than memoizing every rule at
+    every position like the PEG parser does. It accepts exactly the language in `grammar.ebnf`.
+    """
+    return _Parser(text).parse()
+
+
+class _Parser(object):
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def parse(self) -> ModelAst:
+        params = []
+        likelihoods = []
+        # start = { @+:statement ';' }+
+        while True:
+            kind = self.tokens[self.pos][0]
+            if kind == "variable":
+                likelihoods.append(self._likelihood())
+            elif kind == "name":
+                params.append(self._param_spec())
+            else:
+                self._fail("a statement")
+            self._expect(";")
+            if self.tokens[self.pos][0] == END:
+                break
+        return ModelAst(params=params, likelihoods=likelihoods)
+
+    def _likelihood(self) -> Likelihood:
+        variable = self._take("variable")
+        kind, aspect, _ = self.tokens[self.pos]
+        if kind != "name" or aspect not in ASPECTS:
+            self._fail("'mean' or 'variance'")
+        self.pos += 1
+        self._expect("=")
+        return Likelihood(variable=variable, aspect=aspect, value=self._expression(1))
+
+    def _param_spec(self) -> ParamSpec:
+        data_type = self._take("name")
+        name = self._take("parameter")
+        self._expect("=")
+        param_type = self._take("name")
+        self._expect("(")
+        kwargs: Dict[str, Union[str, float]] = {}
+        if not self._accept(")"):
+            while True:
+                arg_name = self._take("name")
+                self._expect("=")
+                kind, value, _ = self.tokens[self.pos]
+                if kind == "number":
+                    kwargs[arg_name] = float(value)
+                elif kind in ("name", "variable"):
+                    kwargs[arg_name] = value
+                else:
+                    self._fail("an argument value")
+                self.pos += 1
+                if self._accept(")"):
+                    break
+                self._expect(",")
+        return ParamSpec(name=name, data_type=data_type, param_type=param_type, kwargs=kwargs)
+
+    def _expression(self, min_precedence: int) -> Operand:
+        left = self._power()
+        while True:
+            kind, op, _ = self.tokens[self.pos]
+            precedence = BINARY_PRECEDENCE.get(op, 0) if kind == "symbol" else 0
+            if precedence < min_precedence:
+                return left
+            self.pos += 1
+            right = self._expression(precedence + 1)
+            left = Operation(operator=op, operands=[left, right])
+
+    def _power(self) -> Operand:
+        base = self._unary()
+        if self._accept("^"):
+            return Operation(operator="^", operands=[base, self._unary()])
+        return base
+
+    def _unary(self) -> Operand:
+        if self._accept("-"):
+            return Operation(operator="-", operands=[self._primary()])
+        return self._primary()
+
+    def _primary(self) -> Operand:
+        kind, text, _ = self.tokens[self.pos]
+        if kind == "parameter":
+            self.pos += 1
+            return text
+        elif kind == "variable":
+            self.pos += 1
+            modifiers = []
+            while self._accept("."):
+                modifiers.append(self._take("name"))
+            return VariableOperand(name=text, modifiers=sorted(modifiers))
+        elif kind == "name":
+            self.pos += 1
+            self._expect("(")
+            arg = self._expression(1)
+            self._expect(")")
+            return OpCall(name=text, arg=arg)
+        elif kind == "number":
+            self.pos += 1
+            return float(text)
+        elif self._accept("("):
+            value = self._expression(1)
+            self._expect(")")
+            return value
+        self._fail("an operand")
+
+    def _take(self, kind: str) -> str:
+        token_kind, text, _ = self.tokens[self.pos]
+        if token_kind != kind:
+            self._fail(f"<{kind}>")
+        self.pos += 1
+        return text
+
+    def _accept(self, symbol: str) -> bool:
+        kind, text, _ = self.tokens[self.pos]
+        if kind == "symbol" and text == symbol:
+            self.pos += 1
+            return True
+        return False
+
+    def _expect(self, symbol: str):
+        if not self._accept(symbol):
+            self._fail(f"'{symbol}'")
+
+    def _fail(self, expected: str):
+        kind, text, offset = self.tokens[self.pos]
+        line = self.text.count("\n", 0, offset) + 1
+        column = offset - (self.text.rfind("\n", 0, offset) + 1) + 1
+        found = "end of input" if kind == END else repr(text)
+        raise ParseException(f"({line}:{column}) Expecting {expected}, found {found}")
+
+
+def _tokenize(text: str) -> List[Token]:
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        tokens.append((kind, match.group(), match.start()))
+    tokens.append((END, "", len(text)))
+    return tokens
@@ -4,6 +4,7 @@ import tatsu
 
 from .ast import ModelAst
 from .ast_actions import ModelAstActions
+from .fast import parse_text_fast
 
 # Initialize the language parser
 GRAMMAR_FILENAME = Path(__file__).parent / "grammar.ebnf"
@@ -12,5 +13,17 @@ with open(GRAMMAR_FILENAME, "r") as infile:
 MARROW_PARSER = tatsu.compile(GRAMMAR_TEXT)
 
 
-def parse_text(text: str, trace: bool = False) -> ModelAst:
+def parse_text(text: str, trace: bool = False, reference: bool = False) -> ModelAst:
+    """Parse Stapes source code.
+
+    The hand-written parser in `fast.py` is used by default. The tatsu parser generated from
+    `grammar.ebnf` is the reference implementation of the language; it's used if `reference`
+    is set, or if `trace` is set to trace the parse.
+    """
+    if reference or trace:
+        return parse_text_reference(text, trace)
+    return parse_text_fast(text)
+
+
+def parse_text_reference(text: str, trace: bool = False) -> ModelAst:
     return MARROW_PARSER.parse(text, semantics=ModelAstActions(), trace=trace)
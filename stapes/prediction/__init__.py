@@ -0,0 +1,2 @@
+from .plan import PredictionPlan
+from .generated import generated_quantities_code, generated_quantities_data
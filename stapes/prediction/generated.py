@@ -0,0 +1,191 @@
+from collections import ChainMap
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from ..data import DataCoords, DataValue
+from ..parse import ast
+from ..likelihood import variable_reference
+from ..utils import StanCode, process_stem
+from .plan import PredictionPlan, Reference
+
+# Namespace of everything the generated quantities program adds to the model
+NAMESPACE = "gq"
+
+
+def generated_quantities_code(plan: PredictionPlan) -> StanCode:
+    """Data declarations and a generated quantities block that predict the planned cells.
+
+    Cells are visited in the plan's calendar order, so a cell that reads an earlier prediction
+    through `prev_dev` or `prev_exp` finds it already drawn. Other variables are passed in as
+    plain data. The program only depends on which
+    responses, variables and parameters the plan uses, not on the cells themselves, so plans
+    over different cells share a compiled program.
+    """
+    references = _references(plan)
+    params = _grouped_parameters(plan)
+
+    def _rewrite(op: ast.Operand) -> Optional[str]:
+        if isinstance(op, ast.VariableOperand):
+            name = _reference_name(variable_reference(op))
+            if op.name not in plan.responses:
+                return f"{name}__value[p]"
+            return f"({name}__source[p] > 0 ? {NAMESPACE}[{name}__source[p]] : {name}__value[p])"
+        elif isinstance(op, str) and op[1:] in params:
+            return _parameter_text(plan, op[1:])
+        return None
+
+    per_cell = f"array[{NAMESPACE}__num_cells]"
+    data_declarations = []
+    for reference in references:
+        name = _reference_name(reference)
+        if reference[0] in plan.responses:
+            data_declarations.append(
+                f"{per_cell} int<lower=0, upper={NAMESPACE}__num_cells> {name}__source;"
+            )
+        data_declarations.append(f"{per_cell} real {name}__value;")
+
+    level_declarations, level_definitions = [], []
+    for name in params:
+        prefix = f"{NAMESPACE}__{name}"
+        data_declarations += [
+            f"{per_cell} int<lower=0> {prefix}__level;",
+            f"int<lower=0> {prefix}__num_new;",
+            f"{per_cell} int<lower=0, upper={prefix}__num_new> {prefix}__new_id;",
+        ]
+        new_level_rng = plan.parameters[name].new_level_rng()
+        if new_level_rng is not None:
+            level_declarations.append(f"array[{prefix}__num_new] real {prefix}__new;")
+            level_definitions.append(
+                f"for (k in 1:{prefix}__num_new) {{ {prefix}__new[k] = {new_level_rng}; }}"
+            )
+
+    branches = []
+    for ndx, response in enumerate(plan.responses):
+        mean, variance = plan.likelihoods[response].prediction_definitions(
+            plan.parameters, _rewrite
+        )
+        keyword = "if" if ndx == 0 else "} else if"
+        branches += [
+            f"{keyword} ({NAMESPACE}__response[p] == {ndx + 1}) {{",
+            f"obs_mean = {mean};",
+            f"obs_variance = {variance};",
+            f"family = {response}__family;",
+        ]
+    branches.append("}")
+
+    stem = process_stem(
+        Path(__file__).resolve().parent / "generated.stem",
+        NAMESPACE,
+        {
+            "data_declarations": "\n".join(data_declarations),
+            "level_declarations": "\n".join(level_declarations),
+            "level_definitions": "\n".join(level_definitions),
+            "branches": "\n".join(branches),
+        },
+    )
+    return stem.stan_code
+
+
+def generated_quantities_data(
+    plan: PredictionPlan, pred_data: Optional[Dict[DataCoords, DataValue]] = None
+) -> Dict[str, Any]:
+    """Data for the program from `generated_quantities_code`, for one scenario."""
+    data = ChainMap(pred_data or {}, plan.train_data)
+    num_cells = len(plan.coords)
+    result = {
+        f"{NAMESPACE}__num_cells": num_cells,
+        f"{NAMESPACE}__response": np.zeros(num_cells, dtype=int),
+    }
+    response_ids = {response: ndx + 1 for ndx, response in enumerate(plan.responses)}
+    references = _references(plan)
+    sources = {reference: np.zeros(num_cells, dtype=int) for reference in references}
+    values = {reference: np.zeros(num_cells) for reference in references}
+    params = _grouped_parameters(plan)
+    levels = {name: np.zeros(num_cells, dtype=int) for name in params}
+    new_ids = {name: np.zeros(num_cells, dtype=int) for name in params}
+    new_levels = {name: {} for name in params}
+
+    for batch in plan.batches:
+        result[f"{NAMESPACE}__response"][batch.rows] = response_ids[batch.response]
+        rows = np.arange(num_cells)[batch.rows]
+        for reference, source in batch.sources.items():
+            if reference not in values:
+                continue
+            if source.constant is not None:
+                values[reference][rows] = source.constant
+                continue
+            # Stan reads earlier predictions by their 1-based position
+            sources[reference][rows[source.pred_cols]] = source.pred_rows + 1
+            values[reference][rows[source.data_cols]] = _data_values(source.data_keys, data)
+
+        for name in plan.likelihoods[batch.response].parameters:
+            if name not in params:
+                continue
+            param = plan.parameters[name]
+            if name in batch.groups:
+                group_ids, gather_index = batch.groups[name]
+            else:
+                source = batch.sources[(param.group_name, 0, 0)]
+                group_ids = _data_values(source.data_keys, data).astype(int)
+                gather_index = param.gather_index(group_ids)
+            if np.any(gather_index < 0) and param.new_level_rng() is None:
+                raise Exception("Cannot extrapolate to index values not in training data")
+            levels[name][rows] = gather_index + 1
+            for col in np.flatnonzero(gather_index < 0):
+                idx = int(group_ids[col])
+                new_ids[name][rows[col]] = new_levels[name].setdefault(
+                    idx, len(new_levels[name]) + 1
+                )
+
+    for reference in references:
+        name = _reference_name(reference)
+        if reference[0] in plan.responses:
+            result[f"{name}__source"] = sources[reference]
+        result[f"{name}__value"] = values[reference]
+    for name in params:
+        prefix = f"{NAMESPACE}__{name}"
+        result[f"{prefix}__level"] = levels[name]
+        result[f"{prefix}__num_new"] = len(new_levels[name])
+        result[f"{prefix}__new_id"] = new_ids[name]
+    return result
+
+
+def _references(plan: PredictionPlan) -> List[Reference]:
+    result = set()
+    for response in plan.responses:
+        result |= plan.likelihoods[response].references
+    return sorted(result)
+
+
+def _grouped_parameters(plan: PredictionPlan) -> List[str]:
+    result = set()
+    for response in plan.responses:
+        result |= plan.likelihoods[response].parameters
+    return sorted([name for name in result if plan.parameters[name].group_name is not None])
+
+
+def _reference_name(reference: Reference) -> str:
+    variable, exp_offset, dev_offset = reference
+    if (exp_offset, dev_offset) == (0, 0):
+        return f"{NAMESPACE}__{variable}"
+    return f"{NAMESPACE}__{variable}__Lag" + "T" * exp_offset + "D" * dev_offset
+
+
+def _parameter_text(plan: PredictionPlan, name: str) -> str:
+    prefix = f"{NAMESPACE}__{name}"
+    level = f"{name}[{prefix}__level[p]]"
+    if plan.parameters[name].new_level_rng() is None:
+        return level
+    return f"({prefix}__level[p] > 0 ? {level} : {prefix}__new[{prefix}__new_id[p]])"
+
+
+def _data_values(keys: List[DataCoords], data: ChainMap) -> np.ndarray:
+    try:
+        values = [data[key] for key in keys]
+    except KeyError as e:
+        raise Exception(f"No value for {e.args[0]} in the prediction or training data")
+    if any([np.ndim(value) > 0 for value in values]):
+        raise Exception("Prediction inside Stan needs plain values, not per-draw values")
+    return np.asarray(values, dtype=float)
@@ -0,0 +1,222 @@
+from collections import ChainMap
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+
+from ..data import DataCoords, DataValue, get_coordinate_id
+from ..likelihood import Likelihood
+from ..parameter import Parameter
+from ..results import PredictionResult
+
+# A variable read by a likelihood: (variable, exp_offset, dev_offset)
+Reference = Tuple[str, int, int]
+
+
+@dataclass
+class _Source(object):
+    """Where the values of one variable reference come from, for each cell in a batch."""
+
+    # Values of coordinate variables, which never change between runs
+    constant: Optional[np.ndarray] = None
+    # Columns filled from cells predicted by earlier batches, and the output rows they come from
+    pred_cols: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=int))
+    pred_rows: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=int))
+    # Columns filled from the data, and the data keys they're read from
+    data_cols: List[int] = field(default_factory=list)
+    data_keys: List[DataCoords] = field(default_factory=list)
+
+
+@dataclass
+class _Batch(object):
+    """Cells of one response on one calendar diagonal, which only depend on earlier batches."""
+
+    response: str
+    rows: slice
+    num_cells: int
+    sources: Dict[Reference, _Source]
+    # Original group ids and sample columns of each grouped parameter, where they're known
+    # up front
+    groups: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+class PredictionPlan(object):
+    """Everything about predicting a fixed set of cells that doesn't depend on the scenario.
+
+    Cells are ordered and grouped into batches by calendar diagonal and response, the source of
+    every variable each batch reads is resolved to either an earlier prediction or a data key,
+    and parameter gather indices are computed once. Each call to `run` then only looks up
+    scenario data and does vectorized arithmetic over (draws x cells) arrays.
+    """
+    def __init__(
+        self,
+        parameters: Dict[str, Parameter],
+        likelihoods: Dict[str, Likelihood],
+        distribution_ids: Dict[str, int],
+        train_data: Dict[DataCoords, DataValue],
+        pred_coords: List[DataCoords],
+    ):
+        self.parameters = parameters
+        self.likelihoods = likelihoods
+        self.distribution_ids = distribution_ids
+        self.train_data = train_data
+        for name, _, _, _ in pred_coords:
+            if name not in likelihoods:
+                raise Exception(f"Cannot predict variable {name}")
+
+        # Predicting in calendar order lets each diagonal read the one before it
+        self.coords = sorted(
+            set(pred_coords), key=lambda x: (x[2] + x[3], x[0], x[2], x[1], x[3])
+        )
+        rows = {coord: ndx for ndx, coord in enumerate(self.coords)}
+        self.batches = []
+        start = 0
+        for (_, response), cells in groupby(self.coords, key=lambda x: (x[2] + x[3], x[0])):
+            cells = list(cells)
+            self.batches.append(self._plan_batch(response, cells, rows, start))
+            start += len(cells)
+
+    def _plan_batch(self, response, cells, rows, start) -> _Batch:
+        lik = self.likelihoods[response]
+        references = set(lik.references)
+        for name in lik.parameters:
+            group_name = self.parameters[name].group_name
+            if group_name is not None:
+                references.add((group_name, 0, 0))
+
+        sources = {}
+        for variable, exp_offset, dev_offset in references:
+            keys = [
+                (variable, tri_id, exp_id - exp_offset, dev_id - dev_offset)
+                for _, tri_id, exp_id, dev_id in cells
+            ]
+            if variable[-2:] == "Id":
+                sources[(variable, exp_offset, dev_offset)] = _Source(constant=np.asarray(
+                    [get_coordinate_id(key[1:], variable) for key in keys], dtype=float
+                ))
+                continue
+            # Only cells predicted by earlier batches can be read; anything else comes from data
+            source_rows = [rows.get(key, start) for key in keys]
+            is_predicted = [row < start for row in source_rows]
+            sources[(variable, exp_offset, dev_offset)] = _Source(
+                pred_cols=np.flatnonzero(is_predicted),
+                pred_rows=np.asarray(
+                    [row for row, pred in zip(source_rows, is_predicted) if pred], dtype=int
+                ),
+                data_cols=[col for col, pred in enumerate(is_predicted) if not pred],
+                data_keys=[key for key, pred in zip(keys, is_predicted) if not pred],
+            )
+
+        groups = {}
+        for name in lik.parameters:
+            param = self.parameters[name]
+            source = sources.get((param.group_name, 0, 0))
+            if source is not None and source.constant is not None:
+                group_ids = source.constant.astype(int)
+                groups[name] = (group_ids, param.gather_index(group_ids))
+
+        return _Batch(
+            response=response,
+            rows=slice(start, start + len(cells)),
+            num_cells=len(cells),
+            sources=sources,
+            groups=groups,
+        )
+
+    @property
+    def responses(self) -> List[str]:
+        """The distinct variables the plan predicts."""
+        return sorted(set([batch.response for batch in self.batches]))
+
+    @property
+    def num_draws(self) -> int:
+        return next(iter(self.parameters.values())).samples[".."].shape[0]
+
+    def run(
+        self,
+        pred_data: Optional[Dict[DataCoords, DataValue]] = None,
+        seed: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        dtype: np.dtype = np.float64,
+    ) -> PredictionResult:
+        """Predict every planned cell for one scenario.
+
+        `pred_data` is layered over the training data without copying either, so scenarios
+        only need to supply the values they change. Draws are processed `chunk_size` at a time
+        and written straight into the preallocated output, so intermediate arrays never exceed
+        (chunk_size x cells). `dtype` sets the precision predictions are stored in; arithmetic
+        is always done in double precision.
+        """
+        num_draws = self.num_draws
+        chunk_size = chunk_size or num_draws
+        if chunk_size < 1:
+            raise Exception("Prediction chunk size must be positive")
+        state = np.random.default_rng(seed)
+        data = ChainMap(pred_data or {}, self.train_data)
+        output = np.empty((len(self.coords), num_draws), dtype=dtype)
+        for start in range(0, num_draws, chunk_size):
+            draws = slice(start, min(start + chunk_size, num_draws))
+            self._run_draws(state, data, output, draws)
+        return PredictionResult(output, self.coords)
+
+    def _run_draws(
+        self,
+        state: np.random.Generator,
+        data: ChainMap,
+        output: np.ndarray,
+        draws: slice,
+    ):
+        """Fill in the given draws of every planned cell."""
+        num_draws = draws.stop - draws.start
+        new_levels = {name: {} for name in self.parameters}
+        for batch in self.batches:
+            variable_values = {
+                reference: self._gather(source, data, output, draws, batch.num_cells)
+                for reference, source in batch.sources.items()
+            }
+            lik = self.likelihoods[batch.response]
+            param_values = {}
+            for name in lik.parameters:
+                param = self.parameters[name]
+                if name in batch.groups:
+                    group_ids, gather_index = batch.groups[name]
+                elif param.group_name is not None:
+                    # Group ids read from non-coordinate data are only known per scenario
+                    group_ids = np.asarray(variable_values[(param.group_name, 0, 0)], dtype=int)
+                    gather_index = param.gather_index(group_ids)
+                else:
+                    group_ids, gather_index = None, None
+                param_values[name] = param.evaluate_cells(
+                    state, group_ids, gather_index, new_levels[name], draws
+                )
+            output[batch.rows, draws] = lik.predict_batch(
+                param_values,
+                variable_values,
+                self.distribution_ids[batch.response],
+                state,
+                (num_draws, batch.num_cells),
+            ).T
+
+    @staticmethod
+    def _gather(
+        source: _Source,
+        data: ChainMap,
+        output: np.ndarray,
+        draws: slice,
+        num_cells: int,
+    ) -> np.ndarray:
+        """Values of one variable reference over a batch, broadcastable against (draws x cells)."""
+        if source.constant is not None:
+            return source.constant
+        try:
+            data_values = [data[key] for key in source.data_keys]
+        except KeyError as e:
+            raise Exception(f"No value for {e.args[0]} in the prediction or training data")
+        if len(source.pred_rows) == 0 and all([np.ndim(value) == 0 for value in data_values]):
+            return np.asarray(data_values, dtype=float)
+        values = np.empty((draws.stop - draws.start, num_cells))
+        values[:, source.pred_cols] = output[source.pred_rows, draws].T
+        for col, value in zip(source.data_cols, data_values):
+            values[:, col] = value[draws] if np.ndim(value) > 0 else value
+        return values
@@ -0,0 +1,3 @@
+from .table import DrawTable, DEFAULT_QUANTILES
+from .prediction import PredictionResult
+from .draws import ParameterDraws
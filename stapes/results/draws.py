@@ -0,0 +1,29 @@
+from typing import Dict
+
+import numpy as np
+
+from .table import DrawTable
+
+
+class ParameterDraws(DrawTable):
+    """Posterior draws of every element of every model parameter, with one row of `values` per
+    scalar element.
+
+    Rows are labelled by the parameter, the component within it (`..` for the parameter
+    itself, `.sigma` etc. for its hyperparameters) and the element's flat position.
+    """
+    def __init__(self, samples: Dict[str, Dict[str, np.ndarray]]):
+        blocks, parameters, components, elements = [], [], [], []
+        for parameter, parameter_samples in samples.items():
+            for component, draws in parameter_samples.items():
+                block = draws.reshape(draws.shape[0], -1).T
+                blocks.append(block)
+                parameters += [parameter] * block.shape[0]
+                components += [component] * block.shape[0]
+                elements.append(np.arange(block.shape[0]))
+        values = np.concatenate(blocks) if blocks else np.zeros((0, 0))
+        super().__init__(values, {
+            "parameter": np.asarray(parameters, dtype=str),
+            "component": np.asarray(components, dtype=str),
+            "element": np.concatenate(elements) if elements else np.zeros(0, dtype=int),
+        })
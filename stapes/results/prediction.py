@@ -0,0 +1,40 @@
+from typing import Dict, List, Iterator, Mapping
+
+import numpy as np
+
+from ..data import DataCoords
+from .table import DrawTable
+
+
+class PredictionResult(DrawTable, Mapping):
+    """Predicted draws for a set of cells, with one row of `values` per cell.
+
+    Behaves as a read-only mapping from data coordinates to the draws of each cell, where each
+    value is a view of the row in `values`.
+    """
+    def __init__(self, values: np.ndarray, coords: List[DataCoords]):
+        self.coords = list(coords)
+        names, tri_ids, exp_ids, dev_ids = zip(*self.coords) if self.coords else ([], [], [], [])
+        super().__init__(values, {
+            "name": np.asarray(names, dtype=str),
+            "TriangleId": np.asarray(tri_ids, dtype=int),
+            "ExpPeriodId": np.asarray(exp_ids, dtype=int),
+            "DevLagId": np.asarray(dev_ids, dtype=int),
+        })
+        self._rows = {coord: ndx for ndx, coord in enumerate(self.coords)}
+
+    @classmethod
+    def from_dict(cls, predictions: Dict[DataCoords, np.ndarray]) -> "PredictionResult":
+        coords = list(predictions)
+        if not coords:
+            return cls(np.zeros((0, 0)), [])
+        return cls(np.stack([predictions[coord] for coord in coords]), coords)
+
+    def __getitem__(self, coord: DataCoords) -> np.ndarray:
+        return self.values[self._rows[coord]]
+
+    def __iter__(self) -> Iterator[DataCoords]:
+        return iter(self.coords)
+
+    def __len__(self) -> int:
+        return len(self.coords)
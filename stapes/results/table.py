@@ -0,0 +1,103 @@
+from typing import Dict, Sequence, Union
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+
+LAYOUTS = ["long", "summary"]
+
+
+class DrawTable(object):
+    """Posterior draws of many scalar quantities, held as one contiguous (rows x draws) array.
+
+    `index` holds one column per label, each with one entry per row of `values`. Draws can be
+    written out either in long layout (one record per row and draw) or summarized (one record
+    per row).
+    """
+    def __init__(self, values: np.ndarray, index: Dict[str, np.ndarray]):
+        self.values = np.ascontiguousarray(values)
+        if self.values.ndim != 2:
+            raise Exception("Draw tables must be two-dimensional")
+        for name, column in index.items():
+            if len(column) != self.num_rows:
+                raise Exception(f"Index column {name} doesn't match the number of rows")
+        self.index = {name: np.asarray(column) for name, column in index.items()}
+
+    @property
+    def num_rows(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def num_draws(self) -> int:
+        return self.values.shape[1]
+
+    def summary(self, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> Dict[str, np.ndarray]:
+        """Index columns plus the mean, standard deviation and quantiles of each row."""
+        ddof = 1 if self.num_draws > 1 else 0
+        result = {
+            **self.index,
+            "mean": self.values.mean(axis=1),
+            "sd": self.values.std(axis=1, ddof=ddof),
+        }
+        for quantile, values in zip(quantiles, np.quantile(self.values, quantiles, axis=1)):
+            result[f"q{100 * quantile:g}"] = values
+        return result
+
+    def long(self) -> Dict[str, np.ndarray]:
+        """Index columns repeated for each draw, plus the draw number and the value.
+
+        The value column is a view of `values`, so no draws are copied.
+        """
+        return {
+            **{name: np.repeat(column, self.num_draws) for name, column in self.index.items()},
+            "draw": np.tile(np.arange(self.num_draws), self.num_rows),
+            "value": self.values.reshape(-1),
+        }
+
+    def to_npz(self, path: Union[str, Path], layout: str = "long", compressed: bool = False):
+        """Write the table to a NumPy `.npz` archive.
+
+        In long layout the draws are written as the (rows x draws) `values` array alongside the
+        index columns, which label its rows, so the array is written as is.
+        """
+        if layout == "long":
+            columns = {**self.index, "values": self.values}
+        else:
+            columns = self._columns(layout)
+        if compressed:
+            np.savez_compressed(path, **columns)
+        else:
+            np.savez(path, **columns)
+
+    def to_arrow(self, layout: str = "long"):
+        """Convert the table to a `pyarrow.Table`. Numeric columns are passed to Arrow without
+        copying."""
+        pa = _import_pyarrow()
+        return pa.table({
+            name: pa.array(column) for name, column in self._columns(layout).items()
+        })
+
+    def to_parquet(self, path: Union[str, Path], layout: str = "long", **kwargs):
+        """Write the table to a Parquet file, passing `kwargs` to `pyarrow.parquet.write_table`."""
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(layout), str(path), **kwargs)
+
+    def _columns(self, layout: str) -> Dict[str, np.ndarray]:
+        if layout == "long":
+            return self.long()
+        elif layout == "summary":
+            return self.summary()
+        else:
+            raise Exception(f"Unrecognized layout {layout}, expected one of {LAYOUTS}")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            "Arrow and Parquet export require pyarrow, install it with `pip install pyarrow`"
+        )
+    return pyarrow
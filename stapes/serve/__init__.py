@@ -0,0 +1,3 @@
+from .cache import LruCache
+from .server import ModelServer, serve
+from .client import send_request, ServerError
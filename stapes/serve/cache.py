@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+import threading
+
+
+class LruCache(object):
+    """A thread-safe mapping that holds at most `max_entries` values, evicting the least
+    recently used one to make room for a new one."""
+    def __init__(self, max_entries: int):
+        if max_entries < 1:
+            raise Exception("A cache must hold at least one entry")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        """The cached value for `key`, calling `create` to make it on a miss. `create` runs
+        outside the lock, so slow values don't hold up other requests."""
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def evict(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def keys(self) -> List[Hashable]:
+        """Cached keys, from least to most recently used."""
+        with self._lock:
+            return list(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
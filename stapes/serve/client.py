@@ -0,0 +1,110 @@
+# Client for a running `stapes serve` process. It only uses the standard library and doesn't
+# import the rest of Stapes, so running it as a plain script, as in
+# `python stapes/serve/client.py <socket> ping`, or a copy of it, keeps the latency of a request
+# down to interpreter startup plus the work the server does. `python -m stapes client` imports
+# the whole package first.
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import socket
+import sys
+
+
+class ServerError(Exception):
+    pass
+
+
+def send_request(socket_path: str, command: str, timeout: Optional[float] = None, **params):
+    """Send one request to the server at `socket_path` and return its response, raising
+    `ServerError` if the request failed."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(socket_path))
+        sock.sendall((json.dumps({"command": command, **params}) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as infile:
+            line = infile.readline()
+    if not line:
+        raise ServerError("The server closed the connection without responding")
+    response = json.loads(line)
+    if not response.pop("ok", False):
+        raise ServerError(response.get("error", "Unknown error"))
+    return response
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Send a request to a running `stapes serve` process and print the response.",
+    )
+    parser.add_argument("socket", help="Unix socket the server listens on")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ping", help="Check that the server is up")
+    commands.add_parser("status", help="List cached models and fits")
+    commands.add_parser("shutdown", help="Stop the server")
+
+    fit = commands.add_parser("fit", help="Fit a model and keep the fit in memory")
+    fit.add_argument("--model", required=True, help="File with the model's Stapes source")
+    fit.add_argument("--data", required=True, help="Long-format CSV of training data")
+    fit.add_argument("--config", default="{}", help="Configuration as a JSON object")
+    fit.add_argument("--seed", type=int)
+    fit.add_argument("--backend", default="stan")
+    fit.add_argument("--fit-kwargs", default="{}", help="Extra `fit` arguments as JSON")
+    fit.add_argument("--save-to", help="Also save the fitted model to this file")
+
+    load = commands.add_parser("load", help="Load a saved fitted model into memory")
+    load.add_argument("path")
+
+    predict = commands.add_parser("predict", help="Predict cells with a fit in memory")
+    target = predict.add_mutually_exclusive_group(required=True)
+    target.add_argument("--fit-id")
+    target.add_argument("--model-file", help="Saved fitted model, loaded if it isn't cached")
+    predict.add_argument("--data", required=True, help="Long-format CSV of the cells to predict")
+    predict.add_argument("--seed", type=int)
+    predict.add_argument("--output", help="Write the draws to this .npz file")
+    predict.add_argument("--layout", default="long", help="Layout of the output file")
+
+    evict = commands.add_parser("evict", help="Drop a fit from memory")
+    evict.add_argument("fit_id")
+
+    args = parser.parse_args(argv)
+    params: Dict[str, Any] = {}
+    if args.command == "fit":
+        params = {
+            "model_text": Path(args.model).read_text(),
+            "data_file": _absolute(args.data),
+            "config": json.loads(args.config),
+            "seed": args.seed,
+            "backend": args.backend,
+            "fit_kwargs": json.loads(args.fit_kwargs),
+            "save_to": _absolute(args.save_to),
+        }
+    elif args.command == "load":
+        params = {"path": _absolute(args.path)}
+    elif args.command == "predict":
+        params = {
+            "fit_id": args.fit_id,
+            "model_file": _absolute(args.model_file),
+            "data_file": _absolute(args.data),
+            "seed": args.seed,
+            "output_file": _absolute(args.output),
+            "layout": args.layout,
+        }
+    elif args.command == "evict":
+        params = {"fit_id": args.fit_id}
+
+    try:
+        response = send_request(args.socket, args.command, **params)
+    except (ServerError, OSError) as e:
+        print(f"{e.__class__.__name__}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response, indent=2))
+
+
+def _absolute(path: Optional[str]) -> Optional[str]:
+    # The server has its own working directory, so paths are sent resolved
+    return str(Path(path).resolve()) if path is not None else None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ..backtest import frame_to_data
+from ..backtest.splits import CELL_COLUMNS
+from ..data import DataCoords
+from ..model import Model, FittedModel, build_model, load_model
+from ..results import DEFAULT_QUANTILES
+from ..workqueue import FitJob
+from .cache import LruCache
+
+Handler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class ModelServer(object):
+    """Answers fit and predict requests against models and fits kept in memory.
+
+    Built models are cached by their source text, and fits by an id returned when they're made
+    or loaded; the least recently used are evicted once there are more than `max_models` or
+    `max_fits`. Compiled executables are cached on disk by the content of their program, so a
+    cached model finds its executable without recompiling. Requests may be handled from many
+    threads at once, since fitting never changes a model and fitted models are read-only.
+    """
+    def __init__(self, max_models: int = 32, max_fits: int = 8):
+        self.models = LruCache(max_models)
+        self.fits = LruCache(max_fits)
+        self.handlers: Dict[str, Handler] = {
+            "ping": self._ping,
+            "status": self._status,
+            "fit": self._fit,
+            "load": self._load,
+            "predict": self._predict,
+            "evict": self._evict,
+        }
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Answer one request, reporting failures in the response instead of raising."""
+        params = dict(request)
+        command = params.pop("command", None)
+        try:
+            if command not in self.handlers:
+                raise Exception(f"Unrecognized command {command}")
+            return {"ok": True, **self.handlers[command](params)}
+        except Exception as e:
+            return {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+
+    def model(self, model_text: str) -> Model:
+        return self.models.get_or_create(_digest(model_text), lambda: build_model(model_text))
+
+    def fitted_model(
+        self, fit_id: Optional[str] = None, model_file: Optional[str] = None
+    ) -> FittedModel:
+        """A fit in memory, by id, or a saved fitted model, loading it on a miss."""
+        if model_file is not None:
+            return self.fits.get_or_create(
+                _saved_fit_id(model_file), lambda: load_model(model_file)
+            )
+        fitted = self.fits.get(fit_id)
+        if fitted is None:
+            raise KeyError(f"No fit {fit_id} in memory")
+        return fitted
+
+    def _ping(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"pid": os.getpid()}
+
+    def _status(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "models": {
+                "count": len(self.models), "hits": self.models.hits, "misses": self.models.misses
+            },
+            "fits": {"ids": self.fits.keys(), "hits": self.fits.hits, "misses": self.fits.misses},
+        }
+
+    def _fit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Fit a model to a CSV of training data, taking the fields of a work queue `FitJob`.
+        Identical requests against unchanged data share one fit."""
+        save_to = params.pop("save_to", None)
+        job = FitJob(**params)
+        fit_id = _digest(json.dumps({
+            "job": job.to_json(),
+            "data": _file_version(job.data_file),
+        }))
+        fitted = self.fits.get(fit_id)
+        is_cached = fitted is not None
+        if fitted is None:
+            fit_kwargs = dict(job.fit_kwargs)
+            if job.seed is not None:
+                fit_kwargs["seed"] = job.seed
+            fitted = self.model(job.model_text).fit(
+                job.load_data(), job.config, backend=job.backend, **fit_kwargs
+            )
+            self.fits.put(fit_id, fitted)
+        if save_to is not None:
+            fitted.save(save_to)
+        return {"fit_id": fit_id, "cached": is_cached}
+
+    def _load(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        fit_id = _saved_fit_id(params["path"])
+        is_cached = self.fits.get(fit_id) is not None
+        self.fitted_model(model_file=params["path"])
+        return {"fit_id": fit_id, "cached": is_cached}
+
+    def _predict(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Predict every response of the fit in the cells of a CSV, reading the other variables
+        from it. Returns a summary of each cell, or writes the draws to `output_file`."""
+        fitted = self.fitted_model(params.get("fit_id"), params.get("model_file"))
+        pred_coords, pred_data = _prediction_cells(
+            params["data_file"], list(fitted.likelihoods), params.get("variables")
+        )
+        result = fitted.predict(pred_coords, pred_data, seed=params.get("seed"))
+        output_file = params.get("output_file")
+        if output_file is not None:
+            result.to_npz(output_file, layout=params.get("layout", "long"))
+            return {"output_file": output_file, "num_rows": result.num_rows}
+        quantiles = params.get("quantiles", DEFAULT_QUANTILES)
+        return {"summary": _to_json(result.summary(quantiles))}
+
+    def _evict(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"evicted": self.fits.evict(params["fit_id"])}
+
+
+def serve(socket_path: Union[str, Path], max_models: int = 32, max_fits: int = 8):
+    """Serve requests on a Unix socket until a `shutdown` request arrives.
+
+    Each request and response is one line of JSON. A connection may send any number of
+    requests, and connections are handled concurrently.
+    """
+    socket_path = Path(socket_path)
+    if socket_path.exists():
+        if _is_listening(socket_path):
+            raise Exception(f"A server is already listening on {socket_path}")
+        socket_path.unlink()
+
+    model_server = ModelServer(max_models, max_fits)
+
+    class _RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {"ok": False, "error": f"Malformed request: {e}"}
+                else:
+                    if request.get("command") == "shutdown":
+                        self._respond({"ok": True})
+                        # Shutting down waits for the serving loop, so it can't block this thread
+                        threading.Thread(target=self.server.shutdown).start()
+                        return
+                    response = model_server.handle(request)
+                self._respond(response)
+
+        def _respond(self, response: Dict[str, Any]):
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+    class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    with _Server(str(socket_path), _RequestHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def _prediction_cells(
+    data_file: str, responses: List[str], variables: Optional[Sequence[str]] = None
+):
+    # The example data starts with a byte order mark, which `utf-8-sig` skips
+    frame = pd.read_csv(data_file, encoding="utf-8-sig")
+    cells = frame[CELL_COLUMNS].drop_duplicates()
+    pred_coords: List[DataCoords] = [
+        (name, int(tri_id), int(exp_id), int(dev_id))
+        for name in responses
+        for tri_id, exp_id, dev_id in cells.itertuples(index=False)
+    ]
+    inputs = variables or [
+        column for column in frame.columns
+        if column not in CELL_COLUMNS + ["CalendarId"] + responses
+    ]
+    return pred_coords, frame_to_data(frame, inputs)
+
+
+def _to_json(columns: Dict[str, np.ndarray]) -> Dict[str, list]:
+    return {name: np.asarray(values).tolist() for name, values in columns.items()}
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _file_version(path: str) -> List[Any]:
+    # Changing a file changes its size or modification time, and so the ids of fits made from it
+    stat = os.stat(path)
+    return [str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+def _saved_fit_id(path: str) -> str:
+    return "saved-" + _digest(json.dumps(_file_version(path)))
+
+
+def _is_listening(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
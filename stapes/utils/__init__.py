@@ -1,5 +1,7 @@
-from .stan import StanCode
+from .stan import StanCode, StanCodeBuilder, bake_constants, add_profiles, check_data_constraints
 from .config_parameter import ConfigParameter
 from .data_type import DataType, get_data_type
 from .stem import StanStem, process_stem
 from .functions import UTIL_FUNCTIONS
+from .samples import demunge_samples, munge_samples
+from .densities import normal_lpdf, cauchy_lpdf, sum_per_draw
@@ -1,6 +1,5 @@
 from dataclasses import dataclass
 from typing import Callable, Optional
-import math
 
 from .data_type import DataType
 
@@ -19,8 +18,8 @@ class ConfigParameter(object):
 
     @property
     def min_value(self) -> float:
-        return -math.inf
+        return self.data_type.min_value
 
     @property
     def max_value(self) -> float:
-        return math.inf
+        return self.data_type.max_value
@@ -5,6 +5,10 @@ from dataclasses import dataclass
 import numpy as np
 
 
+def _identity(x):
+    return x
+
+
 def _logit(x):
     return np.log(x / (1 - x))
 
@@ -51,15 +55,15 @@ _DATA_TYPE_DEFS = [
         name="real",
         stan_dtype="real",
         transform="",
-        transform_fn=lambda x: x,
-        inv_transform=lambda x: x,
+        transform_fn=_identity,
+        inv_transform=_identity,
     ),
     DataType(
         name="scale",
         stan_dtype="real<lower=0>",
         transform="",
-        transform_fn=lambda x: x,
-        inv_transform=lambda x: x,
+        transform_fn=_identity,
+        inv_transform=_identity,
         min_value=0,
         base_default_value=1,
     ),
@@ -76,8 +80,8 @@ _DATA_TYPE_DEFS = [
         name="int",
         stan_dtype="int<lower=1>",
         transform="",
-        transform_fn=lambda x: x,
-        inv_transform=lambda x: x,
+        transform_fn=_identity,
+        inv_transform=_identity,
         min_value=1,
         max_value=999_999,
     )
@@ -36,5 +36,50 @@ functions {
 
         return log_lik;
     }
+
+    /* Summed log-likelihood for a single family, vectorized over cells. These are used when
+     * the family is fixed when the program is generated, and match mean_variance_log_lik. */
+    real mean_variance_normal_lpdf(array[] real obs, array[] real obs_mean, array[] real obs_variance) {
+        return normal_lpdf(obs | obs_mean, sqrt(to_vector(obs_variance)));
+    }
+
+    real mean_variance_lognormal_lpdf(array[] real obs, array[] real obs_mean, array[] real obs_variance) {
+        vector[size(obs)] mean_sq = square(to_vector(obs_mean));
+        vector[size(obs)] variance = to_vector(obs_variance);
+        return lognormal_lpdf(obs | log(mean_sq ./ sqrt(mean_sq + variance)), sqrt(log1p(variance ./ mean_sq)));
+    }
+
+    real mean_variance_gamma_lpdf(array[] real obs, array[] real obs_mean, array[] real obs_variance) {
+        vector[size(obs)] obs_mean_vec = to_vector(obs_mean);
+        vector[size(obs)] variance = to_vector(obs_variance);
+        return gamma_lpdf(obs | square(obs_mean_vec) ./ variance, obs_mean_vec ./ variance);
+    }
+
+    real mean_variance_rng(real obs_mean, real obs_variance, int family) {
+        real draw;
+
+        if (family == 1) {
+            /* Family 1 is normal. */
+            draw = normal_rng(obs_mean, sqrt(obs_variance));
+        } else if (family == 2) {
+            /* Family 2 is log-normal. */
+            draw = lognormal_rng(
+                log(obs_mean ^ 2 / sqrt(obs_mean ^ 2 + obs_variance)),
+                sqrt(log(1 + obs_variance / obs_mean ^ 2))
+            );
+        } else if (family == 3) {
+            /* Family 3 is gamma. Means too close to zero have a point mass at zero. */
+            if (obs_mean < 1e-8) {
+                draw = 0;
+            } else {
+                draw = gamma_rng(obs_mean ^ 2 / obs_variance, obs_mean / obs_variance);
+            }
+        } else {
+            reject("Positive variables modeled with mean and variance are not compatible with family=", family);
+        }
+
+        /* Predictions are floored at a small positive value, so they can be offset targets. */
+        return fmax(draw, 1e-4);
+    }
 }
 """
@@ -0,0 +1,35 @@
+from typing import Dict
+
+import numpy as np
+
+
+def demunge_samples(namespace: str, samples: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Pick out the samples belonging to a namespace and strip the namespace from their names.
+
+    The Stan variable named exactly `namespace` maps to `..`, and variables named
+    `<namespace>__<suffix>` map to `.<suffix>`. Everything else is dropped.
+    """
+
+    def _demunge_name(name: str) -> str:
+        if name == namespace:
+            return ".."
+        dundered_name = f"{namespace}__"
+        dundered_len = len(dundered_name)
+        if name[:dundered_len] == dundered_name:
+            return "." + name[dundered_len:]
+        else:
+            return name
+
+    return {
+        _demunge_name(name): value
+        for name, value in samples.items()
+        if _demunge_name(name)[0] == "."
+    }
+
+
+def munge_samples(namespace: str, samples: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Inverse of `demunge_samples`: map `..` and `.<suffix>` names back to Stan names."""
+    return {
+        namespace if name == ".." else f"{namespace}__{name[1:]}": value
+        for name, value in samples.items()
+    }
@@ -1,5 +1,9 @@
+from dataclasses import dataclass, fields, replace
+from typing import Any, Callable, Dict, List, Optional
+import math
 import re
-from dataclasses import dataclass
+
+import numpy as np
 
 
 @dataclass
@@ -26,38 +30,226 @@ class StanCode(object):
     trans_def: str = ""
     model_decl: str = ""
     model_def: str = ""
+    gq_decl: str = ""
+    gq_def: str = ""
 
     def __add__(self, other: "StanCode") -> "StanCode":
         """Concatenate two StanCode fragments."""
         # Special case for StanCode + 0.
         if isinstance(other, int):
             return self
-        return StanCode(
-            data=self.data + other.data,
-            trans_data_decl=self.trans_data_decl + other.trans_data_decl,
-            trans_data_def=self.trans_data_def +other.trans_data_def,
-            param_decl=self.param_decl + other.param_decl,
-            trans_decl=self.trans_decl + other.trans_decl,
-            trans_def=self.trans_def + other.trans_def,
-            model_decl=self.model_decl + other.model_decl,
-            model_def=self.model_def + other.model_def,
-        )
+        return StanCodeBuilder().add(self).add(other).build()
 
     def __radd__(self, other: "StanCode") -> "StanCode":
         return other + self
 
     def __str__(self) -> str:
         """Convert a StanCode object to a string representation of a legal Stan program."""
-        # fmt: off
-        raw_join = "\n".join([
-            "data {", self.data, "}\n\n",
-            "transformed data {", self.trans_data_decl, "    real delta = 1e-8;", "\n",
-            self.trans_data_def, "}\n",
-            "parameters {", self.param_decl, "}\n",
-            "transformed parameters {", self.trans_decl, "\n", self.trans_def, "}\n",
-            "model {", self.model_decl, "\n", self.model_def, "}\n",
+        blocks = [
+            ("data", [self.data]),
+            ("transformed data", [self.trans_data_decl, "real delta = 1e-8;", self.trans_data_def]),
+            ("parameters", [self.param_decl]),
+            ("transformed parameters", [self.trans_decl, self.trans_def]),
+            ("model", [self.model_decl, self.model_def]),
+        ]
+        # Generated quantities are optional, and only used for posterior prediction
+        if self.gq_decl or self.gq_def:
+            blocks.append(("generated quantities", [self.gq_decl, self.gq_def]))
+        return "\n".join([
+            name + " {\n" + "\n\n".join([part for part in parts if part]) + "\n}\n"
+            for name, parts in blocks
         ])
-        # fmt: on
-        # Remove sequences of 3 or more consecutive newlines
-        no_triples = re.sub("\n{3,}", "\n\n", raw_join)
-        return no_triples
+
+
+STAN_CODE_FIELDS = [code_field.name for code_field in fields(StanCode)]
+
+
+class StanCodeBuilder(object):
+    """Accumulates StanCode fragments and joins each block only once.
+
+    Summing many StanCode objects copies every block string on each addition, which is
+    quadratic in the size of the program. The builder keeps a list of fragments per block
+    instead, preserving the order in which fragments were added.
+    """
+
+    def __init__(self):
+        self.fragments: Dict[str, List[str]] = {name: [] for name in STAN_CODE_FIELDS}
+
+    def add(self, code: StanCode) -> "StanCodeBuilder":
+        """Append a StanCode fragment to each of the blocks it contributes to."""
+        for name, block_fragments in self.fragments.items():
+            fragment = getattr(code, name)
+            if fragment:
+                block_fragments.append(fragment)
+        return self
+
+    def __iadd__(self, code: StanCode) -> "StanCodeBuilder":
+        return self.add(code)
+
+    def build(self) -> StanCode:
+        return StanCode(**{
+            name: "\n".join(block_fragments) for name, block_fragments in self.fragments.items()
+        })
+
+
+# A data block declaration without a definition: "<type> <name>;"
+DATA_DECLARATION = re.compile(r"^(\S.*)\s+([A-Za-z][A-Za-z0-9_]*);$")
+
+
+def bake_constants(code: StanCode, values: Dict[str, Any]) -> StanCode:
+    """Turn the named data variables into constants of the Stan program.
+
+    Each declaration is moved from the data block to the front of transformed data and defined
+    as a literal, keeping its type and bounds, so the rest of the program reads it unchanged but
+    the compiler sees a fixed value.
+    """
+    data_lines = []
+    constant_lines = []
+    found = set()
+    for line in code.data.split("\n"):
+        match = DATA_DECLARATION.match(line.strip())
+        if match and match.group(2) in values:
+            stan_dtype, name = match.groups()
+            literal = _stan_literal(values[name], stan_dtype)
+            constant_lines.append(f"{stan_dtype} {name} = {literal};")
+            found.add(name)
+        else:
+            data_lines.append(line)
+
+    if found != set(values):
+        missing = ", ".join(sorted(set(values) - found))
+        raise Exception(f"Cannot make {missing} constant, since it isn't declared as data")
+
+    trans_data_lines = constant_lines + ([code.trans_data_decl] if code.trans_data_decl else [])
+    return replace(
+        code, data="\n".join(data_lines), trans_data_decl="\n".join(trans_data_lines)
+    )
+
+
+# The parts of a declared data type: "array[<sizes>] <int|real><<bounds>>"
+DECLARED_TYPE = re.compile(
+    r"^(?:array\[(?P<sizes>[^\]]*)\]\s*)?(?P<base>int|real)(?:<(?P<bounds>[^>]*)>)?$"
+)
+# Sizes and bounds are data names, integer literals, or one of them plus or minus another
+SIZE_EXPRESSION = re.compile(r"^(\w+)(?:\s*([-+])\s*(\w+))?$")
+
+
+def check_data_constraints(
+    code: StanCode,
+    data: Dict[str, Any],
+    describe: Optional[Callable[[str, int], Optional[str]]] = None,
+) -> List[str]:
+    """Check data against the sizes, types and bounds declared in the program's data block,
+    as CmdStan does when it reads the data, without compiling anything.
+
+    Returns a description of each problem. `describe` may name the element at an index of an
+    array whose first size is the given expression, such as the cell behind an index into `T`.
+    Declarations whose sizes or bounds aren't simple expressions of other data are only
+    checked as far as they can be.
+    """
+    problems = []
+    for line in code.data.split("\n"):
+        match = DATA_DECLARATION.match(line.strip())
+        type_match = DECLARED_TYPE.match(match.group(1).strip()) if match else None
+        if type_match is None:
+            continue
+        name = match.group(2)
+        if name not in data:
+            problems.append(f"Data {name} is missing")
+            continue
+
+        values = np.asarray(data[name])
+        size_exprs = [
+            expr.strip() for expr in (type_match.group("sizes") or "").split(",") if expr.strip()
+        ]
+        sizes = [_evaluate_size(expr, data) for expr in size_exprs]
+        if values.ndim != len(sizes) or any([
+            size is not None and size != actual for size, actual in zip(sizes, values.shape)
+        ]):
+            expected = ", ".join([
+                expr if size is None else str(size) for expr, size in zip(size_exprs, sizes)
+            ])
+            problems.append(f"Data {name} should have shape ({expected}), not {values.shape}")
+            continue
+
+        if type_match.group("base") == "int" and not np.all(np.mod(values, 1) == 0):
+            problems.append(f"Data {name} must be integer-valued")
+            continue
+
+        for bound in (type_match.group("bounds") or "").split(","):
+            if "=" not in bound:
+                continue
+            kind, expr = [part.strip() for part in bound.split("=", 1)]
+            limit = _evaluate_size(expr, data)
+            if limit is None:
+                continue
+            # Comparisons with NaN are false, so NaN values fail either bound, like in Stan
+            is_valid = values >= limit if kind == "lower" else values <= limit
+            invalid = np.flatnonzero(~np.asarray(is_valid))
+            if invalid.size == 0:
+                continue
+            first = int(invalid[0])
+            where = describe(size_exprs[0], first) if describe and size_exprs else None
+            bound_text = expr if expr == str(limit) else f"{expr} ({limit})"
+            relation = "at least" if kind == "lower" else "at most"
+            if values.ndim == 0:
+                problems.append(f"Data {name} must be {relation} {bound_text}, not {values}")
+            else:
+                problems.append(
+                    f"Data {name} must be {relation} {bound_text}, but has {invalid.size} of "
+                    f"{values.size} values outside that bound; the first is "
+                    f"{values.flat[first]} at " + (where or f"index {first + 1}")
+                )
+    return problems
+
+
+def _evaluate_size(expr: str, data: Dict[str, Any]) -> Optional[float]:
+    match = SIZE_EXPRESSION.match(expr)
+    if match is None:
+        return None
+    left, op, right = match.groups()
+    values = [_evaluate_term(left, data)] + ([_evaluate_term(right, data)] if op else [])
+    if any([value is None for value in values]):
+        return None
+    if op is None:
+        return values[0]
+    return values[0] - values[1] if op == "-" else values[0] + values[1]
+
+
+def _evaluate_term(term: str, data: Dict[str, Any]) -> Optional[float]:
+    if re.match(r"^[0-9]+$", term):
+        return int(term)
+    if term in data and np.ndim(data[term]) == 0:
+        return data[term]
+    return None
+
+
+def _stan_literal(value: Any, stan_dtype: str) -> str:
+    if stan_dtype.startswith("int"):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "not_a_number()"
+    elif math.isinf(value):
+        return "positive_infinity()" if value > 0 else "negative_infinity()"
+    return repr(value)
+
+
+def add_profiles(code: StanCode, name: str) -> StanCode:
+    """Wrap the statements of the transformed parameters and model blocks in Stan `profile`
+    blocks named `<name>:<block>`, so CmdStan times each separately.
+
+    A profile block is its own scope, which suits stem definitions: any declarations in them
+    already belong to nested blocks.
+    """
+    return replace(
+        code,
+        trans_def=_profile_block(code.trans_def, f"{name}:transformed_parameters"),
+        model_def=_profile_block(code.model_def, f"{name}:model"),
+    )
+
+
+def _profile_block(statements: str, name: str) -> str:
+    if not statements:
+        return statements
+    return f'profile("{name}") {{\n{statements}\n}}'
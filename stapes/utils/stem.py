@@ -145,6 +145,7 @@ _CONTEXT_MAP = {
     "parameters {": "param_decl",
     "transformed parameters {": "trans_decl",
     "model {": "model_decl",
+    "generated quantities {": "gq_decl",
     "}": None,
 }
 
@@ -153,6 +154,7 @@ _CONDITIONAL_CONTEXT_MAP = {
     ("trans_data_decl", "// !definitions"): "trans_data_def",
     ("trans_decl", "// !definitions"): "trans_def",
     ("model_decl", "// !definitions"): "model_def",
+    ("gq_decl", "// !definitions"): "gq_def",
 }
 
 
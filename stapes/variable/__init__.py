@@ -1 +1,6 @@
-from .variable import get_variable_stan
+from .variable import (
+    get_variable_stan,
+    variable_unconstrained_shapes,
+    constrain_variable,
+    variable_log_prior,
+)
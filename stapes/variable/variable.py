@@ -1,10 +1,13 @@
 from pathlib import Path
+from typing import Dict, Any, Tuple
 
-from ..utils import process_stem, StanStem
+import numpy as np
+
+from ..utils import process_stem, StanStem, normal_lpdf
 
 
 def get_variable_stan(name: str) -> StanStem:
-    if name[-2:] == "Id":
+    if _is_coordinate(name):
         return process_stem(
             Path(__file__).resolve().parent / "coordinate.stem",
             name,
@@ -16,3 +19,48 @@ def get_variable_stan(name: str) -> StanStem:
             name,
             {}
         )
+
+
+def variable_unconstrained_shapes(
+    name: str, stan_data: Dict[str, Any]
+) -> Dict[str, Tuple[int, ...]]:
+    """Shapes of the imputation parameters for a variable, keyed by demunged name."""
+    if _is_coordinate(name):
+        return {}
+    return {".raw_missing_values": (stan_data[f"{name}__num_missing"],)}
+
+
+def constrain_variable(
+    name: str,
+    unconstrained: Dict[str, np.ndarray],
+    stan_data: Dict[str, Any],
+) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """Fill in imputed values for a variable, mirroring `variable.stem`.
+
+    Returns demunged samples with the (draws x T) variable under `..`, along with the per-draw
+    log Jacobian (always zero, since the imputation parameters are unconstrained).
+    """
+    if _is_coordinate(name):
+        return {}, 0.0
+    raw_missing = unconstrained[".raw_missing_values"]
+    values = np.tile(np.asarray(stan_data[f"{name}__raw"], dtype=float), (raw_missing.shape[0], 1))
+    values[:, np.asarray(stan_data[f"{name}__missing_ids"], dtype=int) - 1] = np.exp(raw_missing)
+    samples = {".raw_missing_values": raw_missing, "..": values}
+    return samples, np.zeros(raw_missing.shape[0])
+
+
+def variable_log_prior(
+    name: str,
+    samples: Dict[str, np.ndarray],
+    config: Dict[str, float],
+) -> np.ndarray:
+    """Per-draw log prior density of a variable's imputed values, up to a constant."""
+    if _is_coordinate(name):
+        return 0.0
+    return normal_lpdf(
+        samples[".raw_missing_values"], config[".missing_loc"], config[".missing_scale"]
+    )
+
+
+def _is_coordinate(name: str) -> bool:
+    return name[-2:] == "Id"
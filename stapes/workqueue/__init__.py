@@ -0,0 +1,3 @@
+from .jobs import FitJob
+from .queue import FileQueue, Lease
+from .worker import run_worker, run_local_workers
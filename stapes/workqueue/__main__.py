@@ -0,0 +1,32 @@
+import argparse
+
+from .worker import run_worker, run_local_workers
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m stapes.workqueue",
+        description="Fit jobs from a Stapes work queue directory.",
+    )
+    parser.add_argument("root", help="Directory of the work queue")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes to run")
+    parser.add_argument("--lease-seconds", type=float, default=600.0)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--exit-when-empty", action="store_true", help="Stop once there's no work left"
+    )
+    args = parser.parse_args()
+
+    kwargs = {
+        "lease_seconds": args.lease_seconds,
+        "poll_interval": args.poll_interval,
+        "exit_when_empty": args.exit_when_empty,
+    }
+    if args.workers == 1:
+        run_worker(args.root, **kwargs)
+    else:
+        run_local_workers(args.root, args.workers, **kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+import json
+
+import pandas as pd
+
+from ..backtest import frame_to_data
+from ..backtest.splits import CELL_COLUMNS
+from ..data import DataCoords
+
+
+@dataclass
+class FitJob(object):
+    """A request to fit a model, as stored in a work queue.
+
+    Fields:
+        model_text: Stapes source code of the model.
+        data_file: Long-format CSV of training data with one row per cell, like
+            `examples/example_triangles.csv`. It must be readable by every worker.
+        config: Configuration to fit the model with.
+        seed: Random seed for the fit.
+        backend: The `Model.fit` backend, "stan" or "map".
+        variables: Columns of the data file to use as variables. By default, every column but
+            the cell and calendar period ids.
+        fit_kwargs: Additional keyword arguments for `Model.fit`.
+        job_id: Identifier assigned by the queue on submission.
+        attempts: How many times the job has been leased.
+        max_attempts: How many times the job may be leased before it's given up on. Set by the
+            queue on submission if not given.
+        last_error: Why the previous attempt failed, if it did.
+    """
+
+    model_text: str
+    data_file: str
+    config: Dict[str, Any] = field(default_factory=dict)
+    seed: Optional[int] = None
+    backend: str = "stan"
+    variables: Optional[List[str]] = None
+    fit_kwargs: Dict[str, Any] = field(default_factory=dict)
+    job_id: Optional[str] = None
+    attempts: int = 0
+    max_attempts: Optional[int] = None
+    last_error: Optional[str] = None
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str) -> "FitJob":
+        return cls(**json.loads(text))
+
+    def load_data(self) -> Dict[DataCoords, float]:
+        """Read the job's training data."""
+        # The example data starts with a byte order mark, which `utf-8-sig` skips
+        frame = pd.read_csv(self.data_file, encoding="utf-8-sig")
+        variables = self.variables or [
+            column for column in frame.columns if column not in CELL_COLUMNS + ["CalendarId"]
+        ]
+        return frame_to_data(frame, variables)
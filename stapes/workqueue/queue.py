@@ -0,0 +1,176 @@
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from ..model import FittedModel, load_model
+from .jobs import FitJob
+
+QUEUE_STATES = ["pending", "leased", "done", "failed"]
+
+# Leased job files are named "<job id>__<worker id>.json", so the owner of a lease can be read
+# from the directory listing
+LEASE_SEPARATOR = "__"
+
+
+@dataclass
+class Lease(object):
+    """A worker's claim on a job.
+
+    Fields:
+        job: The leased job.
+        worker_id: The worker holding the lease.
+        path: The leased job file. Its modification time is the last time the lease was renewed.
+    """
+
+    job: FitJob
+    worker_id: str
+    path: Path
+
+
+class FileQueue(object):
+    """A queue of fit jobs kept in a directory, which may be on a shared filesystem.
+
+    Each job is a JSON file that moves between the `pending`, `leased`, `done` and `failed`
+    subdirectories. Every transition is a rename, which is atomic, so any number of workers on
+    any number of hosts can share the queue without a server or locks: whichever worker renames
+    a file first owns it. Fitted models are saved to the `models` subdirectory.
+
+    A lease lasts until its holder stops renewing it. Jobs whose leases have expired (because
+    their worker died, say) go back to pending, and jobs that have been leased `max_attempts`
+    times without finishing are moved to failed. The limit is stored with each job when it's
+    submitted, so workers don't need to agree on it.
+    """
+
+    def __init__(self, root: Union[str, Path], max_attempts: int = 3):
+        self.root = Path(root)
+        self.max_attempts = max_attempts
+        for state in QUEUE_STATES + ["models"]:
+            (self.root / state).mkdir(parents=True, exist_ok=True)
+
+    def submit(self, job: FitJob) -> str:
+        """Add a job to the queue and return its id. Jobs are leased in submission order."""
+        job.job_id = job.job_id or f"{time.time_ns():016x}-{uuid.uuid4().hex[:8]}"
+        job.max_attempts = job.max_attempts or self.max_attempts
+        if LEASE_SEPARATOR in job.job_id:
+            raise Exception(f"Job ids can't contain {LEASE_SEPARATOR}")
+        _write_atomic(self.root / "pending" / f"{job.job_id}.json", job.to_json())
+        return job.job_id
+
+    def lease(self, worker_id: str) -> Optional[Lease]:
+        """Claim the oldest pending job for a worker, or return None if there are none."""
+        for pending_file in sorted((self.root / "pending").glob("*.json")):
+            lease_file = self.root / "leased" / (
+                f"{pending_file.stem}{LEASE_SEPARATOR}{worker_id}.json"
+            )
+            try:
+                # Refresh the timestamp first, so the new lease doesn't look expired
+                os.utime(pending_file)
+                os.rename(pending_file, lease_file)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+            job = FitJob.from_json(lease_file.read_text())
+            job.attempts += 1
+            _write_atomic(lease_file, job.to_json())
+            return Lease(job=job, worker_id=worker_id, path=lease_file)
+        return None
+
+    def renew(self, lease: Lease) -> bool:
+        """Extend a lease. Returns False if it has been lost."""
+        try:
+            os.utime(lease.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, lease: Lease, result: Dict[str, Any]) -> bool:
+        """Record a finished job along with `result`. Returns False, recording nothing, if the
+        lease has been lost (its job will be or has been run again)."""
+        claim_file = self._claim(lease)
+        if claim_file is None:
+            return False
+        record = {"job": json.loads(lease.job.to_json()), **result}
+        _write_atomic(self.root / "done" / f"{lease.job.job_id}.json", json.dumps(record))
+        claim_file.unlink()
+        return True
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        """Give up on a leased job. It's retried unless it has used up its attempts. Returns
+        False if the lease has been lost."""
+        claim_file = self._claim(lease)
+        if claim_file is None:
+            return False
+        self._retry_or_fail(lease.job, error)
+        claim_file.unlink()
+        return True
+
+    def requeue_expired(self, lease_seconds: float) -> List[str]:
+        """Return jobs whose leases haven't been renewed in `lease_seconds` to the queue, and
+        return their ids."""
+        requeued = []
+        cutoff = time.time() - lease_seconds
+        for lease_file in (self.root / "leased").glob("*.json"):
+            try:
+                if lease_file.stat().st_mtime >= cutoff:
+                    continue
+                job_id = lease_file.stem.split(LEASE_SEPARATOR, 1)[0]
+                claim_file = self.root / "leased" / f".{job_id}.expired"
+                os.rename(lease_file, claim_file)
+            except FileNotFoundError:
+                # Renewed, finished or requeued by someone else in the meantime
+                continue
+            job = FitJob.from_json(claim_file.read_text())
+            self._retry_or_fail(job, "Lease expired")
+            claim_file.unlink()
+            requeued.append(job_id)
+        return requeued
+
+    def status(self) -> Dict[str, int]:
+        """Number of jobs in each state."""
+        return {
+            state: len(list((self.root / state).glob("*.json"))) for state in QUEUE_STATES
+        }
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The record of a finished or failed job, or None if it's still in the queue."""
+        for state in ["done", "failed"]:
+            record_file = self.root / state / f"{job_id}.json"
+            if record_file.exists():
+                return {"state": state, **json.loads(record_file.read_text())}
+        return None
+
+    def model_file(self, job_id: str) -> Path:
+        return self.root / "models" / f"{job_id}.pkl"
+
+    def load_model(self, job_id: str) -> FittedModel:
+        """Load the fitted model saved by a finished job."""
+        return load_model(self.model_file(job_id))
+
+    def _claim(self, lease: Lease) -> Optional[Path]:
+        # Take the lease file out of circulation before acting on it, so an expiring lease can't
+        # be requeued at the same time
+        claim_file = lease.path.with_name(f".{lease.path.stem}.claim")
+        try:
+            os.rename(lease.path, claim_file)
+        except FileNotFoundError:
+            return None
+        return claim_file
+
+    def _retry_or_fail(self, job: FitJob, error: str):
+        job.last_error = error
+        if job.attempts < job.max_attempts:
+            _write_atomic(self.root / "pending" / f"{job.job_id}.json", job.to_json())
+        else:
+            record = {"job": json.loads(job.to_json()), "error": error}
+            _write_atomic(self.root / "failed" / f"{job.job_id}.json", json.dumps(record))
+
+
+def _write_atomic(path: Path, text: str):
+    # Write to a temporary name first so readers never see a partial file
+    tmp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_file.write_text(text)
+    os.replace(tmp_file, path)
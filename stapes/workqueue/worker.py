@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+from ..model import build_model
+from .queue import FileQueue, Lease, LEASE_SEPARATOR
+
+
+def run_worker(
+    root: Union[str, Path],
+    worker_id: Optional[str] = None,
+    lease_seconds: float = 600.0,
+    poll_interval: float = 1.0,
+    exit_when_empty: bool = False,
+    max_jobs: Optional[int] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> int:
+    """Fit jobs from the queue at `root` until stopped, returning the number completed.
+
+    The worker renews its lease in the background while a job runs, and requeues jobs whose
+    leases have expired before looking for new work. Each fitted model is saved to the queue's
+    `models` directory. With `exit_when_empty`, the worker stops once nothing is pending or
+    leased instead of polling for more jobs.
+
+    Compiled executables go to a cache of the worker's own, `cache_dir`, which defaults to a
+    directory on local disk named after the worker. It's set through `STAPES_CACHE_DIR`, so
+    this should be called in a process of its own.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    if LEASE_SEPARATOR in worker_id:
+        raise Exception(f"Worker ids can't contain {LEASE_SEPARATOR}")
+    cache_dir = cache_dir or Path(tempfile.gettempdir()) / "stapes-workers" / worker_id
+    os.environ["STAPES_CACHE_DIR"] = str(cache_dir)
+
+    queue = FileQueue(root)
+    num_completed = 0
+    while max_jobs is None or num_completed < max_jobs:
+        queue.requeue_expired(lease_seconds)
+        lease = queue.lease(worker_id)
+        if lease is None:
+            status = queue.status()
+            if exit_when_empty and status["pending"] == 0 and status["leased"] == 0:
+                break
+            time.sleep(poll_interval)
+            continue
+        if _run_job(queue, lease, lease_seconds):
+            num_completed += 1
+    return num_completed
+
+
+def run_local_workers(root: Union[str, Path], num_workers: int, **kwargs) -> List[int]:
+    """Run `num_workers` workers in separate processes on this host and wait for them to exit,
+    returning their exit codes. `kwargs` are passed on to `run_worker`."""
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(str(root),),
+            kwargs={"worker_id": f"{socket.gethostname()}-local{ndx}", **kwargs},
+        )
+        for ndx in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+def _run_job(queue: FileQueue, lease: Lease, lease_seconds: float) -> bool:
+    job = lease.job
+    stop_renewing = threading.Event()
+
+    def _renew():
+        while not stop_renewing.wait(lease_seconds / 3):
+            if not queue.renew(lease):
+                break
+
+    renewer = threading.Thread(target=_renew, daemon=True)
+    renewer.start()
+    error = None
+    try:
+        start = time.perf_counter()
+        model = build_model(job.model_text)
+        fit_kwargs = dict(job.fit_kwargs)
+        if job.seed is not None:
+            fit_kwargs["seed"] = job.seed
+        fitted = model.fit(job.load_data(), job.config, backend=job.backend, **fit_kwargs)
+        fit_time = time.perf_counter() - start
+
+        model_file = queue.model_file(job.job_id)
+        tmp_file = model_file.with_name(f".{model_file.name}.{os.getpid()}.tmp")
+        fitted.save(tmp_file)
+        os.replace(tmp_file, model_file)
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+    finally:
+        stop_renewing.set()
+        renewer.join()
+
+    if error is not None:
+        queue.fail(lease, error)
+        return False
+    return queue.complete(lease, {
+        "worker_id": lease.worker_id,
+        "model_file": str(model_file),
+        "fit_time": fit_time,
+    })